@@ -0,0 +1,114 @@
+# engine_benchmark.py - COMPARES THE THREAD AND ASYNCIO EXECUTION ENGINES
+#
+# For each engine and concurrency level, enqueues a batch of I/O-waiting jobs into
+# a scratch directory, runs `queuectl worker start` until every job has finished,
+# and reports jobs/sec plus the worker's peak RSS as JSON.
+#
+#   python benchmarks/engine_benchmark.py --jobs 1000 --levels 10,100,500
+import argparse
+import json
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+def ReadRssKb(pid):
+    """Current resident set size of a process in KiB, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+def CountFinished(dbPath):
+    conn = sqlite3.connect(dbPath)
+    try:
+        done = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'completed'").fetchone()[0]
+        dead = conn.execute("SELECT COUNT(*) FROM dlq").fetchone()[0]
+    finally:
+        conn.close()
+    return done + dead
+
+def MeasureSpan(dbPath):
+    """Seconds from the first job start to the last job finish, read from the job records."""
+    conn = sqlite3.connect(dbPath)
+    try:
+        rows = [json.loads(r[0]) for r in conn.execute("SELECT data FROM jobs WHERE state = 'completed'")]
+    finally:
+        conn.close()
+    return max(j['finished_at'] for j in rows) - min(j['started_at'] for j in rows)
+
+def RunCase(engine, concurrency, jobCount, command, timeout):
+    workDir = tempfile.mkdtemp(prefix='queuectl-bench-')
+    env = dict(os.environ, QUEUECTL_STORAGE='sqlite')
+    try:
+        jobLines = ''.join(json.dumps({'id': f'bench-{i}', 'command': command}) + '\n' for i in range(jobCount))
+        subprocess.run(['queuectl', 'enqueue', '--file', '-'], input=jobLines, text=True, cwd=workDir, env=env, check=True, capture_output=True)
+
+        if engine == 'asyncio':
+            workerArgs = ['--engine', 'asyncio', '--concurrency', str(concurrency)]
+        else:
+            workerArgs = ['--engine', 'thread', '--count', str(concurrency)]
+        worker = subprocess.Popen(
+            ['queuectl', 'worker', 'start'] + workerArgs,
+            cwd=workDir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+        dbPath = os.path.join(workDir, 'jobs_database.db')
+        peakRssKb = None
+        deadline = time.monotonic() + timeout
+        finished = 0
+        while time.monotonic() < deadline:
+            rss = ReadRssKb(worker.pid)
+            if rss is not None:
+                peakRssKb = max(peakRssKb or 0, rss)
+            finished = CountFinished(dbPath)
+            if finished >= jobCount:
+                break
+            time.sleep(0.1)
+
+        worker.send_signal(signal.SIGINT)
+        try:
+            worker.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            worker.kill()
+
+        span = MeasureSpan(dbPath) if finished else None
+        return {
+            'engine': engine,
+            'concurrency': concurrency,
+            'jobs': jobCount,
+            'finished': finished,
+            'seconds': round(span, 3) if span else None,
+            'jobs_per_sec': round(finished / span, 1) if span else None,
+            'peak_rss_kb': peakRssKb,
+        }
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+def Main():
+    parser = argparse.ArgumentParser(description='Compare the thread and asyncio execution engines.')
+    parser.add_argument('--jobs', type=int, default=500, help='Jobs per case.')
+    parser.add_argument('--levels', default='10,50,200', help='Comma-separated concurrency levels.')
+    parser.add_argument('--engines', default='thread,asyncio', help='Comma-separated engines to compare.')
+    parser.add_argument('--command', default='sleep 0.2', help='Shell command each job runs.')
+    parser.add_argument('--timeout', type=float, default=600, help='Give up on a case after this many seconds.')
+    args = parser.parse_args()
+
+    results = []
+    for level in (int(x) for x in args.levels.split(',')):
+        for engine in args.engines.split(','):
+            result = RunCase(engine, level, args.jobs, args.command, args.timeout)
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+    print(json.dumps({'benchmark': 'engines', 'command': args.command, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    Main()
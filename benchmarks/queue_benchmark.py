@@ -0,0 +1,273 @@
+# queue_benchmark.py - REPRODUCIBLE THROUGHPUT AND LATENCY NUMBERS FOR THE WHOLE QUEUE
+#
+# Runs entirely locally, in scratch directories, against each storage engine:
+#
+#   enqueue_single   JobManager.CreateJob one job at a time (jobs/sec, latency)
+#   enqueue_bulk     JobManager.CreateJobs filling the queue to each --sizes value
+#   claim            FindAndLockPending(1) on a queue of that size, straight from
+#                    storage and through the workers' ReadyIndex
+#   status           CountByState, as `queuectl status` runs it
+#   dashboard        the page shell and its JSON API, through Flask's test client
+#   end_to_end       `queuectl worker start --count N` draining no-op jobs, per --workers value
+#
+# Prints one JSON document. Save it with --output and pass it to --compare on a
+# later run to list every metric that moved by more than --threshold percent;
+# the exit status is 1 if any of them got worse.
+#
+#   python benchmarks/queue_benchmark.py --sizes 1000,10000,100000 --workers 1,4,16,64 --output before.json
+#   python benchmarks/queue_benchmark.py --sizes 1000,10000,100000 --workers 1,4,16,64 --compare before.json
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# EVERY JOB RUNS THIS, SO END-TO-END NUMBERS MEASURE THE QUEUE AND NOT THE COMMANDS
+NOOP_COMMAND = 'true'
+
+DASHBOARD_URLS = {
+    'page': '/',
+    'summary': '/api/summary',
+    'jobs_page': '/api/jobs?state=pending&sort=priority&order=asc',
+    'changes': '/api/changes?since=0',
+}
+
+def Percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] if ordered else None
+
+def LatencySummary(latencies):
+    """p50/p99/max of a list of seconds, in milliseconds."""
+    if not latencies:
+        return {}
+    return {
+        'p50_ms': round(Percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(Percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+    }
+
+def TimeCalls(function, samples):
+    latencies = []
+    for _ in range(samples):
+        startTime = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - startTime)
+    return latencies
+
+def JobLines(count, prefix):
+    # ZERO-PADDED IDS KEEP id ORDER EQUAL TO INSERTION ORDER; PRIORITIES SPREAD THE CLAIM INDEX
+    for i in range(count):
+        yield json.dumps({'id': f'{prefix}-{i:08d}', 'command': NOOP_COMMAND, 'priority': i % 10})
+
+@contextmanager
+def ScratchQueue(engine):
+    """
+    Points this process at an empty queue in a temporary directory. The storage
+    singletons and the config cache are reset so nothing leaks between cases.
+    """
+    from queuectl import db
+    from queuectl.config import SharedConfig
+    workDir = tempfile.mkdtemp(prefix='queuectl-bench-')
+    previousDir = os.getcwd()
+    os.chdir(workDir)
+    os.environ['QUEUECTL_STORAGE'] = engine
+    db.StorageInstances.clear()
+    SharedConfig.Invalidate()
+    try:
+        yield workDir
+    finally:
+        db.StorageInstances.clear()
+        SharedConfig.Invalidate()
+        os.chdir(previousDir)
+        shutil.rmtree(workDir, ignore_errors=True)
+
+def RunQueueSizeCases(engine, queueSize, singleJobs, samples):
+    """The enqueue, claim, status and dashboard cases on a queue holding queueSize jobs."""
+    from queuectl.db import GetStorage
+    from queuectl.job import JobManager
+    from queuectl.scheduler import ReadyIndex
+    from queuectl.dashboard import app
+
+    results = []
+    base = {'engine': engine, 'queue_size': queueSize}
+    with ScratchQueue(engine):
+        lines = iter(JobLines(singleJobs, 'single'))
+        latencies = TimeCalls(lambda: JobManager.CreateJob(next(lines)), singleJobs)
+        results.append(dict(base, case='enqueue_single', jobs=singleJobs,
+                            jobs_per_sec=round(singleJobs / sum(latencies), 1), **LatencySummary(latencies)))
+
+        bulkJobs = max(queueSize - singleJobs, 0)
+        startTime = time.perf_counter()
+        JobManager.CreateJobs(JobLines(bulkJobs, 'bulk'))
+        elapsed = time.perf_counter() - startTime
+        results.append(dict(base, case='enqueue_bulk', jobs=bulkJobs,
+                            jobs_per_sec=round(bulkJobs / elapsed, 1) if elapsed else None, seconds=round(elapsed, 3)))
+
+        storage = GetStorage()
+        results.append(dict(base, case='status', **LatencySummary(TimeCalls(storage.CountByState, samples))))
+
+        client = app.test_client()
+        for name, url in DASHBOARD_URLS.items():
+            latencies = TimeCalls(lambda: client.get(url), samples)
+            results.append(dict(base, case=f'dashboard_{name}', **LatencySummary(latencies)))
+
+        # CLAIMS LAST, SINCE THEY CHANGE THE QUEUE; EACH TAKES ONE OF THE queueSize JOBS
+        claimSamples = min(samples, queueSize // 2)
+        latencies = TimeCalls(lambda: JobManager.FindAndLockPending(1, 'bench:storage'), claimSamples)
+        results.append(dict(base, case='claim_storage', **LatencySummary(latencies)))
+        index = ReadyIndex()
+        startTime = time.perf_counter()
+        index.Refresh()
+        indexLoadSeconds = time.perf_counter() - startTime
+        latencies = TimeCalls(lambda: JobManager.FindAndLockPending(1, 'bench:indexed', index), claimSamples)
+        results.append(dict(base, case='claim_indexed', index_load_ms=round(indexLoadSeconds * 1000, 3), **LatencySummary(latencies)))
+    return results
+
+def RunEndToEnd(engine, workerCount, jobCount, timeout):
+    """Drains jobCount no-op jobs with one `queuectl worker start --count workerCount` process."""
+    from queuectl.db import GetStorage
+    from queuectl.job import JobManager
+
+    with ScratchQueue(engine) as workDir:
+        JobManager.CreateJobs(JobLines(jobCount, 'e2e'))
+        storage = GetStorage()
+        env = dict(os.environ, QUEUECTL_STORAGE=engine)
+        startTime = time.perf_counter()
+        worker = subprocess.Popen(
+            ['queuectl', 'worker', 'start', '--count', str(workerCount)],
+            cwd=workDir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        finished = 0
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            counts = storage.CountByState()
+            finished = counts.get('completed', 0) + counts.get('dlq', 0)
+            if finished >= jobCount:
+                break
+            time.sleep(0.05)
+        wallSeconds = time.perf_counter() - startTime
+        worker.send_signal(signal.SIGINT)
+        try:
+            worker.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            worker.kill()
+
+        # THE SPAN FROM FIRST START TO LAST FINISH LEAVES OUT INTERPRETER STARTUP
+        starts, finishes = [], []
+        for job in storage.IterJobs('completed'):
+            starts.append(job['started_at'])
+            finishes.append(job['finished_at'])
+        span = None
+        if starts:
+            span = max(finishes) - min(starts)
+    return {
+        'engine': engine,
+        'case': 'end_to_end',
+        'workers': workerCount,
+        'jobs': jobCount,
+        'finished': finished,
+        'wall_seconds': round(wallSeconds, 3),
+        'jobs_per_sec': round(finished / span, 1) if span else None,
+    }
+
+def ResultKey(result):
+    return (result['engine'], result['case'], result.get('queue_size'), result.get('workers'))
+
+def CompareResults(baseline, current, threshold):
+    """
+    Lists metrics that moved by more than threshold percent. *_per_sec metrics
+    are better higher, *_ms metrics better lower. Returns (lines, anyWorse).
+    """
+    previous = {ResultKey(r): r for r in baseline['results']}
+    lines = []
+    anyWorse = False
+    for result in current['results']:
+        old = previous.get(ResultKey(result))
+        if not old:
+            continue
+        for metric, value in result.items():
+            if not (metric.endswith('_per_sec') or metric.endswith('_ms')):
+                continue
+            oldValue = old.get(metric)
+            if not oldValue or value is None:
+                continue
+            change = (value - oldValue) / oldValue * 100
+            if abs(change) <= threshold:
+                continue
+            worse = change < 0 if metric.endswith('_per_sec') else change > 0
+            anyWorse = anyWorse or worse
+            where = ' '.join(f'{k}={v}' for k, v in zip(('engine', 'case', 'queue_size', 'workers'), ResultKey(result)) if v is not None)
+            lines.append(f"{'WORSE ' if worse else 'BETTER'} {where} {metric}: {oldValue} -> {value} ({change:+.1f}%)")
+    return lines, anyWorse
+
+def GitRevision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def Main():
+    parser = argparse.ArgumentParser(description='Measure enqueue, claim, status, dashboard and end-to-end performance.')
+    parser.add_argument('--engines', default='sqlite,tinydb', help='Comma-separated storage engines.')
+    parser.add_argument('--sizes', default='1000,10000', help='Comma-separated queue sizes, e.g. 1000,10000,100000,1000000.')
+    parser.add_argument('--workers', default='1,4,16', help='Comma-separated worker counts for the end-to-end case, e.g. 1,4,16,64.')
+    parser.add_argument('--e2e-jobs', type=int, default=1000, help='No-op jobs drained per end-to-end case.')
+    parser.add_argument('--single-jobs', type=int, default=200, help='Jobs enqueued one at a time per queue size.')
+    parser.add_argument('--samples', type=int, default=200, help='Timed calls per latency case.')
+    parser.add_argument('--tinydb-max-size', type=int, default=10000,
+                        help='Skip larger queue sizes for tinydb, which rewrites its whole file on every write.')
+    parser.add_argument('--timeout', type=float, default=600, help='Give up on an end-to-end case after this many seconds.')
+    parser.add_argument('--output', help='Also write the JSON results to this file.')
+    parser.add_argument('--compare', metavar='BASELINE', help='A previous --output file to compare against.')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Percent change --compare reports.')
+    args = parser.parse_args()
+
+    results = []
+    for engine in args.engines.split(','):
+        for queueSize in (int(x) for x in args.sizes.split(',')):
+            if engine == 'tinydb' and queueSize > args.tinydb_max_size:
+                results.append({'engine': engine, 'queue_size': queueSize, 'case': 'skipped'})
+                continue
+            for result in RunQueueSizeCases(engine, queueSize, min(args.single_jobs, queueSize), args.samples):
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+        for workerCount in (int(x) for x in args.workers.split(',')):
+            result = RunEndToEnd(engine, workerCount, args.e2e_jobs, args.timeout)
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+
+    report = {
+        'benchmark': 'queue',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'revision': GitRevision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'arguments': vars(args),
+        'results': results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, anyWorse = CompareResults(baseline, report, args.threshold)
+        print(f"Compared with {args.compare} (revision {baseline.get('revision')}), threshold {args.threshold}%:", file=sys.stderr)
+        for line in lines or ['No metric moved beyond the threshold.']:
+            print('  ' + line, file=sys.stderr)
+        if anyWorse:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    Main()
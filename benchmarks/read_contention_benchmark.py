@@ -0,0 +1,148 @@
+# read_contention_benchmark.py - CLAIM THROUGHPUT WITH AND WITHOUT A HAMMERING DASHBOARD
+#
+# For each storage engine, enqueues a batch of jobs into a scratch directory and
+# drains it with claimer threads calling JobManager.FindAndLockPending, first on a
+# quiet system and then while dashboard readers hammer the JSON API as fast as
+# they can: some as threads of this process (sharing its locks, like a /metrics
+# scrape inside a worker) and some as separate processes (like `queuectl dashboard`).
+# Reports claims/sec, claim latency percentiles and reader request counts as JSON.
+#
+#   python benchmarks/read_contention_benchmark.py --jobs 2000 --readers 4 --reader-processes 2
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# THE HAMMER LOOPS OVER THE CALLS THE DASHBOARD PAGE MAKES
+READER_URLS = [
+    '/api/summary',
+    '/api/jobs?state=pending&sort=priority&order=asc',
+    '/api/jobs?state=completed',
+    '/api/changes?since=0',
+    '/metrics',
+]
+
+def RunReaderLoop(stopEvent, counter):
+    from queuectl.dashboard import app
+    client = app.test_client()
+    while not stopEvent.is_set():
+        for url in READER_URLS:
+            client.get(url)
+            counter[0] += 1
+
+def RunHammerChild():
+    """Entry point of a reader process: hammers the API until SIGTERM, then prints its request count."""
+    stopEvent = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopEvent.set())
+    counter = [0]
+    RunReaderLoop(stopEvent, counter)
+    print(counter[0])
+
+def Percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] if ordered else None
+
+def RunCase(engine, jobCount, claimerCount, readerThreads, readerProcesses):
+    workDir = tempfile.mkdtemp(prefix='queuectl-bench-')
+    env = dict(os.environ, QUEUECTL_STORAGE=engine)
+    previousDir = os.getcwd()
+    try:
+        jobLines = ''.join(json.dumps({'command': 'true', 'priority': i % 5}) + '\n' for i in range(jobCount))
+        subprocess.run(['queuectl', 'enqueue', '--file', '-'], input=jobLines, text=True, cwd=workDir, env=env, check=True, capture_output=True)
+
+        # THE STORAGE SINGLETONS USE RELATIVE PATHS, SO EACH CASE STARTS FRESH IN ITS OWN DIRECTORY
+        os.chdir(workDir)
+        os.environ['QUEUECTL_STORAGE'] = engine
+        from queuectl import db
+        from queuectl.job import JobManager
+        db.StorageInstances.clear()
+
+        children = [
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), '--hammer-child'], cwd=workDir, env=env, stdout=subprocess.PIPE, text=True)
+            for _ in range(readerProcesses)
+        ]
+        stopEvent = threading.Event()
+        readerCounters = [[0] for _ in range(readerThreads)]
+        readers = [threading.Thread(target=RunReaderLoop, args=(stopEvent, c), daemon=True) for c in readerCounters]
+        for reader in readers:
+            reader.start()
+        if readers or children:
+            # LET THE READERS REACH FULL SPEED BEFORE MEASURING
+            time.sleep(1.0)
+
+        latencies = []
+        latencyLock = threading.Lock()
+
+        def RunClaimer(workerId):
+            owner = f"bench:{workerId}"
+            while True:
+                startTime = time.perf_counter()
+                claimed = JobManager.FindAndLockPending(1, owner)
+                elapsed = time.perf_counter() - startTime
+                if not claimed:
+                    return
+                with latencyLock:
+                    latencies.append(elapsed)
+
+        startTime = time.perf_counter()
+        claimers = [threading.Thread(target=RunClaimer, args=(i,)) for i in range(claimerCount)]
+        for claimer in claimers:
+            claimer.start()
+        for claimer in claimers:
+            claimer.join()
+        elapsed = time.perf_counter() - startTime
+
+        stopEvent.set()
+        for reader in readers:
+            reader.join()
+        readerRequests = sum(c[0] for c in readerCounters)
+        for child in children:
+            child.send_signal(signal.SIGTERM)
+            output, _ = child.communicate(timeout=30)
+            readerRequests += int(output.strip() or 0)
+
+        return {
+            'engine': engine,
+            'reader_threads': readerThreads,
+            'reader_processes': readerProcesses,
+            'claimed': len(latencies),
+            'seconds': round(elapsed, 3),
+            'claims_per_sec': round(len(latencies) / elapsed, 1) if elapsed else None,
+            'claim_p50_ms': round(Percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+            'claim_p99_ms': round(Percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+            'reader_requests': readerRequests,
+        }
+    finally:
+        os.chdir(previousDir)
+        shutil.rmtree(workDir, ignore_errors=True)
+
+def Main():
+    parser = argparse.ArgumentParser(description='Measure claim throughput while dashboard readers hammer storage.')
+    parser.add_argument('--jobs', type=int, default=2000, help='Jobs claimed per case.')
+    parser.add_argument('--engines', default='sqlite,tinydb', help='Comma-separated storage engines.')
+    parser.add_argument('--claimers', type=int, default=4, help='Claimer threads.')
+    parser.add_argument('--readers', type=int, default=4, help='Dashboard reader threads inside the claiming process.')
+    parser.add_argument('--reader-processes', type=int, default=2, help='Dashboard reader processes.')
+    parser.add_argument('--hammer-child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hammer_child:
+        RunHammerChild()
+        return
+
+    results = []
+    for engine in args.engines.split(','):
+        for readerThreads, readerProcesses in ((0, 0), (args.readers, args.reader_processes)):
+            result = RunCase(engine, args.jobs, args.claimers, readerThreads, readerProcesses)
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+    print(json.dumps({'benchmark': 'read_contention', 'claimers': args.claimers, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    Main()
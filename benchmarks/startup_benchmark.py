@@ -0,0 +1,89 @@
+# startup_benchmark.py - STARTUP-TIME BUDGETS FOR THE SHORT CLI COMMANDS
+#
+# Scripts call `queuectl enqueue` and `queuectl status` in loops, so every
+# millisecond of import time is paid thousands of times. For each command below,
+# runs a fresh interpreter in a scratch directory and times importing the CLI
+# plus running the command (interpreter startup itself is left out), then checks
+# it against --budget-ms and that none of the heavy modules only `worker start`
+# and `dashboard` need were imported. Prints the results as JSON and exits with
+# status 1 if any command is over budget or loaded a heavy module. The regression
+# test is tests/test_startup.py; this script is for measuring each command by hand.
+#
+#   python benchmarks/startup_benchmark.py --runs 15 --budget-ms 100
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+COMMANDS = {
+    'enqueue': ['enqueue', '{"command": "true"}'],
+    'status': ['status'],
+    'list': ['list', '--limit', '1'],
+    'dlq list': ['dlq', 'list', '--limit', '1'],
+    'config set': ['config', 'set', 'max-retries', '3'],
+    'metrics': ['metrics'],
+    'worker start --help': ['worker', 'start', '--help'],
+}
+
+# MODULES THAT BELONG TO `worker start` AND `dashboard` ONLY
+HEAVY_MODULES = ['flask', 'werkzeug', 'jinja2', 'http.server', 'queuectl.dashboard', 'queuectl.worker', 'queuectl.aioworker']
+
+# RUN IN EACH CHILD: TIMES THE CLI IMPORT AND THE COMMAND, THEN REPORTS ON THE LAST LINE OF STDERR
+CHILD_SCRIPT = '''
+import sys, time, json
+startTime = time.perf_counter()
+from queuectl.cli import MainCLI
+importedTime = time.perf_counter()
+try:
+    MainCLI(sys.argv[1:], prog_name='queuectl')
+except SystemExit:
+    pass
+finishedTime = time.perf_counter()
+sys.stderr.write('\\n' + json.dumps({
+    'import_ms': (importedTime - startTime) * 1000,
+    'total_ms': (finishedTime - startTime) * 1000,
+    'heavy': [name for name in %r if name in sys.modules],
+}) + '\\n')
+''' % (HEAVY_MODULES,)
+
+def RunCommand(args, workDir):
+    result = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, *args], cwd=workDir, capture_output=True, text=True)
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+def Main():
+    parser = argparse.ArgumentParser(description='Check CLI startup time against a per-command budget.')
+    parser.add_argument('--runs', type=int, default=15, help='Timed runs per command; the median is reported.')
+    parser.add_argument('--budget-ms', type=float, default=100.0, help='Largest median import-plus-run time allowed per command.')
+    parser.add_argument('--engine', default='sqlite', help='Storage engine to run the commands against.')
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix='queuectl-bench-')
+    os.environ['QUEUECTL_STORAGE'] = args.engine
+    try:
+        results = []
+        for name, commandArgs in COMMANDS.items():
+            # AN UNTIMED RUN FIRST, SO SCHEMA CREATION AND COLD CACHES DON'T COUNT
+            RunCommand(commandArgs, workDir)
+            samples = [RunCommand(commandArgs, workDir) for _ in range(args.runs)]
+            result = {
+                'command': name,
+                'import_ms': round(statistics.median(s['import_ms'] for s in samples), 1),
+                'total_ms': round(statistics.median(s['total_ms'] for s in samples), 1),
+                'heavy_modules': sorted({m for s in samples for m in s['heavy']}),
+            }
+            result['ok'] = result['total_ms'] <= args.budget_ms and not result['heavy_modules']
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    print(json.dumps({'benchmark': 'startup', 'engine': args.engine, 'budget_ms': args.budget_ms, 'results': results}, indent=2))
+    if not all(r['ok'] for r in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,131 @@
+# aioworker.py - ASYNCIO EXECUTION ENGINE FOR MANY CONCURRENT, MOSTLY IDLE JOBS
+import asyncio
+import threading
+import time
+from .notify import WorkerWakeup
+from .worker import (
+    StopEventFlag, ClaimNextJobs, StartWorkerServices, EnsureLogDirectory,
+    WorkerOwnerName, IdleWaitSeconds, FinishJob, OpenJobLog, WorkerLeases,
+)
+from .joblog import CHUNK_SIZE, PUMP_DRAIN_TIMEOUT, ProcessGroupArgs, KillProcessTree
+from .instrument import JobRuntimeSeconds, WorkerIdleSeconds
+
+async def PumpStreamAsync(stream, jobLog):
+    while True:
+        chunk = await stream.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        jobLog.Write(chunk)
+
+async def RunStreamingProcessAsync(command, timeout, jobLog):
+    """The asyncio twin of joblog.RunStreamingProcess."""
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        **ProcessGroupArgs()
+    )
+    pump = asyncio.create_task(PumpStreamAsync(process.stdout, jobLog))
+    try:
+        return await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        KillProcessTree(process)
+        await process.wait()
+        raise
+    finally:
+        await asyncio.wait([pump], timeout=PUMP_DRAIN_TIMEOUT)
+        pump.cancel()
+
+async def ExecuteJobAsync(currentJob):
+    """The asyncio twin of worker.ExecuteJob: same outcomes, no thread per job."""
+    loop = asyncio.get_running_loop()
+    currentJob['started_at'] = time.time()
+    updates = {'started_at': currentJob['started_at']}
+    runStart = time.perf_counter()
+    outcome = 'error'
+    try:
+        timeout = currentJob.get('timeout', 300)
+        with OpenJobLog(currentJob) as jobLog:
+            try:
+                returnCode = await RunStreamingProcessAsync(currentJob['command'], timeout, jobLog)
+            except asyncio.TimeoutError:
+                jobLog.WriteNote(f"Job timed out after {timeout} seconds.")
+                raise
+            if returnCode == 0:
+                updates['state'] = outcome = 'completed'
+                print(f"JOB {currentJob['id']} SUCCEEDED.")
+            else:
+                jobLog.WriteNote(f"Command exited with status {returnCode}.")
+                updates['state'] = outcome = 'failed'
+                print(f"JOB {currentJob['id']} FAILED: Command '{currentJob['command']}' returned non-zero exit status {returnCode}.")
+    except asyncio.TimeoutError:
+        outcome = 'timeout'
+        updates['state'] = 'failed'
+        updates['output'] = f"Job timed out after {timeout} seconds."
+        print(f"JOB {currentJob['id']} FAILED: TIMEOUT")
+    except Exception as e:
+        updates['state'] = 'failed'
+        updates['output'] = f"An unexpected error occurred: {str(e)}"
+        print(f"JOB {currentJob['id']} FAILED: UNEXPECTED ERROR")
+    JobRuntimeSeconds.Observe(time.perf_counter() - runStart, outcome)
+
+    # READING THE LOG TAIL AND STORAGE LOOKUPS BLOCK, SO THEY RUN OFF THE EVENT LOOP
+    await loop.run_in_executor(None, FinishJob, currentJob, updates)
+
+async def RunAsyncWorkerLoop(concurrency):
+    """
+    Keeps up to `concurrency` jobs running as subprocesses on one event loop.
+    Claims only as many jobs as there are free slots, and sleeps until a job
+    finishes, new work is announced, or the earliest run_at is due.
+    """
+    loop = asyncio.get_running_loop()
+    owner = WorkerOwnerName('asyncio')
+    running = set()
+    wakeEvent = asyncio.Event()
+
+    def WakeLoop():
+        loop.call_soon_threadsafe(wakeEvent.set)
+    WorkerWakeup.Subscribe(WakeLoop)
+
+    print(f"ASYNCIO ENGINE STARTED WITH CONCURRENCY {concurrency}.")
+    try:
+        while not StopEventFlag.is_set():
+            wakeEvent.clear()
+            freeSlots = concurrency - len(running)
+            claimed = []
+            if freeSlots > 0:
+                claimed = await loop.run_in_executor(None, ClaimNextJobs, freeSlots, owner)
+                WorkerLeases.Hold(claimed)
+                for job in claimed:
+                    running.add(asyncio.create_task(ExecuteJobAsync(job)))
+
+            # A FULL CLAIM MAY MEAN MORE WORK IS WAITING, SO ONLY SLEEP OTHERWISE
+            if claimed and len(claimed) == freeSlots:
+                continue
+            waiters = [asyncio.create_task(wakeEvent.wait())]
+            idleStart = time.perf_counter() if not running else None
+            done, _ = await asyncio.wait(
+                running | set(waiters),
+                timeout=IdleWaitSeconds(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            waiters[0].cancel()
+            running -= done
+            # ONLY A WAIT WITH NOTHING RUNNING IS IDLE TIME
+            if idleStart is not None:
+                WorkerIdleSeconds.Inc(time.perf_counter() - idleStart, 'asyncio')
+    finally:
+        WorkerWakeup.Unsubscribe(WakeLoop)
+        # LETTING JOBS THAT ALREADY STARTED RUN TO COMPLETION
+        if running:
+            print(f"ASYNCIO ENGINE WAITING FOR {len(running)} RUNNING JOB(S).")
+            await asyncio.gather(*running, return_exceptions=True)
+    print("ASYNCIO ENGINE STOPPING.")
+
+def StartAsyncEngine(concurrency, flushBatchSize=100, flushLatency=0.05, gcInterval=0, queueWeights=None):
+    """Runs the asyncio engine on its own thread. Returns it in a list, like StartWorkers."""
+    StartWorkerServices(flushBatchSize, flushLatency, gcInterval, queueWeights)
+    EnsureLogDirectory()
+    engineThread = threading.Thread(target=asyncio.run, args=(RunAsyncWorkerLoop(concurrency),), name='AsyncioEngine')
+    engineThread.start()
+    return [engineThread]
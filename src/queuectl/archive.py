@@ -0,0 +1,65 @@
+# archive.py - COMPRESSED, DATE-PARTITIONED ARCHIVES OF EXPIRED JOBS
+import gzip
+import json
+import os
+import time
+import zlib
+from .record import ParseTime
+
+# ARCHIVES LIVE NEXT TO THE DATABASE, ONE DIRECTORY PER KIND ('completed' OR 'dlq')
+# AND ONE FILE PER UTC DAY THE JOBS FINISHED ON, e.g. archive/completed/2024-05-01.ndjson.gz
+ARCHIVE_DIR = 'archive'
+ARCHIVE_KINDS = ('completed', 'dlq')
+ARCHIVE_SUFFIX = '.ndjson.gz'
+
+def FinishedAt(job):
+    """The timestamp a finished job is aged and partitioned by."""
+    return job.get('finished_at') or job.get('updated_at') or job['created_at']
+
+def PartitionDate(job):
+    return time.strftime('%Y-%m-%d', time.gmtime(ParseTime(FinishedAt(job))))
+
+def WriteArchive(kind, jobs, archiveDir=ARCHIVE_DIR):
+    """
+    Appends jobs to their partition files and fsyncs them. Each call adds one gzip
+    member per partition; concatenated members read back as a single stream.
+    """
+    partitions = {}
+    for job in jobs:
+        partitions.setdefault(PartitionDate(job), []).append(job)
+    kindDir = os.path.join(archiveDir, kind)
+    os.makedirs(kindDir, exist_ok=True)
+    for date, partJobs in sorted(partitions.items()):
+        payload = ''.join(json.dumps(job, separators=(',', ':')) + '\n' for job in partJobs).encode()
+        with open(os.path.join(kindDir, date + ARCHIVE_SUFFIX), 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as compressed:
+                compressed.write(payload)
+            raw.flush()
+            os.fsync(raw.fileno())
+
+def ArchivePartitions(kind, archiveDir=ARCHIVE_DIR):
+    """Returns [(date, path)] of the partition files for kind, oldest first."""
+    kindDir = os.path.join(archiveDir, kind)
+    try:
+        names = os.listdir(kindDir)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        (name[:-len(ARCHIVE_SUFFIX)], os.path.join(kindDir, name))
+        for name in names if name.endswith(ARCHIVE_SUFFIX)
+    )
+
+def ReadPartition(path):
+    """Yields the jobs in one partition file, stopping quietly at a member cut short by a crash."""
+    with gzip.open(path, 'rt') as lines:
+        try:
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, zlib.error):
+            return
+
+def ReadArchive(kind, archiveDir=ARCHIVE_DIR):
+    """Yields every archived job of kind, oldest partition first."""
+    for _, path in ArchivePartitions(kind, archiveDir):
+        yield from ReadPartition(path)
@@ -1,12 +1,45 @@
 # cli.py - THE MAIN ENTRY POINT FOR ALL CLI COMMANDS (WITH DESCRIPTIONS)
 import click
 import json
+import time
 from .job import JobManager
-from .worker import StartWorkers, StopWorkers
-from .db import GetDbConnection, JobQuery, DatabaseLock
-from .config import SetConfigValue
-from .dashboard import RunDashboard
+from .db import GetStorage, SqliteBackend, DuplicateJobError, TINYDB_PATH, SQLITE_PATH, DEFAULT_ENGINE, DEFAULT_QUEUE, COMPACT_JSON
+from .shards import ValidateQueueName
+from .record import ForDisplay, LogPath
+from .config import SetConfigValue, GetConfigValue
+from .stats import Percentile, Throughput, BuildStats, THROUGHPUT_WINDOWS
+from .archive import ArchivePartitions, ReadPartition, ARCHIVE_DIR, ARCHIVE_KINDS
 import os
+import sys
+
+# THE WORKER, THE METRICS EXPORTER AND THE DASHBOARD (WHICH PULLS IN FLASK) ARE
+# IMPORTED INSIDE THE COMMANDS THAT USE THEM, SO SHORT COMMANDS LIKE `enqueue`
+# AND `status` START QUICKLY. tests/test_startup.py GUARDS THIS.
+
+def QueueOption(help):
+    """A --queue option whose value must be a valid queue name."""
+    def Validate(ctx, param, value):
+        try:
+            return ValidateQueueName(value) if value is not None else None
+        except ValueError as error:
+            raise click.BadParameter(str(error))
+    return click.option('--queue', callback=Validate, help=help)
+
+def ParseQueueWeights(ctx, param, value):
+    """Parses 'critical:5,batch:1' (weight 1 when left out) into {queue: weight}."""
+    if not value:
+        return None
+    weights = {}
+    for part in value.split(','):
+        name, _, weight = part.strip().partition(':')
+        try:
+            ValidateQueueName(name)
+        except ValueError as error:
+            raise click.BadParameter(str(error))
+        if weight and not (weight.isdigit() and int(weight) >= 1):
+            raise click.BadParameter(f"Weight '{weight}' of queue '{name}' must be a whole number of at least 1.")
+        weights[name] = int(weight or 1)
+    return weights
 
 # COMMANDS DEFINITION
 @click.group()
@@ -15,11 +48,51 @@ def MainCLI():
     pass
 
 @MainCLI.command()
-@click.argument('job_data')
-def enqueue(job_data):
-    """Add a new job to the queue."""
-    newJob = JobManager.CreateJob(job_data)
-    click.echo(f"Enqueued job {newJob['id']}.")
+@click.argument('job_data', required=False)
+@click.option('--file', 'job_file', type=click.File('r'), help="NDJSON file with one job per line, or '-' for stdin.")
+@click.option('--chunk-size', default=1000, type=click.IntRange(min=1), help='Jobs inserted per transaction with --file.')
+@QueueOption(f"Queue to add the job(s) to, overriding any 'queue' field (default: {DEFAULT_QUEUE}).")
+def enqueue(job_data, job_file, chunk_size, queue):
+    """
+    Add a new job to the queue, or many jobs from an NDJSON file. Exits with
+    status 1 if any job was not enqueued: a duplicate, or an invalid line.
+    """
+    from .daemon import DaemonGone
+
+    def ReportDaemonGone(error):
+        # THE LATER CALLS OF THIS PROCESS ALREADY USE STORAGE DIRECTLY, BUT A WRITE MAY
+        # HAVE LANDED, SO RETRYING IT HERE COULD ENQUEUE A JOB WITHOUT AN id TWICE
+        click.echo(f"Error: {error} Check with `queuectl list` before enqueueing again.", err=True)
+        sys.exit(1)
+
+    if job_file is None:
+        if job_data is None:
+            raise click.UsageError("Provide JOB_DATA or --file.")
+        try:
+            newJob = JobManager.CreateJob(job_data, queue)
+        except DuplicateJobError as error:
+            click.echo(f"Not enqueued: {error}", err=True)
+            sys.exit(1)
+        except DaemonGone as error:
+            ReportDaemonGone(error)
+        except (ValueError, TypeError) as error:
+            raise click.BadParameter(str(error), param_hint='JOB_DATA')
+        click.echo(f"Enqueued job {newJob['id']}" + (f" on queue {newJob['queue']}." if newJob['queue'] != DEFAULT_QUEUE else "."))
+        return
+
+    def ReportError(lineNumber, error):
+        click.echo(f"Line {lineNumber}: {error}", err=True)
+
+    startTime = time.perf_counter()
+    try:
+        enqueuedCount, errorCount = JobManager.CreateJobs(job_file, chunk_size, ReportError, queue)
+    except DaemonGone as error:
+        ReportDaemonGone(error)
+    elapsed = time.perf_counter() - startTime
+    rate = enqueuedCount / elapsed if elapsed > 0 else 0
+    click.echo(f"Enqueued {enqueuedCount} job(s) in {elapsed:.2f}s ({rate:.0f} jobs/sec), {errorCount} line(s) rejected.")
+    if errorCount:
+        sys.exit(1)
 
 @click.group()
 def worker():
@@ -29,50 +102,130 @@ def worker():
 
 @worker.command()
 @click.option('--count', default=1, help='Number of workers to start.')
-def start(count):
+@click.option('--prefetch', default=1, type=click.IntRange(min=1), help='Jobs each worker leases per claim and buffers locally.')
+@click.option('--flush-batch', default=100, type=click.IntRange(min=1), help='Most job outcomes committed in one transaction.')
+@click.option('--flush-latency-ms', default=50, type=click.IntRange(min=0), help='Longest a job outcome waits before it is committed.')
+@click.option('--engine', type=click.Choice(['thread', 'asyncio']), default='thread', show_default=True, help='How job subprocesses are run.')
+@click.option('--concurrency', default=100, type=click.IntRange(min=1), help='Jobs run at once by the asyncio engine.')
+@click.option('--metrics-port', type=click.IntRange(min=1, max=65535), help='Serve OpenMetrics at http://127.0.0.1:PORT/metrics.')
+@click.option('--gc-interval', default=0, type=click.IntRange(min=0), help='Archive jobs past their retention every N seconds (0 disables).')
+@click.option('--queues', callback=ParseQueueWeights, metavar='NAME[:WEIGHT],...',
+              help='Serve only these queues, NAME:WEIGHT jobs of each per round, e.g. critical:5,batch:1 (default: every queue equally).')
+def start(count, prefetch, flush_batch, flush_latency_ms, engine, concurrency, metrics_port, gc_interval, queues):
     """Start one or more worker processes."""
-    workerThreads = StartWorkers(count)
-    click.echo(f"Started {count} worker(s). Press Ctrl+C to stop.")
+    from .worker import StartWorkers, StopWorkers, FlushOutcomes
+    if metrics_port:
+        from .instrument import StartMetricsExporter
+        StartMetricsExporter(metrics_port)
+        click.echo(f"Serving metrics at http://127.0.0.1:{metrics_port}/metrics")
+    if engine == 'asyncio':
+        from .aioworker import StartAsyncEngine
+        workerThreads = StartAsyncEngine(concurrency, flush_batch, flush_latency_ms / 1000, gc_interval, queues)
+        click.echo(f"Started asyncio engine with concurrency {concurrency}. Press Ctrl+C to stop.")
+    else:
+        workerThreads = StartWorkers(count, prefetch, flush_batch, flush_latency_ms / 1000, gc_interval, queues)
+        click.echo(f"Started {count} worker(s). Press Ctrl+C to stop.")
+    if queues:
+        click.echo("Serving queues " + ', '.join(f"{name} (weight {weight})" for name, weight in queues.items()) + ".")
     try:
-        for aThread in workerThreads:
-            aThread.join()
+        # POLLING INSTEAD OF join(): AN INTERRUPTED join() CAN MARK A LIVE THREAD AS
+        # STOPPED, WHICH WOULD LET THE PROCESS EXIT BEFORE WORKERS RELEASE THEIR JOBS
+        while any(aThread.is_alive() for aThread in workerThreads):
+            time.sleep(0.2)
     except KeyboardInterrupt:
         click.echo("\nGRACEFULLY SHUTTING DOWN WORKERS...")
         StopWorkers()
         for aThread in workerThreads:
             aThread.join()
+        FlushOutcomes()
         click.echo("ALL WORKERS HAVE STOPPED.")
 MainCLI.add_command(worker)
 
 
+def FormatCounts(counts):
+    return (f"Pending: {counts.get('pending', 0)}, Processing: {counts.get('processing', 0)}, "
+            f"Completed: {counts.get('completed', 0)}, Failed: {counts.get('failed', 0)}, DLQ: {counts.get('dlq', 0)}")
+
 @MainCLI.command()
-def status():
-    """Show a summary of job states."""
-    with DatabaseLock:
-        db = GetDbConnection()
-        JobsTable = db.table('Jobs')
-        DlqTable = db.table('DLQ')
-        pendingCount = JobsTable.count(JobQuery.state == 'pending')
-        processingCount = JobsTable.count(JobQuery.state == 'processing')
-        completedCount = JobsTable.count(JobQuery.state == 'completed')
-        failedCount = JobsTable.count(JobQuery.state == 'failed')
-        deadCount = len(DlqTable)
-        db.close()
-    click.echo(f"Pending: {pendingCount}, Processing: {processingCount}, Completed: {completedCount}, Failed: {failedCount}, DLQ: {deadCount}")
+@QueueOption('Only count this queue.')
+def status(queue):
+    """Show a summary of job states, per queue when there are several."""
+    storage = GetStorage()
+    if queue is not None:
+        click.echo(FormatCounts(storage.CountByState(queue=queue)))
+        return
+    queues = storage.ListQueues()
+    if len(queues) == 1:
+        click.echo(FormatCounts(storage.CountByState()))
+        return
+    perQueue = {name: storage.CountByState(queue=name) for name in queues}
+    total = {}
+    for counts in perQueue.values():
+        for state, count in counts.items():
+            total[state] = total.get(state, 0) + count
+    click.echo(FormatCounts(total))
+    width = max(len(name) for name in queues)
+    for name, counts in perQueue.items():
+        click.echo(f"  {name.ljust(width)}  {FormatCounts(counts)}")
+
+# RECORDS WRITTEN BETWEEN FLUSHES WHEN STREAMING list OUTPUT
+STREAM_FLUSH_EVERY = 100
+
+def ListingOptions(command):
+    """The pagination, projection and output options shared by `list` and `dlq list`."""
+    command = click.option('--ndjson', is_flag=True, help='Stream one compact JSON object per line instead of a JSON array.')(command)
+    command = click.option('--fields', help='Comma-separated fields to keep in each record, e.g. id,state,command.')(command)
+    command = click.option('--after', metavar='JOB_ID', help='Start after this job id (the cursor printed by a previous --limit page).')(command)
+    command = click.option('--limit', type=click.IntRange(min=1), help='Print at most this many jobs.')(command)
+    return command
+
+def EchoRecords(records, limit, fields, ndjson):
+    """
+    Writes up to limit records to stdout as they arrive, as NDJSON or as the same
+    indented JSON array `list` has always printed, so nothing is held in memory.
+    Timestamps are printed as ISO 8601. If more records follow, the cursor for
+    the next page goes to stderr.
+    """
+    fieldNames = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+    out = click.get_text_stream('stdout')
+    written = 0
+    lastId = None
+    nextCursor = None
+    try:
+        if not ndjson:
+            out.write('[')
+        for record in records:
+            if limit is not None and written == limit:
+                nextCursor = lastId
+                break
+            lastId = record['id']
+            record = ForDisplay(record)
+            if fieldNames:
+                record = {name: record.get(name) for name in fieldNames}
+            if ndjson:
+                out.write(json.dumps(record, separators=COMPACT_JSON) + '\n')
+            else:
+                out.write((',\n  ' if written else '\n  ') + json.dumps(record, indent=2).replace('\n', '\n  '))
+            if written % STREAM_FLUSH_EVERY == 0:
+                out.flush()
+            written += 1
+        if not ndjson:
+            out.write('\n]\n' if written else ']\n')
+        out.flush()
+        if nextCursor is not None:
+            click.echo(f"More jobs follow; continue with --after {nextCursor}", err=True)
+    except BrokenPipeError:
+        # THE READER (E.G. `head`) HAS ALL IT WANTS; SILENCE THE FLUSH PYTHON ATTEMPTS AT EXIT
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(0)
 
 @MainCLI.command('list')
 @click.option('--state', type=click.Choice(['pending', 'processing', 'completed', 'failed']), help='Filter jobs by state.')
-def ListJobs(state):
-    """List jobs, optionally filtering by state."""
-    with DatabaseLock:
-        db = GetDbConnection()
-        JobsTable = db.table('Jobs')
-        if state:
-            jobs = JobsTable.search(JobQuery.state == state)
-        else:
-            jobs = JobsTable.all()
-        db.close()
-    click.echo(json.dumps(jobs, indent=2))
+@QueueOption('Only list jobs on this queue.')
+@ListingOptions
+def ListJobs(state, queue, limit, after, fields, ndjson):
+    """List jobs in id order, optionally filtering by state and queue."""
+    EchoRecords(GetStorage().IterJobs(state, after, queue=queue), limit, fields, ndjson)
 
 
 @click.group()
@@ -81,94 +234,190 @@ def dlq():
     pass
 
 @dlq.command('list')
-def ListDlq():
-    """List all jobs in the DLQ."""
-    with DatabaseLock:
-        db = GetDbConnection()
-        DlqTable = db.table('DLQ')
-        dlqJobs = DlqTable.all()
-        db.close()
-    click.echo(json.dumps(dlqJobs, indent=2))
+@QueueOption('Only list DLQ entries from this queue.')
+@ListingOptions
+def ListDlq(queue, limit, after, fields, ndjson):
+    """List jobs in the DLQ, in id order."""
+    EchoRecords(GetStorage().IterDlq(after, queue=queue), limit, fields, ndjson)
 
 @dlq.command()
 @click.argument('job_id')
 def retry(job_id):
     """Retry a job from the DLQ."""
-    with DatabaseLock:
-        db = GetDbConnection()
-        JobsTable = db.table('Jobs')
-        DlqTable = db.table('DLQ')
-        jobToRetry = DlqTable.get(JobQuery.id == job_id)
-        if jobToRetry:
-            DlqTable.remove(JobQuery.id == job_id)
-            jobToRetry['state'] = 'pending'
-            jobToRetry['attempts'] = 0
-            JobsTable.insert(jobToRetry)
-            click.echo(f"Job {job_id} has been moved back to the queue for retry.")
-        else:
-            click.echo(f"Error: Job {job_id} not found in DLQ.", err=True)
-        db.close()
+    if JobManager.RetryFromDlq(job_id):
+        click.echo(f"Job {job_id} has been moved back to the queue for retry.")
+    else:
+        click.echo(f"Error: Job {job_id} not found in DLQ.", err=True)
 MainCLI.add_command(dlq)
 
 
+# CLI NAMES FOR THE SETTINGS STORED IN THE CONFIG TABLE
+ConfigKeys = {
+    'max-retries': 'maxRetries',
+    'backoff-base': 'backoffBase',
+    'backoff-cap': 'backoffCap',
+    'backoff-jitter': 'backoffJitter',
+    'log-max-bytes': 'logMaxBytes',
+    'log-backups': 'logBackups',
+    'lease-seconds': 'leaseSeconds',
+    'completed-retention-seconds': 'completedRetentionSeconds',
+    'completed-retention-count': 'completedRetentionCount',
+    'dlq-retention-seconds': 'dlqRetentionSeconds',
+    'dlq-retention-count': 'dlqRetentionCount',
+    'dedup-window-seconds': 'dedupWindowSeconds',
+}
+
 @click.group()
 def config():
     """Manage system configuration."""
     pass
 
 @config.command()
-@click.argument('key', type=click.Choice(['max-retries', 'backoff-base']))
+@click.argument('key', type=click.Choice(list(ConfigKeys)))
 @click.argument('value', type=int)
 def set(key, value):
     """Set a configuration value."""
-    dbKey = 'maxRetries' if key == 'max-retries' else 'backoffBase'
-    SetConfigValue(dbKey, value)
+    if key == 'backoff-jitter' and not 0 <= value <= 100:
+        click.echo("Error: backoff-jitter is a percentage between 0 and 100.", err=True)
+        return
+    if key == 'lease-seconds' and value < 1:
+        click.echo("Error: lease-seconds must be at least 1.", err=True)
+        return
+    if key == 'dedup-window-seconds' and value < 0:
+        click.echo("Error: dedup-window-seconds cannot be negative.", err=True)
+        return
+    if '-retention-' in key and value < 0:
+        click.echo(f"Error: {key} cannot be negative (0 keeps jobs forever).", err=True)
+        return
+    SetConfigValue(ConfigKeys[key], value)
     click.echo(f"Configuration updated: {key} = {value}")
 MainCLI.add_command(config)
 
+
+@MainCLI.command()
+@click.option('--source', default=TINYDB_PATH, show_default=True, help='TinyDB JSON file to import.')
+@click.option('--target', default=SQLITE_PATH, show_default=True, help='SQLite database to create or extend.')
+def migrate(source, target):
+    """Import jobs, DLQ and config from the JSON file into SQLite. Safe to run again: ids already imported are skipped."""
+    if not os.path.exists(source) or os.path.getsize(source) == 0:
+        click.echo(f"Error: Nothing to migrate, {source} is missing or empty.", err=True)
+        return
+    jobCount, dlqCount, configCount, skippedCount = SqliteBackend(target).ImportFromTinyDb(source)
+    click.echo(f"Migrated {jobCount} job(s), {dlqCount} DLQ entry(ies) and {configCount} config value(s) into {target}.")
+    if skippedCount:
+        click.echo(f"Skipped {skippedCount} job(s) and DLQ entry(ies) whose id {target} already holds.")
+
 # BONUS COMMANDS
 
 @MainCLI.command()
 @click.argument('job_id')
 def logs(job_id):
     """Display the log file for a given job ID."""
-    log_file = f"logs/{job_id}.log"
+    log_file = LogPath(job_id)
     if not os.path.exists(log_file):
         click.echo(f"Error: Log file not found for job {job_id}.", err=True)
         return
-    with open(log_file, 'r') as f:
-        click.echo(f.read())
+    # ROTATED COPIES ('.2' IS OLDER THAN '.1') COME FIRST, THEN THE CURRENT FILE
+    rotated = []
+    while os.path.exists(f"{log_file}.{len(rotated) + 1}"):
+        rotated.append(f"{log_file}.{len(rotated) + 1}")
+    stdout = click.get_binary_stream('stdout')
+    for path in list(reversed(rotated)) + [log_file]:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                stdout.write(chunk)
+    stdout.flush()
 
 @MainCLI.command()
-def metrics():
-    """Show execution stats for completed and dead jobs."""
-    with DatabaseLock:
-        db = GetDbConnection()
-        JobsTable = db.table('Jobs')
-        DlqTable = db.table('DLQ')
-        completed_jobs = JobsTable.search(JobQuery.state == 'completed')
-        dead_jobs = DlqTable.all()
-        db.close()
-
-    total_finished = len(completed_jobs) + len(dead_jobs)
+def gc():
+    """Archive completed jobs and DLQ entries past their retention."""
+    retentionKeys = [k for k in ConfigKeys if '-retention-' in k]
+    if not any(GetConfigValue(ConfigKeys[k]) for k in retentionKeys):
+        click.echo(f"No retention is configured; set one of: {', '.join(retentionKeys)}.")
+        return
+    purged = JobManager.CollectGarbage()
+    click.echo(f"Archived {purged['completed']} completed job(s) and {purged['dlq']} DLQ entr(ies) to {ARCHIVE_DIR}/.")
+
+@MainCLI.command()
+@click.pass_context
+def compact(ctx):
+    """Run gc, then give the space it freed back to the filesystem."""
+    ctx.invoke(gc)
+    freedBytes = GetStorage().Compact()
+    click.echo(f"Compacted the database, {freedBytes / (1024 * 1024):.1f} MB freed.")
+
+def EchoArchiveMetrics():
+    """Prints a line per archive partition (UTC day) with its counts and duration percentiles."""
+    partitions = {}
+    for kind in ARCHIVE_KINDS:
+        for date, path in ArchivePartitions(kind):
+            partitions.setdefault(date, {})[kind] = path
+    if not partitions:
+        click.echo("No archived jobs.")
+        return
+    click.echo(f"Archived Jobs (from {ARCHIVE_DIR}/)")
+    for date, paths in sorted(partitions.items()):
+        stats = BuildStats(
+            ReadPartition(paths['completed']) if 'completed' in paths else [],
+            ReadPartition(paths['dlq']) if 'dlq' in paths else []
+        )
+        line = f"  {date}: {stats['completed']} completed, {stats['dead']} dead"
+        if stats['duration_count']:
+            line += f", p50 {Percentile(stats, 0.5):.2f}s, p99 {Percentile(stats, 0.99):.2f}s"
+        click.echo(line)
+
+@MainCLI.command()
+@click.option('--archived', is_flag=True, help='Also break down archived jobs by the day they finished.')
+def metrics(archived):
+    """Show execution stats for completed and dead jobs, archived ones included."""
+    stats = GetStorage().GetStats()
+    total_finished = stats['completed'] + stats['dead']
     if total_finished == 0:
         click.echo("No jobs have finished yet.")
         return
 
-    total_duration = sum(j.get('duration_seconds', 0) for j in completed_jobs + dead_jobs if j.get('duration_seconds'))
-    avg_duration = total_duration / total_finished if total_finished > 0 else 0
-    success_rate = (len(completed_jobs) / total_finished) * 100 if total_finished > 0 else 0
+    avg_duration = stats['duration_sum'] / stats['duration_count'] if stats['duration_count'] else 0
+    success_rate = (stats['completed'] / total_finished) * 100
 
     click.echo("Execution Metrics")
     click.echo(f"Total Jobs Finished: {total_finished}")
-    click.echo(f"  - Completed: {len(completed_jobs)}")
-    click.echo(f"  - Dead: {len(dead_jobs)}")
+    click.echo(f"  - Completed: {stats['completed']}")
+    click.echo(f"  - Dead: {stats['dead']}")
+    click.echo(f"  - Failed attempts retried: {stats['retried']}")
     click.echo(f"Success Rate: {success_rate:.2f}%")
     click.echo(f"Average Job Duration: {avg_duration:.2f} seconds")
+    if stats['duration_count']:
+        percentiles = ', '.join(
+            f"p{label} {Percentile(stats, fraction):.2f}s" for label, fraction in (('50', 0.5), ('95', 0.95), ('99', 0.99))
+        )
+        click.echo(f"Duration Percentiles: {percentiles}")
+    throughput = ', '.join(f"{Throughput(stats, w):.2f}/s ({w // 60}m)" for w in THROUGHPUT_WINDOWS)
+    click.echo(f"Throughput: {throughput}")
+    if archived:
+        EchoArchiveMetrics()
+
+@MainCLI.command()
+def serve():
+    """Run a daemon that owns storage; other commands here use it while it runs."""
+    from .daemon import StartDaemon, StopDaemon
+    engine = os.environ.get('QUEUECTL_STORAGE', DEFAULT_ENGINE)
+    try:
+        server = StartDaemon(engine)
+    except RuntimeError as error:
+        click.echo(f"Error: {error}", err=True)
+        sys.exit(1)
+    click.echo(f"Serving {engine} storage at {server.server_address}. Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        click.echo("\nDaemon stopped; commands will use storage directly again.")
+    finally:
+        StopDaemon(server)
 
 @MainCLI.command()
 def dashboard():
     """Launch a minimal web dashboard for monitoring."""
+    from .dashboard import RunDashboard
     click.echo("Starting web dashboard at http://127.0.0.1:5000/")
     click.echo("Press Ctrl+C to stop the dashboard.")
     RunDashboard()
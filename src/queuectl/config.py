@@ -1,24 +1,85 @@
 # config.py - MANAGES ALL CONFIGURATION SETTINGS (UPDATED TO PREVENT FILE LOCKS)
-from .db import GetDbConnection, Query
+import threading
+import time
+from .db import GetStorage
 
 DefaultConfig = {
     'maxRetries': 3,
     'backoffBase': 2,
+    'backoffCap': 300,    # LONGEST RETRY DELAY IN SECONDS
+    'backoffJitter': 0,   # PERCENT OF THE DELAY TO SHAVE OFF AT RANDOM (0 DISABLES)
+    'logMaxBytes': 10 * 1024 * 1024,  # SIZE AT WHICH A JOB LOG IS ROTATED
+    'logBackups': 2,      # ROTATED COPIES KEPT PER JOB LOG
+    'leaseSeconds': 60,   # A CLAIM NOT RENEWED FOR THIS LONG IS REQUEUED BY THE REAPER
+    # RETENTION FOR FINISHED JOBS: OLDER OR SURPLUS ONES ARE MOVED TO THE ARCHIVE BY
+    # `queuectl gc` OR A WORKER'S --gc-interval. 0 KEEPS THEM FOREVER.
+    'completedRetentionSeconds': 0,
+    'completedRetentionCount': 0,
+    'dlqRetentionSeconds': 0,
+    'dlqRetentionCount': 0,
+    # HOW LONG A JOB ENQUEUED WITH A dedup_key BLOCKS OTHERS WITH THE SAME KEY
+    'dedupWindowSeconds': 3600,
 }
 
+# JOB FIELDS THAT OVERRIDE A CONFIG VALUE FOR THAT ONE JOB
+JobOverrides = {
+    'max_retries': 'maxRetries',
+    'backoff_base': 'backoffBase',
+    'backoff_cap': 'backoffCap',
+    'backoff_jitter': 'backoffJitter',
+}
+
+# HOW OFTEN, IN SECONDS, THE CACHE ASKS STORAGE WHETHER THE CONFIG CHANGED.
+# A `queuectl config set` FROM ANOTHER PROCESS IS PICKED UP WITHIN THIS DELAY.
+CONFIG_CHECK_INTERVAL = 1.0
+
+class ConfigCache:
+    """
+    A process-local copy of the stored config. Lookups are served from memory;
+    at most once per checkInterval a lookup asks the backend for its cheap
+    ConfigVersion token and reloads every value in one read if it changed.
+    """
+    def __init__(self, checkInterval=CONFIG_CHECK_INTERVAL):
+        self.checkInterval = checkInterval
+        self.lock = threading.Lock()
+        self.values = None
+        self.version = None
+        self.checkedAt = 0.0
+
+    def Get(self, configKey):
+        with self.lock:
+            now = time.monotonic()
+            if self.values is None or now - self.checkedAt >= self.checkInterval:
+                self.Refresh(now)
+            return self.values.get(configKey)
+
+    def Refresh(self, now):
+        storage = GetStorage()
+        version = storage.ConfigVersion()
+        if self.values is None or version != self.version:
+            self.values = storage.GetAllConfig()
+            self.version = version
+        self.checkedAt = now
+
+    def Invalidate(self):
+        with self.lock:
+            self.values = None
+
+# THE CACHE EVERY CONFIG LOOKUP IN THIS PROCESS GOES THROUGH
+SharedConfig = ConfigCache()
+
 def GetConfigValue(configKey):
-    """Gets a config value, opening and closing the DB connection."""
-    db = GetDbConnection()
-    ConfigTable = db.table('Config')
-    ConfigQuery = Query()
-    result = ConfigTable.get(ConfigQuery.key == configKey)
-    db.close()
-    return result['value'] if result else DefaultConfig.get(configKey)
+    """Gets a config value, served from the process-wide cache."""
+    value = SharedConfig.Get(configKey)
+    return value if value is not None else DefaultConfig.get(configKey)
+
+def GetJobSetting(job, jobField):
+    """Resolves a setting for one job: its own override if it has one, else the config value."""
+    value = job.get(jobField)
+    return value if value is not None else GetConfigValue(JobOverrides[jobField])
 
 def SetConfigValue(configKey, configValue):
-    """Sets a config value, opening and closing the DB connection."""
-    db = GetDbConnection()
-    ConfigTable = db.table('Config')
-    ConfigQuery = Query()
-    ConfigTable.upsert({'key': configKey, 'value': configValue}, ConfigQuery.key == configKey)
-    db.close()
\ No newline at end of file
+    """Sets a config value in the active storage backend."""
+    GetStorage().SetConfig(configKey, configValue)
+    # THIS PROCESS SEES ITS OWN CHANGE AT ONCE, OTHERS WITHIN CONFIG_CHECK_INTERVAL
+    SharedConfig.Invalidate()
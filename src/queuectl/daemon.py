@@ -0,0 +1,305 @@
+# daemon.py - `queuectl serve`: ONE LONG-LIVED PROCESS OWNS STORAGE, OTHERS CALL IT OVER A UNIX SOCKET
+import builtins
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from itertools import islice
+from .db import StorageBackend, StorageEngines, StorageInstances, StorageOperations, OpenStorage, DuplicateJobError, ITER_PAGE_SIZE
+from .archive import WriteArchive
+from .instrument import InstrumentStorage
+from .notify import SUPPORTS_SOCKET_WAKEUP
+
+# ONE SOCKET PER ENGINE, NEXT TO THE WORKERS' WAKEUP SOCKETS, SO A CLIENT ONLY
+# EVER TALKS TO A DAEMON SERVING THE ENGINE IT ASKED FOR
+DAEMON_DIR = '.queuectl'
+
+# EVERY MESSAGE IS A 4-BYTE BIG-ENDIAN LENGTH FOLLOWED BY THAT MANY BYTES OF UTF-8 JSON.
+# A REQUEST IS {"op", "args", "kwargs"}; A REPLY IS {"result"} OR {"error", "type"}.
+HEADER = struct.Struct('>I')
+MAX_MESSAGE_BYTES = 256 * 1024 * 1024
+
+# PAGED STAND-INS FOR THE GENERATOR METHODS, WHICH CANNOT CROSS THE SOCKET AS-IS
+PAGE_OPERATIONS = {
+    'JobsPage': lambda backend, state, after, queue=None: list(islice(backend.IterJobs(state, after, queue), ITER_PAGE_SIZE)),
+    'DlqPage': lambda backend, after, queue=None: list(islice(backend.IterDlq(after, queue), ITER_PAGE_SIZE)),
+}
+
+# RESULTS THAT ARE NOT PLAIN JSON, CONVERTED BY THE DAEMON AND RESTORED BY RemoteBackend
+ResultEncoders = {
+    'RenewLeases': list,
+    'CountActiveByPriority': lambda counts: [[state, priority, count] for (state, priority), count in counts.items()],
+}
+
+# CALLS THAT CHANGE NOTHING, SO ONE WHOSE REPLY WAS LOST CAN SIMPLY RUN AGAIN LOCALLY
+READ_OPERATIONS = {
+    'GetJob', 'ClaimableChangesSince', 'FindExpiredLeases', 'SearchJobs', 'QueryJobs', 'ChangesSince',
+    'ListDlq', 'CountByState', 'CountActiveByPriority', 'GetStats', 'GetConfig', 'GetAllConfig',
+    'ConfigVersion', 'ListQueues', 'JobsPage', 'DlqPage',
+}
+
+# A CLAIM WHOSE REPLY WAS LOST IS REPORTED AS "NOTHING CLAIMED": IF THE DAEMON DID APPLY
+# IT, THE LEASE RUNS OUT UNRENEWED AND THE REAPER HANDS THE JOBS TO ANOTHER WORKER
+CLAIM_OPERATIONS = {'ClaimPending', 'ClaimByIds'}
+
+# ERRORS OF OUR OWN A STORAGE CALL MAY RAISE, RE-RAISED AS THEMSELVES BY RemoteBackend;
+# ANY OTHER ERROR COMES BACK AS THE BUILTIN EXCEPTION OF THE SAME NAME, OR RuntimeError
+StorageErrors = {'DuplicateJobError': DuplicateJobError}
+
+class DaemonGone(ConnectionError):
+    """The daemon went away after a request was sent, so whether it was applied is unknown."""
+
+def SocketPath(engine):
+    return os.path.join(DAEMON_DIR, f'serve-{engine}.sock')
+
+def SendMessage(sock, message):
+    payload = json.dumps(message, separators=(',', ':')).encode()
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+def ReceiveExactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def ReceiveMessage(sock):
+    """Returns the next message, or None if the peer closed the connection."""
+    header = ReceiveExactly(sock, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Message of {size} bytes exceeds the {MAX_MESSAGE_BYTES} byte limit.")
+    payload = ReceiveExactly(sock, size)
+    if payload is None:
+        return None
+    return json.loads(payload)
+
+
+class RemoteBackend(StorageBackend):
+    """
+    A StorageBackend that forwards every call to the `queuectl serve` daemon.
+    Each thread keeps its own connection. If the daemon cannot be reached, the
+    call (and every later one) goes straight to the local engine instead.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.path = SocketPath(engine)
+        self.local = threading.local()
+        self.fallback = None
+
+    def Connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def FallBack(self):
+        if self.fallback is None:
+            print(f"queuectl: the {self.engine} daemon stopped, using storage directly.", file=sys.stderr)
+            self.fallback = OpenStorage(self.engine)
+        return self.fallback
+
+    def RunLocally(self, op, *args, **kwargs):
+        if op in PAGE_OPERATIONS:
+            return PAGE_OPERATIONS[op](self.FallBack(), *args, **kwargs)
+        return getattr(self.FallBack(), op)(*args, **kwargs)
+
+    def Call(self, op, *args, **kwargs):
+        if self.fallback is not None:
+            return self.RunLocally(op, *args, **kwargs)
+        sock = getattr(self.local, 'sock', None)
+        try:
+            if sock is None:
+                sock = self.local.sock = self.Connect()
+            SendMessage(sock, {'op': op, 'args': args, 'kwargs': kwargs})
+        except OSError:
+            # NOTHING REACHED THE DAEMON, SO RUNNING THE CALL LOCALLY CANNOT APPLY IT TWICE
+            self.local.sock = None
+            return self.RunLocally(op, *args, **kwargs)
+        try:
+            reply = ReceiveMessage(sock)
+        except OSError:
+            reply = None
+        if reply is None:
+            self.local.sock = None
+            self.FallBack()
+            if op in READ_OPERATIONS:
+                return self.Call(op, *args, **kwargs)
+            if op in CLAIM_OPERATIONS:
+                return []
+            raise DaemonGone(f"The queue daemon went away during {op}; it may or may not have been applied.")
+        if 'error' in reply:
+            errorType = StorageErrors.get(reply['type']) or getattr(builtins, reply['type'], None)
+            if not (isinstance(errorType, type) and issubclass(errorType, Exception)):
+                errorType = RuntimeError
+            raise errorType(reply['error'])
+        return reply['result']
+
+    def IterJobs(self, state=None, after=None, queue=None):
+        return self.IterPages('JobsPage', after, state=state, queue=queue)
+
+    def IterDlq(self, after=None, queue=None):
+        return self.IterPages('DlqPage', after, queue=queue)
+
+    def IterPages(self, pageOperation, after, **kwargs):
+        while True:
+            page = self.Call(pageOperation, after=after, **kwargs)
+            yield from page
+            if len(page) < ITER_PAGE_SIZE:
+                return
+            after = page[-1]['id']
+
+    def RenewLeases(self, claims, expiresAt):
+        return set(self.Call('RenewLeases', claims, expiresAt))
+
+    def CountActiveByPriority(self):
+        return {(state, priority): count for state, priority, count in self.Call('CountActiveByPriority')}
+
+    def PurgeFinished(self, kind, cutoff, keepCount, onPurge, limit=1000):
+        # A CALLBACK CANNOT CROSS THE SOCKET: THE DAEMON ARCHIVES WHAT IT PURGES ITSELF,
+        # WITH THE WriteArchive CALLBACK JobManager.CollectGarbage PASSES
+        if self.fallback is not None:
+            return self.fallback.PurgeFinished(kind, cutoff, keepCount, onPurge, limit)
+        return self.Call('PurgeFinished', kind, cutoff, keepCount, None, limit)
+
+
+def ForwardOperation(name):
+    def Forward(self, *args, **kwargs):
+        return self.Call(name, *args, **kwargs)
+    Forward.__name__ = name
+    return Forward
+
+for operation in StorageOperations:
+    if operation not in vars(RemoteBackend):
+        setattr(RemoteBackend, operation, ForwardOperation(operation))
+InstrumentStorage(RemoteBackend, 'daemon', StorageOperations)
+
+def ConnectDaemon(engine):
+    """Returns a RemoteBackend if a daemon is serving engine here, else None."""
+    if not SUPPORTS_SOCKET_WAKEUP or not os.path.exists(SocketPath(engine)):
+        return None
+    backend = RemoteBackend(engine)
+    try:
+        backend.local.sock = backend.Connect()
+    except OSError:
+        # A SOCKET FILE LEFT BEHIND BY A DAEMON THAT DID NOT EXIT CLEANLY
+        return None
+    return backend
+
+
+class StorageRequestHandler(socketserver.BaseRequestHandler):
+    """
+    Serves one client connection: requests are answered in order until it closes
+    or the daemon stops. A request already received is always answered first.
+    """
+    def handle(self):
+        backend = self.server.backend
+        while True:
+            with self.server.connectionsLock:
+                if self.server.stopping:
+                    return
+                self.server.idleConnections.add(self.request)
+            try:
+                request = ReceiveMessage(self.request)
+            except (OSError, ValueError):
+                return
+            finally:
+                with self.server.connectionsLock:
+                    self.server.idleConnections.discard(self.request)
+            if request is None:
+                return
+            try:
+                reply = {'result': self.Dispatch(backend, request)}
+            except Exception as error:
+                reply = {'error': str(error), 'type': type(error).__name__}
+            try:
+                SendMessage(self.request, reply)
+            except TypeError as error:
+                SendMessage(self.request, {'error': f"Result of {request['op']} is not JSON: {error}", 'type': 'TypeError'})
+            except OSError:
+                return
+
+    @staticmethod
+    def Dispatch(backend, request):
+        op = request['op']
+        args = request.get('args', [])
+        kwargs = request.get('kwargs', {})
+        if op in PAGE_OPERATIONS:
+            return PAGE_OPERATIONS[op](backend, *args, **kwargs)
+        if op not in StorageOperations:
+            raise ValueError(f"Unknown operation '{op}'.")
+        if op == 'PurgeFinished':
+            kind = args[0]
+            args = [*args[:3], lambda jobs: WriteArchive(kind, jobs), *args[4:]]
+        result = getattr(backend, op)(*args, **kwargs)
+        return ResultEncoders[op](result) if op in ResultEncoders else result
+
+
+class StorageServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # server_close() WAITS FOR EVERY HANDLER, SO NO ANSWER IS CUT OFF AT SHUTDOWN
+    block_on_close = True
+
+    def __init__(self, path, backend):
+        self.backend = backend
+        self.connectionsLock = threading.Lock()
+        self.idleConnections = set()
+        self.stopping = False
+        super().__init__(path, StorageRequestHandler)
+
+    def Drain(self):
+        """Closes idle connections now and busy ones once their current request is answered."""
+        with self.connectionsLock:
+            self.stopping = True
+            for connection in self.idleConnections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def StartDaemon(engine):
+    """
+    Binds the daemon socket for engine and returns the server, ready for
+    serve_forever(). Raises RuntimeError if another daemon is already serving it.
+    """
+    if not SUPPORTS_SOCKET_WAKEUP:
+        raise RuntimeError("The queue daemon needs Unix domain sockets, which this platform lacks.")
+    if engine not in StorageEngines:
+        raise RuntimeError(f"Unknown storage engine '{engine}'. Choose from: {', '.join(StorageEngines)}")
+    path = SocketPath(engine)
+    os.makedirs(DAEMON_DIR, exist_ok=True)
+    if os.path.exists(path):
+        if ConnectDaemon(engine) is not None:
+            raise RuntimeError(f"A daemon is already serving {engine} storage at {path}.")
+        os.remove(path)
+    # THE DAEMON ITSELF MUST USE THE ENGINE DIRECTLY, NOT CALL ITSELF THROUGH THE SOCKET
+    backend = StorageInstances[engine] = OpenStorage(engine)
+    # WARM THE CACHES (PARSED FILE, CONNECTION, STATS) BEFORE THE FIRST CLIENT ARRIVES
+    backend.CountByState()
+    backend.GetStats()
+    oldMask = os.umask(0o177)
+    try:
+        server = StorageServer(path, backend)
+    finally:
+        os.umask(oldMask)
+    return server
+
+def StopDaemon(server):
+    # THE SOCKET FILE GOES FIRST SO NEW COMMANDS USE STORAGE DIRECTLY WHILE THIS DRAINS
+    try:
+        os.remove(server.server_address)
+    except OSError:
+        pass
+    server.Drain()
+    server.server_close()
@@ -1,56 +1,134 @@
 # dashboard.py - A MINIMAL FLASK WEB DASHBOARD (DEFINITIVELY CORRECTED)
-from flask import Flask, render_template, abort
-from .db import GetDbConnection, JobQuery, DatabaseLock
+from flask import Flask, Response, render_template, request, jsonify
+from .db import GetStorage, QUERY_SORTS
+from .shards import ValidateQueueName
+from .record import ParseTime, ForDisplay
+from .instrument import RenderOpenMetrics, CONTENT_TYPE
 import os
 import click
 
 template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
 app = Flask(__name__, template_folder=template_dir)
 
-# DEFINING LOGICAL DEFAULTS FOR SORTING
-# OLD TIMESTAMP: FOR DESCENDING SORTS (NEWEST FIRST).
-# FUTURE TIMESTAMP: FOR ASCENDING SORTS (OLDEST FIRST).
-OLDEST_TIMESTAMP = "1970-01-01T00:00:00+00:00"
-NEWEST_TIMESTAMP = "9999-12-31T23:59:59+00:00"
+# THE SECTIONS THE PAGE SHOWS, IN ORDER, WITH THEIR DEFAULT SORT
+DASHBOARD_SECTIONS = [
+    {'state': 'processing', 'title': 'Processing', 'sort': 'updated', 'order': 'asc'},
+    {'state': 'pending', 'title': 'Pending', 'sort': 'priority', 'order': 'asc'},
+    {'state': 'completed', 'title': 'Completed', 'sort': 'updated', 'order': 'desc'},
+    {'state': 'failed', 'title': 'Failed (Retryable)', 'sort': 'updated', 'order': 'desc'},
+    {'state': 'dlq', 'title': 'Dead Letter Queue (DLQ)', 'sort': 'updated', 'order': 'desc'},
+]
+JOB_STATES = [section['state'] for section in DASHBOARD_SECTIONS]
+
+# PAGE SIZE LIMITS FOR /api/jobs
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 200
+
+class ApiError(Exception):
+    """A bad API request, reported to the caller as a 400 with a JSON body."""
+
+@app.errorhandler(ApiError)
+def HandleApiError(error):
+    return jsonify({'error': str(error)}), 400
+
+def IntArgument(name, default, low, high):
+    value = request.args.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ApiError(f"'{name}' must be an integer.")
+    if not low <= value <= high:
+        raise ApiError(f"'{name}' must be between {low} and {high}.")
+    return value
+
+def QueueArgument():
+    """The optional 'queue' argument: one named queue, or None for all of them."""
+    value = request.args.get('queue')
+    if not value:
+        return None
+    try:
+        return ValidateQueueName(value)
+    except ValueError as error:
+        raise ApiError(str(error))
+
+def TimeArgument(name):
+    """Parses an ISO timestamp argument (naive means UTC) into the epoch form timestamps are stored in."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return ParseTime(value)
+    except ValueError:
+        raise ApiError(f"'{name}' must be an ISO 8601 timestamp.")
 
 @app.route('/')
 def index():
     """
-    Main route to display the dashboard. Fetches all data and renders it.
-    It's wrapped in a try/except to prevent the server from crashing.
+    Serves the page shell. The jobs themselves are fetched page by page from the
+    JSON API, and only the sections that changed are fetched again.
     """
-    try:
-        with DatabaseLock:
-            db = GetDbConnection()
-            JobsTable = db.table('Jobs')
-            DlqTable = db.table('DLQ')
-            all_jobs = JobsTable.all()
-            dlq_jobs = DlqTable.all()
-            db.close()
-        
-        # CATEGORIZE JOBS BY STATE
-        pending = [j for j in all_jobs if j['state'] == 'pending']
-        processing = [j for j in all_jobs if j['state'] == 'processing']
-        completed = [j for j in all_jobs if j['state'] == 'completed']
-        failed = [j for j in all_jobs if j['state'] == 'failed']
-
-        # SORT JOBS WITHIN EACH CATEGORY
-        pending.sort(key=lambda j: j.get('created_at', NEWEST_TIMESTAMP))
-        processing.sort(key=lambda j: j.get('started_at', NEWEST_TIMESTAMP))
-        completed.sort(key=lambda j: j.get('finished_at', OLDEST_TIMESTAMP), reverse=True)
-        failed.sort(key=lambda j: j.get('updated_at', OLDEST_TIMESTAMP), reverse=True)
-        dlq_jobs.sort(key=lambda j: j.get('updated_at', OLDEST_TIMESTAMP), reverse=True)
-        
-        return render_template(
-            'dashboard.html',
-            pending=pending,
-            processing=processing,
-            completed=completed,
-            failed=failed,
-            dlq=dlq_jobs
-        )
-    except Exception as e:
-        abort(500, description=f"An error occurred while reading the database: {e}")
+    return render_template('dashboard.html', sections=DASHBOARD_SECTIONS, pageSize=DEFAULT_PAGE_SIZE)
+
+@app.route('/api/summary')
+def ApiSummary():
+    """
+    Job counts by state (of one queue with ?queue=), the queues there are, and
+    the change cursor to poll /api/changes from.
+    """
+    storage = GetStorage()
+    _, cursor, _ = storage.ChangesSince(None, 0)
+    return jsonify({'counts': storage.CountByState(queue=QueueArgument()), 'queues': storage.ListQueues(), 'cursor': cursor})
+
+@app.route('/api/jobs')
+def ApiJobs():
+    """
+    One page of jobs in a state. Query parameters: state (required; 'dlq' for the
+    DLQ), limit, offset, sort (updated, created_at, priority or run_at), order
+    (asc or desc), id_prefix, created_from / created_to (ISO timestamps), and
+    queue (every queue when left out).
+    """
+    state = request.args.get('state')
+    if state not in JOB_STATES:
+        raise ApiError(f"'state' must be one of: {', '.join(JOB_STATES)}.")
+    sort = request.args.get('sort', 'updated')
+    if sort not in QUERY_SORTS:
+        raise ApiError(f"'sort' must be one of: {', '.join(QUERY_SORTS)}.")
+    order = request.args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        raise ApiError("'order' must be 'asc' or 'desc'.")
+    limit = IntArgument('limit', DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    offset = IntArgument('offset', 0, 0, 10 ** 9)
+
+    jobs, total = GetStorage().QueryJobs(
+        state,
+        idPrefix=request.args.get('id_prefix') or None,
+        createdFrom=TimeArgument('created_from'),
+        createdTo=TimeArgument('created_to'),
+        sort=sort,
+        descending=(order == 'desc'),
+        limit=limit,
+        offset=offset,
+        queue=QueueArgument(),
+    )
+    jobs = [ForDisplay(job) for job in jobs]
+    return jsonify({'state': state, 'jobs': jobs, 'total': total, 'limit': limit, 'offset': offset})
+
+@app.route('/api/changes')
+def ApiChanges():
+    """
+    Delta polling: the ids and current states of jobs written since the given
+    cursor, plus fresh counts. 'full_refresh' tells the page to reload every
+    section instead, e.g. when the storage engine keeps no change log.
+    """
+    storage = GetStorage()
+    rows, cursor, fullRefresh = storage.ChangesSince(request.args.get('since'))
+    counts = storage.CountByState() if rows or fullRefresh else None
+    return jsonify({'cursor': cursor, 'changes': rows, 'full_refresh': fullRefresh, 'counts': counts})
+
+@app.route('/metrics')
+def metrics():
+    """OpenMetrics exposition: queue depth from storage plus this process's own timings."""
+    return Response(RenderOpenMetrics(), content_type=CONTENT_TYPE)
 
 
 def RunDashboard():
@@ -62,4 +140,4 @@ def RunDashboard():
     app.run(host='127.0.0.1', port=5000, debug=False, use_reloader=False)
 
 if __name__ == '__main__':
-    RunDashboard()
\ No newline at end of file
+    RunDashboard()
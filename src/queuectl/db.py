@@ -1,13 +1,1646 @@
 # db.py - HANDLES DATABASE INITIALIZATION AND ACCESS
+import os
+import json
+import sqlite3
 import threading
+import time
+import copy
+from contextlib import contextmanager
+from itertools import chain
 from tinydb import TinyDB, Query
+from tinydb.storages import JSONStorage
+from tinydb.middlewares import CachingMiddleware
+from .stats import RecordOutcomes, BuildStats
+from .archive import FinishedAt, ReadArchive
+from .record import DEFAULT_QUEUE, SCHEMA_VERSION, FIELD_DEFAULTS, Compact, Upgrade, ApplyUpdates, ParseTime, FormatTime
+from .instrument import TimedLock, Gauge, LockWaitSeconds, TinyDbIoSeconds, InstrumentStorage
 
-# A GLOBAL LOCK TO PREVENT PHYSICAL RACE CONDITIONS ON THE DATABASE FILE
-DatabaseLock = threading.Lock()
+try:
+    import fcntl
+except ImportError:  # WINDOWS
+    fcntl = None
+    import msvcrt
+
+# ONE IN-PROCESS LOCK PER DATABASE FILE TO PREVENT PHYSICAL RACE CONDITIONS ON IT,
+# SO WRITES TO DIFFERENT QUEUE SHARDS NEVER WAIT FOR EACH OTHER. ACQUIRE WAITS ARE
+# RECORDED IN queuectl_lock_wait_seconds{lock="database"}.
+DatabaseLocks = {}
+DatabaseLocksGuard = threading.Lock()
+
+def DatabaseLock(path):
+    """Returns the process-wide write lock of the database file at path."""
+    path = os.path.abspath(path)
+    with DatabaseLocksGuard:
+        if path not in DatabaseLocks:
+            DatabaseLocks[path] = TimedLock(LockWaitSeconds, 'database')
+        return DatabaseLocks[path]
 
 # A QUERY OBJECT FOR SEARCHING
 JobQuery = Query()
 
-def GetDbConnection():
+# STORAGE LOCATIONS AND ENGINE SELECTION
+TINYDB_PATH = 'jobs_database.json'
+SQLITE_PATH = 'jobs_database.db'
+DEFAULT_ENGINE = 'sqlite'
+
+# STATES A WORKER MAY CLAIM ONCE run_at HAS PASSED ('failed' JOBS ARE AWAITING A RETRY)
+CLAIMABLE_STATES = ('pending', 'failed')
+
+# ORDERINGS QueryJobs SUPPORTS. 'updated' IS MOST RECENTLY WRITTEN FIRST WHEN DESCENDING.
+QUERY_SORTS = ('updated', 'created_at', 'priority', 'run_at')
+
+# ROWS FETCHED PER READ WHEN STREAMING JOBS WITH IterJobs / IterDlq
+ITER_PAGE_SIZE = 500
+
+# JSON SEPARATORS FOR STORED DOCUMENTS: NO PADDING AFTER ',' AND ':'
+COMPACT_JSON = (',', ':')
+
+class DuplicateJobError(ValueError):
+    """An enqueued job repeats a stored job id, or a dedup_key another job still holds."""
+
+def DuplicateReason(job, idTaken, holder):
+    """
+    Why job may not be inserted, or None. idTaken says whether its id is already
+    stored; holder is the (jobId, expiresAt) entry of its dedup_key, if any.
+    """
+    if idTaken:
+        return f"Job {job['id']} already exists."
+    if holder and holder[1] > job['created_at']:
+        return f"Dedup key {job['dedup_key']!r} belongs to job {holder[0]} until {FormatTime(holder[1])}."
+    return None
+
+def Rejection(index, job, reason):
+    """One entry of the list InsertJobs returns for the jobs it skipped."""
+    return {'index': index, 'id': job['id'], 'reason': reason}
+
+def ArchivedJobs(backend, kind):
+    """
+    The archived jobs a backend folds into a first-time stats rebuild. Every queue
+    archives into the one archive directory, so only the default queue's shard counts it.
+    """
+    return ReadArchive(kind) if backend.countsArchive else ()
+
+def LeaseDeadline(job):
+    """When a processing job's lease runs out. Claims from before leases existed count from their last write."""
+    return job.get('lease_expires_at') or job.get('updated_at') or job['created_at']
+
+def OutcomeJobId(outcome):
+    return outcome[1] if outcome[0] == 'update' else outcome[1]['id']
+
+def OutcomeLeaseToken(outcome):
+    """The lease token of the claim an outcome concludes, or None for a write that concludes no claim."""
+    return outcome[3] if outcome[0] == 'update' else outcome[2]
+
+def HoldsLease(job, outcome):
+    """Whether outcome may be applied to the stored job (None if missing): it is still held under the outcome's lease."""
+    leaseToken = OutcomeLeaseToken(outcome)
+    return leaseToken is None or (job is not None and job.get('lease_token') == leaseToken)
+
+def PrefixUpperBound(prefix):
+    """The smallest string greater than every string starting with prefix, for index range scans."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+# ON POSIX A FILE CAN BE REPLACED WHILE OTHERS HAVE IT OPEN, SO THE JSON ENGINE
+# WRITES A NEW FILE AND RENAMES IT INTO PLACE, AND READERS SKIP THE LOCK. WINDOWS
+# REFUSES TO REPLACE AN OPEN FILE, SO THERE WRITES STAY IN PLACE AND READS LOCK.
+ATOMIC_REPLACE = os.name == 'posix'
+
+class AtomicJSONStorage(JSONStorage):
+    """
+    JSONStorage that records how long each full-file parse and rewrite takes,
+    and with ATOMIC_REPLACE publishes every write by renaming a finished copy
+    over the file, so a reader opening it never sees a half-written document.
+    """
+    def read(self):
+        with TinyDbIoSeconds.Time('read'):
+            return super().read()
+
+    def write(self, data):
+        with TinyDbIoSeconds.Time('write'):
+            if not ATOMIC_REPLACE:
+                super().write(data)
+                return
+            path = self._handle.name
+            tempPath = path + '.tmp'
+            serialized = json.dumps(data, **self.kwargs)
+            with open(tempPath, 'w') as tempFile:
+                tempFile.write(serialized)
+                tempFile.flush()
+                os.fsync(tempFile.fileno())
+            os.replace(tempPath, path)
+            # THE OLD HANDLE STILL POINTS AT THE REPLACED FILE
+            self._handle.close()
+            self._handle = open(path, mode=self._mode)
+
+def GetDbConnection(path=TINYDB_PATH):
     """Creates a new TinyDB instance for an operation."""
-    return TinyDB('jobs_database.json')
\ No newline at end of file
+    return TinyDB(path, storage=AtomicJSONStorage, separators=COMPACT_JSON)
+
+def GetBatchConnection(path=TINYDB_PATH):
+    """
+    A TinyDB instance whose writes are held until close(), so a multi-step change
+    costs one parse and one write and readers see all of it or none of it.
+    """
+    return TinyDB(path, storage=CachingMiddleware(AtomicJSONStorage), separators=COMPACT_JSON)
+
+
+class FileLock:
+    """
+    A cross-process exclusive lock on a sidecar '.lock' file. It also takes the
+    file's DatabaseLock, so threads of the same process queue up before touching it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+        self.threadLock = DatabaseLock(path)
+
+    def __enter__(self):
+        self.threadLock.acquire()
+        try:
+            self.handle = open(self.path, 'a+')
+            startTime = time.perf_counter()
+            if fcntl:
+                fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX)
+            else:
+                self.handle.seek(0)
+                msvcrt.locking(self.handle.fileno(), msvcrt.LK_LOCK, 1)
+            LockWaitSeconds.Observe(time.perf_counter() - startTime, 'file')
+        except Exception:
+            if self.handle:
+                self.handle.close()
+            self.threadLock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl:
+                fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+            else:
+                self.handle.seek(0)
+                msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.handle.close()
+            self.threadLock.release()
+
+
+class StorageBackend:
+    """
+    The interface every storage engine implements. JobManager, the CLI and the
+    dashboard only talk to storage through these methods. An engine holds one
+    queue; ShardedStorage (shards.py) spreads named queues over one engine per
+    queue and adds a queue keyword to the claim, listing and counting methods.
+    """
+    def InsertJob(self, job):
+        """Inserts one job. Raises DuplicateJobError if InsertJobs would skip it."""
+        rejected = self.InsertJobs([job])
+        if rejected:
+            raise DuplicateJobError(rejected[0]['reason'])
+
+    def InsertJobs(self, jobs):
+        """
+        Inserts a list of jobs in one transaction, skipping duplicates: a job whose
+        id is already stored (as a job or a DLQ entry) or comes earlier in the list,
+        or whose dedup_key another job holds past its created_at. A job with a
+        dedup_key holds it until its dedup_expires_at. Returns the skipped jobs as
+        [{'index', 'id', 'reason'}], index being the position in jobs.
+        """
+        raise NotImplementedError
+
+    def GetJob(self, jobId):
+        raise NotImplementedError
+
+    def ClaimPending(self, now, updates, limit=1):
+        """
+        Atomically picks up to `limit` of the best due claimable jobs in one
+        transaction, applies updates and returns them as a list. Must be safe
+        across processes: a job is only ever handed to one caller.
+        """
+        raise NotImplementedError
+
+    def ClaimByIds(self, jobIds, now, updates):
+        """
+        Claims the given jobs, skipping any that are no longer claimable or due.
+        Same cross-process guarantee as ClaimPending.
+        """
+        raise NotImplementedError
+
+    def ClaimableChangesSince(self, cursor):
+        """
+        Returns (rows, newCursor, isFullSnapshot). Rows carry id, state, priority,
+        created_at and run_at. With cursor None, or when the engine cannot produce
+        a delta, rows are every claimable job and isFullSnapshot is True;
+        otherwise they are the jobs written since cursor, in any state.
+        """
+        raise NotImplementedError
+
+    def ReleaseClaims(self, claims, updates):
+        """
+        Applies updates to each (jobId, leaseToken) claim that is still held with
+        that token. Used to hand unstarted jobs back to the queue.
+        """
+        raise NotImplementedError
+
+    def RenewLeases(self, claims, expiresAt):
+        """
+        Moves lease_expires_at to expiresAt for each (jobId, leaseToken) claim that
+        is still processing under that token. Returns the set of job ids renewed.
+        """
+        raise NotImplementedError
+
+    def FindExpiredLeases(self, now, limit=100):
+        """Returns up to limit processing jobs whose lease ran out before now, oldest first."""
+        raise NotImplementedError
+
+    def ReapLeases(self, outcomes, now):
+        """
+        Applies outcomes like ApplyOutcomes, but only those whose job is still
+        processing under the outcome's lease token with a lease expired before
+        now, so a late heartbeat wins over the reaper. Returns the outcomes applied.
+        """
+        raise NotImplementedError
+
+    def UpdateJob(self, jobId, updates):
+        raise NotImplementedError
+
+    def MoveToDlq(self, job):
+        raise NotImplementedError
+
+    def ApplyOutcomes(self, outcomes):
+        """
+        Applies a batch of ('update', jobId, updates, leaseToken) and ('dlq', job,
+        leaseToken) outcomes in one transaction, in order. leaseToken is that of
+        the claim the outcome concludes: once the job is no longer held under it
+        (its lease was reaped, and it may have been claimed again) the outcome is
+        dropped. A leaseToken of None applies it regardless. Returns the outcomes applied.
+        """
+        raise NotImplementedError
+
+    def RetryFromDlq(self, jobId, updates):
+        """Moves a job from the DLQ back to the jobs table. Returns False if missing."""
+        raise NotImplementedError
+
+    def SearchJobs(self, state=None):
+        raise NotImplementedError
+
+    def IterJobs(self, state=None, after=None):
+        """
+        Yields jobs (optionally only those in state) in id order, starting after
+        the job id `after`. A generator, so callers can stop early and memory
+        stays bounded however many jobs match.
+        """
+        raise NotImplementedError
+
+    def IterDlq(self, after=None):
+        """Yields DLQ entries in id order, starting after the job id `after`."""
+        raise NotImplementedError
+
+    def QueryJobs(self, state, idPrefix=None, createdFrom=None, createdTo=None, sort='updated', descending=True, limit=50, offset=0):
+        """
+        Returns (jobs, total): one page of the jobs in state ('dlq' for the dead
+        letter queue) matching the filters, and how many match in all. sort is
+        one of QUERY_SORTS; createdFrom and createdTo bound created_at (ISO strings).
+        """
+        raise NotImplementedError
+
+    def ChangesSince(self, cursor, limit=500):
+        """
+        Returns (rows, newCursor, isFullRefresh) for change polling. Rows carry the
+        id and current state ('dead' for DLQ entries) of jobs written after cursor,
+        at most limit of them. isFullRefresh is True when the engine cannot list
+        the changes (jobs purged since cursor, or more than limit changes) and the caller should reload;
+        a cursor of None always gets a full refresh, with the current cursor.
+        """
+        raise NotImplementedError
+
+    def ListDlq(self):
+        raise NotImplementedError
+
+    def CountByState(self):
+        """Returns job counts keyed by state, plus a 'dlq' entry."""
+        raise NotImplementedError
+
+    def CountActiveByPriority(self):
+        """Returns {(state, priority): count} for jobs that are not yet completed."""
+        raise NotImplementedError
+
+    def GetStats(self):
+        """
+        Returns the running stats document (see stats.py) that ApplyOutcomes
+        keeps up to date, rebuilding it from stored and archived jobs the first time.
+        """
+        raise NotImplementedError
+
+    def PurgeFinished(self, kind, cutoff, keepCount, onPurge, limit=1000):
+        """
+        Deletes up to limit expired records of kind, oldest first: 'completed' jobs
+        or 'dlq' entries that finished before cutoff (an ISO timestamp, or None),
+        or that fall outside the newest keepCount (0 keeps any number). onPurge(jobs)
+        runs inside the write transaction before the delete, so if it raises nothing
+        is deleted. Returns the number deleted.
+        """
+        raise NotImplementedError
+
+    def Compact(self):
+        """Hands space left by deleted records back to the filesystem. Returns the bytes freed."""
+        raise NotImplementedError
+
+    def GetConfig(self, configKey):
+        raise NotImplementedError
+
+    def SetConfig(self, configKey, configValue):
+        raise NotImplementedError
+
+    def GetAllConfig(self):
+        """Returns every stored config value as a dict, in one read."""
+        raise NotImplementedError
+
+    def ConfigVersion(self):
+        """
+        Returns a cheap token that changes whenever the stored config may have
+        changed. It may also change when nothing in the config did; callers
+        only use it to decide whether to reload.
+        """
+        raise NotImplementedError
+
+    def ListQueues(self):
+        """Returns the names of the queues stored, DEFAULT_QUEUE first. A single file holds just that one."""
+        return [DEFAULT_QUEUE]
+
+
+class TinyDbBackend(StorageBackend):
+    """
+    The original JSON file engine. Every write reparses and rewrites the file,
+    under a FileLock so several worker processes can share it without tearing it.
+    Reads parse a published snapshot of the file without the lock (see
+    ATOMIC_REPLACE) and reuse it until the file is replaced again. The file's
+    'Schema' table records its SCHEMA_VERSION; an older file is upgraded in
+    place the first time this process opens it.
+    """
+    def __init__(self, path=TINYDB_PATH, countsArchive=True):
+        self.path = path
+        self.countsArchive = countsArchive
+        self.snapshotLock = threading.Lock()
+        self.snapshot = None
+        self.snapshotIndexes = (None, {})
+        self.schemaCurrent = False
+
+    def Lock(self):
+        return FileLock(self.path + '.lock')
+
+    def Connect(self, batch=False):
+        """
+        Opens the file for a write (see GetBatchConnection for batch); callers hold
+        self.Lock(). The schema check reads the tables TinyDB has just parsed, so it
+        only costs anything on a file that needs upgrading.
+        """
+        db = GetBatchConnection(self.path) if batch else GetDbConnection(self.path)
+        if not self.schemaCurrent:
+            self.UpgradeSchema(db)
+        return db
+
+    @staticmethod
+    def FileSchema(tables):
+        """The schema version of a file's {tableName: [documents]}. Files from before versioning are 1."""
+        rows = tables.get('Schema') or [{'version': 1}]
+        return rows[0]['version']
+
+    def UpgradeSchema(self, db):
+        """Rewrites every job, DLQ entry and dedup key of an older file in the current schema."""
+        SchemaTable = db.table('Schema')
+        if self.FileSchema({'Schema': SchemaTable.all()}) < SCHEMA_VERSION:
+            for name in ('Jobs', 'DLQ'):
+                table = db.table(name)
+                docs = [Upgrade(doc) for doc in table.all()]
+                table.truncate()
+                table.insert_multiple(docs)
+            DedupTable = db.table('Dedup')
+            rows = [{**row, 'expires_at': ParseTime(row['expires_at'])} for row in DedupTable.all()]
+            DedupTable.truncate()
+            DedupTable.insert_multiple(rows)
+            SchemaTable.truncate()
+            SchemaTable.insert({'version': SCHEMA_VERSION})
+        self.schemaCurrent = True
+
+    def ReadSnapshot(self):
+        """
+        Returns {tableName: [documents]} for the current file. The result is shared
+        with other readers until the next write, so callers must copy before changing it.
+        """
+        return self.VersionedSnapshot()[1]
+
+    def VersionedSnapshot(self):
+        if not ATOMIC_REPLACE:
+            with self.Lock():
+                snapshot = self.ParseFile()
+        else:
+            snapshot = self.ParseFile()
+        if not self.schemaCurrent:
+            tables = snapshot[1]
+            if self.FileSchema(tables) >= SCHEMA_VERSION:
+                self.schemaCurrent = True
+            elif tables.get('Jobs') or tables.get('DLQ') or tables.get('Dedup'):
+                # READERS NEVER COMPARE AN OLD FILE'S ISO STRINGS WITH EPOCH NUMBERS
+                with self.Lock():
+                    self.Connect(batch=True).close()
+                return self.VersionedSnapshot()
+        return snapshot
+
+    def IdIndex(self, tableName):
+        """
+        Returns {id: document} over tableName in the current snapshot, built on first
+        use and kept until the file changes, so lookups by id cost O(1). Shared like
+        ReadSnapshot's result.
+        """
+        version, tables = self.VersionedSnapshot()
+        with self.snapshotLock:
+            if self.snapshotIndexes[0] != version:
+                self.snapshotIndexes = (version, {})
+            index = self.snapshotIndexes[1].get(tableName)
+        if index is None:
+            index = {doc['id']: doc for doc in tables.get(tableName, [])}
+            with self.snapshotLock:
+                if self.snapshotIndexes[0] == version:
+                    self.snapshotIndexes[1][tableName] = index
+        return index
+
+    @staticmethod
+    def DocIds(table):
+        """
+        Returns {id: doc_id} for an open table. Writes reparse the file anyway, so one
+        pass to build this lets every lookup by id in the transaction skip a scan.
+        """
+        return {doc['id']: doc.doc_id for doc in table}
+
+    def StoredIds(self, jobIds):
+        """Returns the ids among jobIds stored here, as jobs or DLQ entries."""
+        jobs, dead = self.IdIndex('Jobs'), self.IdIndex('DLQ')
+        return {jobId for jobId in jobIds if jobId in jobs or jobId in dead}
+
+    def ParseFile(self):
+        try:
+            handle = open(self.path)
+        except FileNotFoundError:
+            return None, {}
+        with handle:
+            # VERSIONED BY THE FILE ACTUALLY OPENED, SO A REPLACE RIGHT AFTER THE open() IS HARMLESS
+            version = self.StatVersion(os.fstat(handle.fileno()))
+            with self.snapshotLock:
+                if self.snapshot is not None and self.snapshot[0] == version:
+                    return self.snapshot
+            with TinyDbIoSeconds.Time('read'):
+                raw = handle.read()
+                data = json.loads(raw) if raw.strip() else {}
+        snapshot = (version, {name: list(docs.values()) for name, docs in data.items()})
+        with self.snapshotLock:
+            self.snapshot = snapshot
+        return snapshot
+
+    @staticmethod
+    def StatVersion(stat):
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def InsertJobs(self, jobs):
+        with self.Lock():
+            db = self.Connect(batch=True)
+            stored = {doc['id'] for doc in db.table('Jobs')} | {doc['id'] for doc in db.table('DLQ')}
+            DedupTable = db.table('Dedup')
+            holders = {row['key']: (row['job_id'], row['expires_at']) for row in DedupTable}
+            accepted, rejected = [], []
+            for index, job in enumerate(jobs):
+                reason = DuplicateReason(job, job['id'] in stored, holders.get(job.get('dedup_key')))
+                if reason:
+                    rejected.append(Rejection(index, job, reason))
+                    continue
+                accepted.append(job)
+                stored.add(job['id'])
+                if job.get('dedup_key'):
+                    holders[job['dedup_key']] = (job['id'], job['dedup_expires_at'])
+            db.table('Jobs').insert_multiple(Compact(job) for job in accepted)
+            if any(job.get('dedup_key') for job in accepted):
+                # THE TABLE IS REWRITTEN WITH THE FILE ANYWAY, SO EXPIRED KEYS ARE DROPPED HERE
+                now = max(job['created_at'] for job in accepted)
+                DedupTable.truncate()
+                DedupTable.insert_multiple(
+                    {'key': key, 'job_id': jobId, 'expires_at': expiresAt}
+                    for key, (jobId, expiresAt) in holders.items() if expiresAt > now
+                )
+            db.close()
+        return rejected
+
+    def GetJob(self, jobId):
+        job = self.IdIndex('Jobs').get(jobId)
+        return dict(job) if job else None
+
+    def ClaimPending(self, now, updates, limit=1):
+        with self.Lock():
+            db = self.Connect()
+            JobsTable = db.table('Jobs')
+
+            # FETCH CANDIDATE JOBS THAT ARE DUE TO RUN
+            candidates = JobsTable.search(
+                (JobQuery.state.one_of(CLAIMABLE_STATES)) &
+                (JobQuery.run_at <= now)
+            )
+
+            if not candidates:
+                db.close()
+                return []
+
+            # SORT CANDIDATES BY PRIORITY AND CREATED_AT
+            candidates.sort(key=lambda j: (j.get('priority', 10), j['created_at']))
+            bestJobs = candidates[:limit]
+
+            JobsTable.update(lambda doc: ApplyUpdates(doc, updates), doc_ids=[j.doc_id for j in bestJobs])
+            for job in bestJobs:
+                ApplyUpdates(job, updates)
+            db.close()
+        return [dict(j) for j in bestJobs]
+
+    def ClaimByIds(self, jobIds, now, updates):
+        with self.Lock():
+            db = self.Connect()
+            JobsTable = db.table('Jobs')
+            docIds = self.DocIds(JobsTable)
+            candidates = (JobsTable.get(doc_id=docIds[jobId]) for jobId in jobIds if jobId in docIds)
+            claimable = [j for j in candidates if j['state'] in CLAIMABLE_STATES and j['run_at'] <= now]
+            if claimable:
+                JobsTable.update(lambda doc: ApplyUpdates(doc, updates), doc_ids=[j.doc_id for j in claimable])
+            db.close()
+        # KEEPING THE CALLER'S ORDER, WHICH IS THE PRIORITY ORDER
+        order = {jobId: i for i, jobId in enumerate(jobIds)}
+        claimable.sort(key=lambda j: order[j['id']])
+        for job in claimable:
+            ApplyUpdates(job, updates)
+        return [dict(j) for j in claimable]
+
+    def ClaimableChangesSince(self, cursor):
+        # THE WHOLE FILE IS REPARSED ANYWAY, SO THE CURSOR ONLY DETECTS "UNCHANGED"
+        # (BY MTIME, SIZE AND INODE) AND EVERY OTHER CALL RETURNS A FULL SNAPSHOT.
+        # A STRING, LIKE ChangesSince's, SO IT SURVIVES A TRIP THROUGH THE DAEMON AS-IS
+        version = self.FileVersion()
+        newCursor = ':'.join(str(v) for v in version) if version else None
+        if cursor is not None and newCursor == cursor:
+            return [], cursor, False
+        rows = [j for j in self.ReadSnapshot().get('Jobs', []) if j['state'] in CLAIMABLE_STATES]
+        keys = ('id', 'state', 'priority', 'created_at', 'run_at')
+        return [{k: j.get(k) for k in keys} for j in rows], newCursor, True
+
+    def HeldClaims(self, JobsTable, claims, state=None):
+        """Yields (jobId, doc_id) for each claim whose job still carries its lease token (and is in state)."""
+        docIds = self.DocIds(JobsTable)
+        for jobId, leaseToken in claims:
+            job = JobsTable.get(doc_id=docIds[jobId]) if jobId in docIds else None
+            if job and job.get('lease_token') == leaseToken and (state is None or job['state'] == state):
+                yield jobId, job.doc_id
+
+    def ReleaseClaims(self, claims, updates):
+        with self.Lock():
+            db = self.Connect(batch=True)
+            JobsTable = db.table('Jobs')
+            held = [docId for _, docId in self.HeldClaims(JobsTable, claims)]
+            if held:
+                JobsTable.update(lambda doc: ApplyUpdates(doc, updates), doc_ids=held)
+            db.close()
+
+    def RenewLeases(self, claims, expiresAt):
+        with self.Lock():
+            db = self.Connect(batch=True)
+            JobsTable = db.table('Jobs')
+            held = list(self.HeldClaims(JobsTable, claims, 'processing'))
+            if held:
+                JobsTable.update({'lease_expires_at': expiresAt}, doc_ids=[docId for _, docId in held])
+            db.close()
+        return {jobId for jobId, _ in held}
+
+    def FindExpiredLeases(self, now, limit=100):
+        # NO INDEX TO USE: THE SNAPSHOT IS ALREADY PARSED, SO THIS IS ONE PASS OVER IT
+        expired = [j for j in self.ReadSnapshot().get('Jobs', []) if j['state'] == 'processing' and LeaseDeadline(j) < now]
+        expired.sort(key=LeaseDeadline)
+        return [dict(j) for j in expired[:limit]]
+
+    def ReapLeases(self, outcomes, now):
+        with self.Lock():
+            db = self.Connect(batch=True)
+            JobsTable = db.table('Jobs')
+            docIds = self.DocIds(JobsTable)
+            expired = []
+            for outcome in outcomes:
+                jobId = OutcomeJobId(outcome)
+                job = JobsTable.get(doc_id=docIds[jobId]) if jobId in docIds else None
+                if job and job['state'] == 'processing' and job.get('lease_token') == OutcomeLeaseToken(outcome) and LeaseDeadline(job) < now:
+                    expired.append(outcome)
+            applied = self.WriteOutcomes(db, expired, docIds)
+            db.close()
+        return applied
+
+    def UpdateJob(self, jobId, updates):
+        self.ApplyOutcomes([('update', jobId, updates, None)])
+
+    def MoveToDlq(self, job):
+        self.ApplyOutcomes([('dlq', job, None)])
+
+    def LoadStats(self, db):
+        rows = db.table('Stats').all()
+        if rows:
+            return dict(rows[0])
+        return BuildStats(
+            chain(db.table('Jobs').search(JobQuery.state == 'completed'), ArchivedJobs(self, 'completed')),
+            chain(db.table('DLQ').all(), ArchivedJobs(self, 'dlq'))
+        )
+
+    def WriteOutcomes(self, db, outcomes, docIds=None):
+        """
+        Applies the outcomes whose lease still holds (see HoldsLease) and folds them
+        into the stats document, on an open connection. docIds is DocIds(Jobs) if
+        the caller already built it. Returns the outcomes applied.
+        """
+        if not outcomes:
+            return []
+        JobsTable = db.table('Jobs')
+        DlqTable = db.table('DLQ')
+        if docIds is None:
+            docIds = self.DocIds(JobsTable)
+        # LOADED FIRST, SO A FIRST-TIME REBUILD DOES NOT ALSO COUNT THIS BATCH
+        stats = self.LoadStats(db)
+        applied = []
+        for outcome in outcomes:
+            jobId = OutcomeJobId(outcome)
+            job = JobsTable.get(doc_id=docIds[jobId]) if jobId in docIds else None
+            if not HoldsLease(job, outcome):
+                continue
+            applied.append(outcome)
+            if outcome[0] == 'update':
+                if job:
+                    JobsTable.update(lambda doc: ApplyUpdates(doc, outcome[2]), doc_ids=[job.doc_id])
+            else:
+                DlqTable.insert(Compact(outcome[1]))
+                if job:
+                    JobsTable.remove(doc_ids=[docIds.pop(jobId)])
+        StatsTable = db.table('Stats')
+        StatsTable.truncate()
+        StatsTable.insert(RecordOutcomes(stats, applied))
+        return applied
+
+    def ApplyOutcomes(self, outcomes):
+        with self.Lock():
+            db = self.Connect(batch=True)
+            applied = self.WriteOutcomes(db, outcomes)
+            db.close()
+        return applied
+
+    def RetryFromDlq(self, jobId, updates):
+        with self.Lock():
+            db = self.Connect(batch=True)
+            DlqTable = db.table('DLQ')
+            docId = self.DocIds(DlqTable).get(jobId)
+            jobToRetry = DlqTable.get(doc_id=docId) if docId is not None else None
+            if jobToRetry:
+                DlqTable.remove(doc_ids=[docId])
+                db.table('Jobs').insert(ApplyUpdates(dict(jobToRetry), updates))
+            db.close()
+        return jobToRetry is not None
+
+    def SearchJobs(self, state=None):
+        return [dict(j) for j in self.ReadSnapshot().get('Jobs', []) if not state or j['state'] == state]
+
+    def ListDlq(self):
+        return [dict(j) for j in self.ReadSnapshot().get('DLQ', [])]
+
+    @staticmethod
+    def IterSorted(docs, after):
+        # THE SNAPSHOT IS ALREADY IN MEMORY; ONLY REFERENCES ARE SORTED, COPIES ARE MADE ONE AT A TIME
+        for job in sorted((j for j in docs if after is None or j['id'] > after), key=lambda j: j['id']):
+            yield dict(job)
+
+    def IterJobs(self, state=None, after=None):
+        jobs = self.ReadSnapshot().get('Jobs', [])
+        return self.IterSorted((j for j in jobs if not state or j['state'] == state), after)
+
+    def IterDlq(self, after=None):
+        return self.IterSorted(self.ReadSnapshot().get('DLQ', []), after)
+
+    def QueryJobs(self, state, idPrefix=None, createdFrom=None, createdTo=None, sort='updated', descending=True, limit=50, offset=0):
+        tables = self.ReadSnapshot()
+        if state == 'dlq':
+            jobs = tables.get('DLQ', [])
+        else:
+            jobs = [j for j in tables.get('Jobs', []) if j['state'] == state]
+        jobs = [
+            j for j in jobs
+            if (not idPrefix or j['id'].startswith(idPrefix))
+            and (not createdFrom or j['created_at'] >= createdFrom)
+            and (not createdTo or j['created_at'] < createdTo)
+        ]
+        sortKeys = {
+            'updated': lambda j: j.get('updated_at') or 0,
+            'created_at': lambda j: j['created_at'],
+            'priority': lambda j: (j.get('priority', 10), j['created_at']),
+            'run_at': lambda j: j.get('run_at') or 0,
+        }
+        jobs.sort(key=sortKeys[sort], reverse=descending)
+        return [dict(j) for j in jobs[offset:offset + limit]], len(jobs)
+
+    def ChangesSince(self, cursor, limit=500):
+        # THE FILE HOLDS NO CHANGE LOG, SO ANY WRITE MEANS "RELOAD"
+        version = self.FileVersion()
+        newCursor = ':'.join(str(v) for v in version) if version else '0'
+        return [], newCursor, cursor is None or str(cursor) != newCursor
+
+    def CountByState(self):
+        tables = self.ReadSnapshot()
+        counts = {}
+        for job in tables.get('Jobs', []):
+            counts[job['state']] = counts.get(job['state'], 0) + 1
+        counts['dlq'] = len(tables.get('DLQ', []))
+        return counts
+
+    def CountActiveByPriority(self):
+        counts = {}
+        for job in self.ReadSnapshot().get('Jobs', []):
+            if job['state'] != 'completed':
+                key = (job['state'], job.get('priority', 10))
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def GetStats(self):
+        tables = self.ReadSnapshot()
+        if tables.get('Stats'):
+            return copy.deepcopy(tables['Stats'][0])
+        return BuildStats(
+            chain((j for j in tables.get('Jobs', []) if j['state'] == 'completed'), ArchivedJobs(self, 'completed')),
+            chain(tables.get('DLQ', []), ArchivedJobs(self, 'dlq'))
+        )
+
+    def PurgeFinished(self, kind, cutoff, keepCount, onPurge, limit=1000):
+        if not cutoff and not keepCount:
+            return 0
+        with self.Lock():
+            db = self.Connect()
+            if kind == 'completed':
+                table = db.table('Jobs')
+                docs = table.search(JobQuery.state == 'completed')
+            else:
+                table = db.table('DLQ')
+                docs = table.all()
+            docs.sort(key=FinishedAt)
+            overflow = len(docs) - keepCount if keepCount else 0
+            expired = [
+                doc for i, doc in enumerate(docs)
+                if i < overflow or (cutoff and FinishedAt(doc) < cutoff)
+            ][:limit]
+            if expired:
+                onPurge([dict(doc) for doc in expired])
+                table.remove(doc_ids=[doc.doc_id for doc in expired])
+            db.close()
+        return len(expired)
+
+    def Compact(self):
+        # EVERY WRITE ALREADY REWRITES THE WHOLE FILE, SO DELETED RECORDS TAKE NO SPACE
+        return 0
+
+    def GetConfig(self, configKey):
+        for row in self.ReadSnapshot().get('Config', []):
+            if row['key'] == configKey:
+                return row['value']
+        return None
+
+    def SetConfig(self, configKey, configValue):
+        with self.Lock():
+            db = self.Connect()
+            db.table('Config').upsert({'key': configKey, 'value': configValue}, Query().key == configKey)
+            db.close()
+
+    def GetAllConfig(self):
+        return {row['key']: row['value'] for row in self.ReadSnapshot().get('Config', [])}
+
+    def FileVersion(self):
+        """Identifies the current database file: changes on every write, costs one stat."""
+        try:
+            return self.StatVersion(os.stat(self.path))
+        except OSError:
+            return None
+
+    def ConfigVersion(self):
+        # THE CONFIG LIVES IN THE SAME FILE AS THE JOBS, SO ANY WRITE BUMPS THIS;
+        # A STAT IS STILL FAR CHEAPER THAN PARSING THE FILE TO FIND OUT
+        return self.FileVersion()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 10,
+    run_at TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_id ON jobs (id);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, priority, created_at);
+CREATE INDEX IF NOT EXISTS jobs_run_at ON jobs (state, run_at);
+CREATE TABLE IF NOT EXISTS dlq (
+    doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dlq_id ON dlq (id);
+CREATE TABLE IF NOT EXISTS config (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# THE jobs AND dedup TABLES FROM MIGRATION 8 ON, WITH REAL TIMESTAMP COLUMNS: A
+# TEXT COLUMN WOULD STORE EPOCH NUMBERS AS STRINGS. THE INDEXES ARE THOSE OF THE
+# SCHEMA AND MIGRATIONS 1 TO 7, AND THE TRIGGERS THOSE OF MIGRATION 3.
+SQLITE_EPOCH_TABLES = """
+CREATE TABLE jobs (
+    doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 10,
+    run_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL,
+    seq INTEGER NOT NULL DEFAULT 0,
+    lease_expires_at REAL
+);
+CREATE INDEX jobs_id ON jobs (id);
+CREATE INDEX jobs_claim ON jobs (state, priority, created_at);
+CREATE INDEX jobs_run_at ON jobs (state, run_at);
+CREATE INDEX jobs_seq ON jobs (seq);
+CREATE INDEX jobs_state_seq ON jobs (state, seq);
+CREATE INDEX jobs_state_created ON jobs (state, created_at);
+CREATE INDEX jobs_state_id ON jobs (state, id);
+CREATE INDEX jobs_lease ON jobs (state, lease_expires_at);
+CREATE TABLE dedup (
+    key TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX dedup_expires ON dedup (expires_at);
+"""
+SQLITE_JOB_TRIGGERS = """
+CREATE TRIGGER jobs_count_insert AFTER INSERT ON jobs BEGIN
+    INSERT OR IGNORE INTO counters (name, value) VALUES ('state:' || NEW.state, 0);
+    UPDATE counters SET value = value + 1 WHERE name = 'state:' || NEW.state;
+END;
+CREATE TRIGGER jobs_count_delete AFTER DELETE ON jobs BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'state:' || OLD.state;
+END;
+CREATE TRIGGER jobs_count_update AFTER UPDATE OF state ON jobs WHEN OLD.state != NEW.state BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'state:' || OLD.state;
+    INSERT OR IGNORE INTO counters (name, value) VALUES ('state:' || NEW.state, 0);
+    UPDATE counters SET value = value + 1 WHERE name = 'state:' || NEW.state;
+END
+"""
+
+# ROWS CONVERTED PER FETCH BY UpgradeJobTables
+UPGRADE_BATCH = 1000
+
+def RunScript(conn, script):
+    # TRIGGER BODIES CONTAIN ';' TOO, SO A PIECE IS ONLY RUN ONCE IT IS A COMPLETE STATEMENT
+    statement = ''
+    for piece in script.split(';'):
+        statement += piece + ';'
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \n;'):
+                conn.execute(statement)
+            statement = ''
+
+def UpgradeJobTables(conn):
+    """
+    Migration 8: copies jobs and dedup into the tables of SQLITE_EPOCH_TABLES and
+    rewrites every job and DLQ document with record.Upgrade. Rows keep their doc_id
+    and seq, so change cursors held by workers and dashboards stay valid.
+    """
+    conn.execute('ALTER TABLE jobs RENAME TO jobs_v1')
+    conn.execute('ALTER TABLE dedup RENAME TO dedup_v1')
+    # THE OLD INDEXES AND TRIGGERS MOVED WITH THE RENAME BUT KEPT THEIR NAMES
+    oldObjects = conn.execute(
+        "SELECT type, name FROM sqlite_master WHERE tbl_name IN ('jobs_v1', 'dedup_v1') AND type != 'table' AND sql IS NOT NULL"
+    ).fetchall()
+    for objectType, name in oldObjects:
+        conn.execute(f'DROP {objectType.upper()} {name}')
+    RunScript(conn, SQLITE_EPOCH_TABLES)
+
+    # COPIED BEFORE THE TRIGGERS EXIST: counters ALREADY COUNTS THESE ROWS
+    rows = conn.execute('SELECT doc_id, seq, data FROM jobs_v1 ORDER BY doc_id')
+    while batch := rows.fetchmany(UPGRADE_BATCH):
+        conn.executemany(
+            'INSERT INTO jobs (id, state, priority, run_at, created_at, lease_expires_at, data, seq, doc_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [SqliteBackend.Columns(Upgrade(json.loads(data))) + (seq, docId) for docId, seq, data in batch]
+        )
+    RunScript(conn, SQLITE_JOB_TRIGGERS)
+    rows = conn.execute('SELECT doc_id, data FROM dlq ORDER BY doc_id')
+    while batch := rows.fetchmany(UPGRADE_BATCH):
+        conn.executemany(
+            'UPDATE dlq SET data = ? WHERE doc_id = ?',
+            [(SqliteBackend.Document(Upgrade(json.loads(data))), docId) for docId, data in batch]
+        )
+    conn.executemany(
+        'INSERT INTO dedup (key, job_id, expires_at) VALUES (?, ?, ?)',
+        [(key, jobId, ParseTime(expiresAt)) for key, jobId, expiresAt in conn.execute('SELECT key, job_id, expires_at FROM dedup_v1')]
+    )
+    conn.execute('DROP TABLE jobs_v1')
+    conn.execute('DROP TABLE dedup_v1')
+
+# SCHEMA CHANGES APPLIED IN ORDER ON TOP OF SQLITE_SCHEMA, TRACKED IN PRAGMA user_version.
+# A STEP IS A SCRIPT, OR A FUNCTION OF THE CONNECTION FOR CHANGES SQL CANNOT EXPRESS.
+SQLITE_MIGRATIONS = {
+    # CHANGE SEQUENCE: EVERY WRITE TRANSACTION STAMPS THE ROWS IT TOUCHES WITH A
+    # NEW, STRICTLY INCREASING seq SO READERS CAN ASK FOR "EVERYTHING SINCE X"
+    1: """
+    ALTER TABLE jobs ADD COLUMN seq INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE dlq ADD COLUMN seq INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX IF NOT EXISTS jobs_seq ON jobs (seq);
+    CREATE INDEX IF NOT EXISTS dlq_seq ON dlq (seq);
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO counters (name, value) VALUES ('seq', 0);
+    """,
+    # CONFIG VERSION: BUMPED BY EVERY SetConfig SO CACHED CONFIG KNOWS WHEN TO RELOAD
+    2: """
+    INSERT OR IGNORE INTO counters (name, value) VALUES ('config', 0);
+    """,
+    # RUNNING STATS: TRIGGERS KEEP A 'state:<state>' COUNTER PER JOB STATE (AND
+    # 'state:dlq') SO `status` NEVER SCANS, AND THE stats TABLE HOLDS THE JSON
+    # DOCUMENT FROM stats.py THAT ApplyOutcomes UPDATES
+    3: """
+    CREATE TABLE IF NOT EXISTS stats (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    DELETE FROM counters WHERE name LIKE 'state:%';
+    INSERT INTO counters (name, value) SELECT 'state:' || state, COUNT(*) FROM jobs GROUP BY state;
+    INSERT INTO counters (name, value) SELECT 'state:dlq', COUNT(*) FROM dlq;
+    CREATE TRIGGER IF NOT EXISTS jobs_count_insert AFTER INSERT ON jobs BEGIN
+        INSERT OR IGNORE INTO counters (name, value) VALUES ('state:' || NEW.state, 0);
+        UPDATE counters SET value = value + 1 WHERE name = 'state:' || NEW.state;
+    END;
+    CREATE TRIGGER IF NOT EXISTS jobs_count_delete AFTER DELETE ON jobs BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'state:' || OLD.state;
+    END;
+    CREATE TRIGGER IF NOT EXISTS jobs_count_update AFTER UPDATE OF state ON jobs WHEN OLD.state != NEW.state BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'state:' || OLD.state;
+        INSERT OR IGNORE INTO counters (name, value) VALUES ('state:' || NEW.state, 0);
+        UPDATE counters SET value = value + 1 WHERE name = 'state:' || NEW.state;
+    END;
+    CREATE TRIGGER IF NOT EXISTS dlq_count_insert AFTER INSERT ON dlq BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'state:dlq';
+    END;
+    CREATE TRIGGER IF NOT EXISTS dlq_count_delete AFTER DELETE ON dlq BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'state:dlq';
+    END
+    """,
+    # DASHBOARD QUERIES: PAGES OF ONE STATE ORDERED BY LAST WRITE OR BY CREATION TIME
+    4: """
+    CREATE INDEX IF NOT EXISTS jobs_state_seq ON jobs (state, seq);
+    CREATE INDEX IF NOT EXISTS jobs_state_created ON jobs (state, created_at);
+    """,
+    # CURSOR PAGINATION: `queuectl list --state X --after ID` WALKS ONE STATE IN id ORDER
+    5: """
+    CREATE INDEX IF NOT EXISTS jobs_state_id ON jobs (state, id);
+    """,
+    # LEASES: A CLAIM EXPIRES UNLESS ITS WORKER KEEPS RENEWING IT. THE REAPER RANGE-SCANS
+    # (state, lease_expires_at), SO IT ONLY EVER READS THE EXPIRED ROWS IT RETURNS.
+    # JOBS LEFT IN PROCESSING BEFORE THIS MIGRATION GET THEIR LAST WRITE AS DEADLINE.
+    6: """
+    ALTER TABLE jobs ADD COLUMN lease_expires_at TEXT;
+    UPDATE jobs SET lease_expires_at = COALESCE(
+        json_extract(data, '$.lease_expires_at'), json_extract(data, '$.updated_at'), created_at
+    ) WHERE state = 'processing';
+    CREATE INDEX IF NOT EXISTS jobs_lease ON jobs (state, lease_expires_at);
+    """,
+    # DEDUP KEYS: WHICH JOB HOLDS EACH KEY AND UNTIL WHEN. EXPIRED ROWS ARE DELETED
+    # BY THE NEXT INSERT THAT CARRIES A KEY, A RANGE SCAN ON expires_at.
+    7: """
+    CREATE TABLE IF NOT EXISTS dedup (
+        key TEXT PRIMARY KEY,
+        job_id TEXT NOT NULL,
+        expires_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS dedup_expires ON dedup (expires_at);
+    """,
+    # JOB SCHEMA 2 (record.py): EPOCH TIMESTAMPS AND COMPACT DOCUMENTS. EVERY DOCUMENT
+    # IS REWRITTEN, SO THIS STEP IS PYTHON (SEE UpgradeJobTables).
+    8: UpgradeJobTables,
+    # ONE ROW PER JOB ID, ENFORCED BY THE DATABASE SO NO WRITE PATH CAN ADD A TWIN.
+    # TWINS ALREADY STORED (E.G. BY A REPEATED `queuectl migrate`) KEEP THEIR FIRST ROW.
+    9: """
+    DELETE FROM jobs WHERE doc_id NOT IN (SELECT MIN(doc_id) FROM jobs GROUP BY id);
+    DELETE FROM dlq WHERE doc_id NOT IN (SELECT MIN(doc_id) FROM dlq GROUP BY id);
+    DROP INDEX IF EXISTS jobs_id;
+    CREATE UNIQUE INDEX jobs_id ON jobs (id);
+    DROP INDEX IF EXISTS dlq_id;
+    CREATE UNIQUE INDEX dlq_id ON dlq (id);
+    """,
+}
+
+# IDS LOOKED UP PER STATEMENT BY StoredIdsIn, TWICE EACH, UNDER SQLITE'S OLDEST 999-PARAMETER LIMIT
+ID_LOOKUP_CHUNK = 400
+
+class SqliteBackend(StorageBackend):
+    """
+    SQLite engine in WAL mode. Jobs are stored as JSON documents next to indexed
+    copies of the columns the claim path filters and sorts on, so each operation
+    touches a handful of pages instead of the whole file.
+    """
+    def __init__(self, path=SQLITE_PATH, countsArchive=True):
+        self.path = path
+        self.countsArchive = countsArchive
+        self.local = threading.local()
+        self.lock = DatabaseLock(path)
+
+    def Connection(self):
+        """Returns this thread's connection, creating the schema on first use."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SQLITE_SCHEMA)
+            self.Migrate(conn)
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def Migrate(conn):
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= max(SQLITE_MIGRATIONS):
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # RE-READ UNDER THE WRITE LOCK IN CASE ANOTHER PROCESS MIGRATED FIRST
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for target in sorted(v for v in SQLITE_MIGRATIONS if v > version):
+                step = SQLITE_MIGRATIONS[target]
+                if callable(step):
+                    step(conn)
+                else:
+                    RunScript(conn, step)
+                conn.execute(f'PRAGMA user_version = {target}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    @contextmanager
+    def ReadSnapshot(self):
+        """
+        Yields this thread's connection inside a read transaction. In WAL mode the
+        reader sees one consistent snapshot and never blocks, or is blocked by,
+        writers, so reads skip the DatabaseLock entirely.
+        """
+        conn = self.Connection()
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
+
+    @contextmanager
+    def Transaction(self):
+        """Yields (connection, seq) inside an immediate write transaction."""
+        with self.lock:
+            conn = self.Connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                seq = conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'seq' RETURNING value").fetchone()[0]
+                yield conn, seq
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    @staticmethod
+    def Document(job):
+        return json.dumps(Compact(job), separators=COMPACT_JSON)
+
+    @staticmethod
+    def Columns(job):
+        return (
+            job['id'], job['state'], job.get('priority', 10), job['run_at'], job['created_at'],
+            job.get('lease_expires_at'), SqliteBackend.Document(job)
+        )
+
+    def InsertJobRow(self, conn, job, seq):
+        conn.execute(
+            'INSERT INTO jobs (id, state, priority, run_at, created_at, lease_expires_at, data, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            self.Columns(job) + (seq,)
+        )
+
+    def WriteJobRow(self, conn, docId, job, seq):
+        conn.execute(
+            'UPDATE jobs SET id = ?, state = ?, priority = ?, run_at = ?, created_at = ?, lease_expires_at = ?, data = ?, seq = ? '
+            'WHERE doc_id = ?',
+            self.Columns(job) + (seq, docId)
+        )
+
+    def InsertDlqRow(self, conn, job, seq):
+        conn.execute('INSERT INTO dlq (id, data, seq) VALUES (?, ?, ?)', (job['id'], self.Document(job), seq))
+
+    @staticmethod
+    def StoredIdsIn(conn, jobIds):
+        """The ids among jobIds in the jobs or dlq table, found through their id indexes."""
+        jobIds = list(jobIds)
+        found = set()
+        for start in range(0, len(jobIds), ID_LOOKUP_CHUNK):
+            chunk = jobIds[start:start + ID_LOOKUP_CHUNK]
+            marks = ', '.join('?' * len(chunk))
+            found.update(row[0] for row in conn.execute(
+                f'SELECT id FROM jobs WHERE id IN ({marks}) UNION SELECT id FROM dlq WHERE id IN ({marks})', chunk + chunk
+            ))
+        return found
+
+    def StoredIds(self, jobIds):
+        """Returns the ids among jobIds stored here, as jobs or DLQ entries."""
+        with self.ReadSnapshot() as conn:
+            return self.StoredIdsIn(conn, jobIds)
+
+    def InsertJobs(self, jobs):
+        with self.Transaction() as (conn, seq):
+            stored = self.StoredIdsIn(conn, {job['id'] for job in jobs})
+            keyed = [job for job in jobs if job.get('dedup_key')]
+            if keyed:
+                conn.execute('DELETE FROM dedup WHERE expires_at <= ?', (min(job['created_at'] for job in keyed),))
+            accepted, rejected = [], []
+            for index, job in enumerate(jobs):
+                holder = None
+                if job.get('dedup_key'):
+                    holder = conn.execute('SELECT job_id, expires_at FROM dedup WHERE key = ?', (job['dedup_key'],)).fetchone()
+                reason = DuplicateReason(job, job['id'] in stored, holder)
+                if reason:
+                    rejected.append(Rejection(index, job, reason))
+                    continue
+                accepted.append(job)
+                stored.add(job['id'])
+                if job.get('dedup_key'):
+                    conn.execute(
+                        'INSERT INTO dedup (key, job_id, expires_at) VALUES (?, ?, ?) '
+                        'ON CONFLICT(key) DO UPDATE SET job_id = excluded.job_id, expires_at = excluded.expires_at',
+                        (job['dedup_key'], job['id'], job['dedup_expires_at'])
+                    )
+            conn.executemany(
+                'INSERT INTO jobs (id, state, priority, run_at, created_at, lease_expires_at, data, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.Columns(job) + (seq,) for job in accepted)
+            )
+        return rejected
+
+    def GetJob(self, jobId):
+        with self.ReadSnapshot() as conn:
+            row = conn.execute('SELECT data FROM jobs WHERE id = ? LIMIT 1', (jobId,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def ClaimRows(self, conn, rows, updates, seq):
+        claimedJobs = []
+        for docId, data in rows:
+            job = ApplyUpdates(json.loads(data), updates)
+
+            # COMPARE-AND-SET ON STATE SO A JOB IS NEVER HANDED OUT TWICE
+            claimed = conn.execute(
+                'UPDATE jobs SET state = ?, lease_expires_at = ?, data = ?, seq = ? WHERE doc_id = ? AND state IN (?, ?)',
+                (job['state'], job.get('lease_expires_at'), self.Document(job), seq, docId) + CLAIMABLE_STATES
+            ).rowcount
+            if claimed:
+                claimedJobs.append(job)
+        return claimedJobs
+
+    def ClaimPending(self, now, updates, limit=1):
+        with self.Transaction() as (conn, seq):
+            rows = conn.execute(
+                'SELECT doc_id, data FROM jobs WHERE state IN (?, ?) AND run_at <= ? '
+                'ORDER BY priority, created_at LIMIT ?',
+                CLAIMABLE_STATES + (now, limit)
+            ).fetchall()
+            return self.ClaimRows(conn, rows, updates, seq)
+
+    def ClaimByIds(self, jobIds, now, updates):
+        with self.Transaction() as (conn, seq):
+            rows = []
+            for jobId in jobIds:
+                rows.extend(conn.execute(
+                    'SELECT doc_id, data FROM jobs WHERE id = ? AND state IN (?, ?) AND run_at <= ?',
+                    (jobId,) + CLAIMABLE_STATES + (now,)
+                ).fetchall())
+            return self.ClaimRows(conn, rows, updates, seq)
+
+    def ClaimableChangesSince(self, cursor):
+        with self.ReadSnapshot() as conn:
+            newCursor = conn.execute("SELECT value FROM counters WHERE name = 'seq'").fetchone()[0]
+            if cursor is None:
+                rows = conn.execute(
+                    'SELECT id, state, priority, created_at, run_at FROM jobs WHERE state IN (?, ?)',
+                    CLAIMABLE_STATES
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    'SELECT id, state, priority, created_at, run_at FROM jobs WHERE seq > ? AND seq <= ?',
+                    (cursor, newCursor)
+                ).fetchall()
+        keys = ('id', 'state', 'priority', 'created_at', 'run_at')
+        return [dict(zip(keys, r)) for r in rows], newCursor, cursor is None
+
+    def ReleaseClaims(self, claims, updates):
+        with self.Transaction() as (conn, seq):
+            for jobId, leaseToken in claims:
+                rows = conn.execute('SELECT doc_id, data FROM jobs WHERE id = ?', (jobId,)).fetchall()
+                for docId, data in rows:
+                    job = json.loads(data)
+                    if job.get('lease_token') != leaseToken:
+                        continue
+                    self.WriteJobRow(conn, docId, ApplyUpdates(job, updates), seq)
+
+    @staticmethod
+    def LeaseFence(leaseToken):
+        """The SQL condition, and its parameters, that a jobs row is still held under leaseToken (any row for None)."""
+        if leaseToken is None:
+            return '', ()
+        return " AND json_extract(data, '$.lease_token') = ?", (leaseToken,)
+
+    def UpdateJobRows(self, conn, jobId, updates, leaseToken, seq):
+        """Applies updates to jobId if it is still held under leaseToken. Returns whether it was."""
+        fence, fenceParams = self.LeaseFence(leaseToken)
+        rows = conn.execute('SELECT doc_id, data FROM jobs WHERE id = ?' + fence, (jobId,) + fenceParams).fetchall()
+        for docId, data in rows:
+            self.WriteJobRow(conn, docId, ApplyUpdates(json.loads(data), updates), seq)
+        return bool(rows)
+
+    def RenewLeases(self, claims, expiresAt):
+        renewed = set()
+        with self.Transaction() as (conn, seq):
+            for jobId, leaseToken in claims:
+                # A HEARTBEAT IS NOT A CHANGE ANYONE POLLS FOR, SO seq IS LEFT ALONE
+                if conn.execute(
+                    "UPDATE jobs SET lease_expires_at = ?, data = json_set(data, '$.lease_expires_at', ?) "
+                    "WHERE id = ? AND state = 'processing' AND json_extract(data, '$.lease_token') = ?",
+                    (expiresAt, expiresAt, jobId, leaseToken)
+                ).rowcount:
+                    renewed.add(jobId)
+        return renewed
+
+    def FindExpiredLeases(self, now, limit=100):
+        with self.ReadSnapshot() as conn:
+            rows = conn.execute(
+                "SELECT data FROM jobs WHERE state = 'processing' AND lease_expires_at < ? ORDER BY lease_expires_at LIMIT ?",
+                (now, limit)
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def ReapLeases(self, outcomes, now):
+        with self.Transaction() as (conn, seq):
+            expired = [
+                outcome for outcome in outcomes if conn.execute(
+                    "SELECT 1 FROM jobs WHERE id = ? AND state = 'processing' AND lease_expires_at < ? "
+                    "AND json_extract(data, '$.lease_token') IS ?",
+                    (OutcomeJobId(outcome), now, OutcomeLeaseToken(outcome))
+                ).fetchone()
+            ]
+            return self.WriteOutcomes(conn, expired, seq)
+
+    def UpdateJob(self, jobId, updates):
+        self.ApplyOutcomes([('update', jobId, updates, None)])
+
+    def MoveToDlq(self, job):
+        self.ApplyOutcomes([('dlq', job, None)])
+
+    def LoadStats(self, conn):
+        row = conn.execute("SELECT value FROM stats WHERE name = 'jobs'").fetchone()
+        if row:
+            return json.loads(row[0])
+        completedJobs = [json.loads(r[0]) for r in conn.execute("SELECT data FROM jobs WHERE state = 'completed'")]
+        deadJobs = [json.loads(r[0]) for r in conn.execute('SELECT data FROM dlq')]
+        return BuildStats(chain(completedJobs, ArchivedJobs(self, 'completed')), chain(deadJobs, ArchivedJobs(self, 'dlq')))
+
+    def WriteOutcomes(self, conn, outcomes, seq):
+        """
+        Applies the outcomes whose lease still holds and folds them into the stats
+        row, inside an open transaction. Returns the outcomes applied.
+        """
+        if not outcomes:
+            return []
+        # LOADED FIRST, SO A FIRST-TIME REBUILD DOES NOT ALSO COUNT THIS BATCH
+        stats = self.LoadStats(conn)
+        applied = []
+        for outcome in outcomes:
+            leaseToken = OutcomeLeaseToken(outcome)
+            if outcome[0] == 'update':
+                if self.UpdateJobRows(conn, outcome[1], outcome[2], leaseToken, seq) or leaseToken is None:
+                    applied.append(outcome)
+                continue
+            fence, fenceParams = self.LeaseFence(leaseToken)
+            # A LATE OUTCOME MUST NOT DELETE THE ROW OF A JOB SOMEONE ELSE HAS CLAIMED SINCE
+            if conn.execute('DELETE FROM jobs WHERE id = ?' + fence, (outcome[1]['id'],) + fenceParams).rowcount or leaseToken is None:
+                self.InsertDlqRow(conn, outcome[1], seq)
+                applied.append(outcome)
+        stats = RecordOutcomes(stats, applied)
+        conn.execute(
+            "INSERT INTO stats (name, value) VALUES ('jobs', ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (json.dumps(stats, separators=(',', ':')),)
+        )
+        return applied
+
+    def ApplyOutcomes(self, outcomes):
+        with self.Transaction() as (conn, seq):
+            return self.WriteOutcomes(conn, outcomes, seq)
+
+    def RetryFromDlq(self, jobId, updates):
+        with self.Transaction() as (conn, seq):
+            row = conn.execute('SELECT doc_id, data FROM dlq WHERE id = ? LIMIT 1', (jobId,)).fetchone()
+            if row:
+                jobToRetry = ApplyUpdates(json.loads(row[1]), updates)
+                conn.execute('DELETE FROM dlq WHERE id = ?', (jobId,))
+                self.InsertJobRow(conn, jobToRetry, seq)
+        return row is not None
+
+    def SearchJobs(self, state=None):
+        with self.ReadSnapshot() as conn:
+            if state:
+                rows = conn.execute('SELECT data FROM jobs WHERE state = ? ORDER BY doc_id', (state,)).fetchall()
+            else:
+                rows = conn.execute('SELECT data FROM jobs ORDER BY doc_id').fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def ListDlq(self):
+        with self.ReadSnapshot() as conn:
+            rows = conn.execute('SELECT data FROM dlq ORDER BY doc_id').fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def IterPages(self, table, where, params, after):
+        """
+        Keyset pagination over table in id order: each page is its own short read
+        transaction, so a slow consumer never pins a WAL snapshot.
+        """
+        while True:
+            conditions = list(where)
+            pageParams = list(params)
+            if after is not None:
+                conditions.append('id > ?')
+                pageParams.append(after)
+            whereSql = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+            with self.ReadSnapshot() as conn:
+                rows = conn.execute(
+                    f'SELECT id, data FROM {table}{whereSql} ORDER BY id LIMIT ?',
+                    pageParams + [ITER_PAGE_SIZE]
+                ).fetchall()
+            for _, data in rows:
+                yield json.loads(data)
+            if len(rows) < ITER_PAGE_SIZE:
+                return
+            after = rows[-1][0]
+
+    def IterJobs(self, state=None, after=None):
+        return self.IterPages('jobs', ['state = ?'] if state else [], [state] if state else [], after)
+
+    def IterDlq(self, after=None):
+        return self.IterPages('dlq', [], [], after)
+
+    def QueryJobs(self, state, idPrefix=None, createdFrom=None, createdTo=None, sort='updated', descending=True, limit=50, offset=0):
+        direction = 'DESC' if descending else 'ASC'
+        if state == 'dlq':
+            # THE DLQ ONLY HAS id AND seq AS COLUMNS, SO THE OTHER FIELDS ARE READ FROM THE
+            # DOCUMENT (A COMPACT DOCUMENT LEAVES OUT A DEFAULT priority, SEE record.py)
+            table, createdColumn = 'dlq', "json_extract(data, '$.created_at')"
+            where, params = [], []
+            orders = {
+                'updated': f'seq {direction}',
+                'created_at': f'{createdColumn} {direction}',
+                'priority': f"COALESCE(json_extract(data, '$.priority'), {FIELD_DEFAULTS['priority']}) {direction}, {createdColumn} {direction}",
+                'run_at': f"json_extract(data, '$.run_at') {direction}",
+            }
+        else:
+            table, createdColumn = 'jobs', 'created_at'
+            where, params = ['state = ?'], [state]
+            orders = {
+                'updated': f'seq {direction}',
+                'created_at': f'created_at {direction}',
+                'priority': f'priority {direction}, created_at {direction}',
+                'run_at': f'run_at {direction}',
+            }
+        if idPrefix:
+            where.append('id >= ? AND id < ?')
+            params += [idPrefix, PrefixUpperBound(idPrefix)]
+        if createdFrom:
+            where.append(f'{createdColumn} >= ?')
+            params.append(createdFrom)
+        if createdTo:
+            where.append(f'{createdColumn} < ?')
+            params.append(createdTo)
+        whereSql = ' WHERE ' + ' AND '.join(where) if where else ''
+        orderSql = orders[sort]
+
+        with self.ReadSnapshot() as conn:
+            rows = conn.execute(
+                f'SELECT data FROM {table}{whereSql} ORDER BY {orderSql} LIMIT ? OFFSET ?',
+                params + [limit, offset]
+            ).fetchall()
+            if len(where) == (0 if state == 'dlq' else 1):
+                # UNFILTERED: THE TRIGGER-MAINTAINED COUNTER ALREADY HAS THE TOTAL
+                row = conn.execute('SELECT value FROM counters WHERE name = ?', (f'state:{state}',)).fetchone()
+                total = row[0] if row else 0
+            else:
+                total = conn.execute(f'SELECT COUNT(*) FROM {table}{whereSql}', params).fetchone()[0]
+        return [json.loads(r[0]) for r in rows], total
+
+    def ChangesSince(self, cursor, limit=500):
+        with self.ReadSnapshot() as conn:
+            newCursor = conn.execute("SELECT value FROM counters WHERE name = 'seq'").fetchone()[0]
+            try:
+                cursor = int(cursor)
+            except (TypeError, ValueError):
+                return [], newCursor, True
+            if cursor > newCursor:
+                # THE DATABASE WAS REPLACED UNDER THE CALLER
+                return [], newCursor, True
+            # A PURGED ROW LEAVES NOTHING TO LIST, SO THE CALLER MUST RELOAD TO DROP IT
+            purged = conn.execute("SELECT value FROM counters WHERE name = 'purged'").fetchone()
+            if purged and cursor < purged[0]:
+                return [], newCursor, True
+            rows = conn.execute(
+                "SELECT id, state FROM jobs WHERE seq > ? AND seq <= ? "
+                "UNION ALL SELECT id, 'dead' FROM dlq WHERE seq > ? AND seq <= ? LIMIT ?",
+                (cursor, newCursor, cursor, newCursor, limit + 1)
+            ).fetchall()
+        if len(rows) > limit:
+            return [], newCursor, True
+        return [{'id': r[0], 'state': r[1]} for r in rows], newCursor, False
+
+    def CountByState(self):
+        # READS THE TRIGGER-MAINTAINED COUNTERS, SO THE COST DOES NOT GROW WITH HISTORY
+        with self.ReadSnapshot() as conn:
+            rows = conn.execute("SELECT name, value FROM counters WHERE name LIKE 'state:%'").fetchall()
+        return {name[len('state:'):]: value for name, value in rows}
+
+    def CountActiveByPriority(self):
+        with self.ReadSnapshot() as conn:
+            rows = conn.execute(
+                "SELECT state, priority, COUNT(*) FROM jobs WHERE state IN ('pending', 'processing', 'failed') GROUP BY state, priority"
+            ).fetchall()
+        return {(state, priority): count for state, priority, count in rows}
+
+    def GetStats(self):
+        with self.ReadSnapshot() as conn:
+            return self.LoadStats(conn)
+
+    def PurgeFinished(self, kind, cutoff, keepCount, onPurge, limit=1000):
+        if kind == 'completed':
+            table, scope = 'jobs', "state = 'completed'"
+        else:
+            table, scope = 'dlq', '1'
+        with self.Transaction() as (conn, seq):
+            conditions, params = [], []
+            if keepCount:
+                # seq ORDER IS WRITE ORDER, AND FINISHING A JOB IS ITS LAST WRITE
+                # NO ROW UNTIL THE FIRST JOB OF kind IS WRITTEN (SEE SQLITE_JOB_TRIGGERS)
+                row = conn.execute('SELECT value FROM counters WHERE name = ?', (f'state:{kind}',)).fetchone()
+                total = row[0] if row else 0
+                if total > keepCount:
+                    conditions.append(f'doc_id IN (SELECT doc_id FROM {table} WHERE {scope} ORDER BY seq LIMIT ?)')
+                    params.append(total - keepCount)
+            if cutoff:
+                conditions.append(
+                    "COALESCE(json_extract(data, '$.finished_at'), json_extract(data, '$.updated_at'), "
+                    "json_extract(data, '$.created_at')) < ?"
+                )
+                params.append(cutoff)
+            if not conditions:
+                return 0
+            rows = conn.execute(
+                f'SELECT doc_id, data FROM {table} WHERE {scope} AND ({" OR ".join(conditions)}) ORDER BY seq LIMIT ?',
+                params + [limit]
+            ).fetchall()
+            if rows:
+                onPurge([json.loads(r[1]) for r in rows])
+                conn.executemany(f'DELETE FROM {table} WHERE doc_id = ?', [(r[0],) for r in rows])
+                # READ BY ChangesSince: A CURSOR FROM BEFORE THIS PURGE GETS A FULL REFRESH
+                conn.execute(
+                    "INSERT INTO counters (name, value) VALUES ('purged', ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = excluded.value", (seq,)
+                )
+        return len(rows)
+
+    def FileSize(self):
+        return sum(os.path.getsize(self.path + suffix) for suffix in ('', '-wal') if os.path.exists(self.path + suffix))
+
+    def Compact(self):
+        sizeBefore = self.FileSize()
+        with self.lock:
+            conn = self.Connection()
+            # VACUUM REBUILDS THE FILE WITHOUT ITS FREE PAGES; THE CHECKPOINT THEN EMPTIES THE WAL
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return max(sizeBefore - self.FileSize(), 0)
+
+    def GetConfig(self, configKey):
+        with self.ReadSnapshot() as conn:
+            row = conn.execute('SELECT value FROM config WHERE key = ?', (configKey,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def SetConfig(self, configKey, configValue):
+        with self.Transaction() as (conn, seq):
+            conn.execute(
+                'INSERT INTO config (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                (configKey, json.dumps(configValue))
+            )
+            conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'config'")
+
+    def GetAllConfig(self):
+        with self.ReadSnapshot() as conn:
+            rows = conn.execute('SELECT key, value FROM config').fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def ConfigVersion(self):
+        with self.ReadSnapshot() as conn:
+            row = conn.execute("SELECT value FROM counters WHERE name = 'config'").fetchone()
+        return row[0] if row else None
+
+    def ImportFromTinyDb(self, sourcePath=TINYDB_PATH):
+        """
+        Imports a TinyDB JSON file in one transaction. Jobs and DLQ entries whose id
+        is already stored are skipped, as InsertJobs skips them, so importing a file
+        again adds nothing. Dedup keys are merged, keeping the later expiry.
+        Returns (jobs, dlq, config, skipped) counts.
+        """
+        source = GetDbConnection(sourcePath)
+        jobs = source.table('Jobs').all()
+        dlqJobs = source.table('DLQ').all()
+        configRows = source.table('Config').all()
+        dedupRows = source.table('Dedup').all()
+        source.close()
+
+        with self.Transaction() as (conn, seq):
+            stored = self.StoredIdsIn(conn, {job['id'] for job in chain(jobs, dlqJobs)})
+            imported = {'jobs': 0, 'dlq': 0}
+            for kind, docs, InsertRow in (('jobs', jobs, self.InsertJobRow), ('dlq', dlqJobs, self.InsertDlqRow)):
+                for job in docs:
+                    if job['id'] in stored:
+                        continue
+                    # THE SOURCE MAY PREDATE THE CURRENT SCHEMA; Upgrade LEAVES CURRENT DOCUMENTS AS THEY ARE
+                    InsertRow(conn, Upgrade(job), seq)
+                    stored.add(job['id'])
+                    imported[kind] += 1
+            conn.executemany(
+                'INSERT INTO dedup (key, job_id, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET job_id = excluded.job_id, expires_at = excluded.expires_at '
+                'WHERE excluded.expires_at > dedup.expires_at',
+                [(row['key'], row['job_id'], ParseTime(row['expires_at'])) for row in dedupRows]
+            )
+            for row in configRows:
+                conn.execute(
+                    'INSERT INTO config (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                    (row['key'], json.dumps(row['value']))
+                )
+            conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'config'")
+            # REBUILT ON NEXT USE SO THE IMPORTED HISTORY IS COUNTED
+            conn.execute("DELETE FROM stats WHERE name = 'jobs'")
+        skipped = len(jobs) + len(dlqJobs) - imported['jobs'] - imported['dlq']
+        return imported['jobs'], imported['dlq'], len(configRows), skipped
+
+
+# EVERY INTERFACE CALL IS TIMED INTO queuectl_storage_operation_seconds
+StorageOperations = [
+    name for name, member in vars(StorageBackend).items()
+    if callable(member) and not name.startswith('_')
+]
+InstrumentStorage(TinyDbBackend, 'tinydb', StorageOperations)
+InstrumentStorage(SqliteBackend, 'sqlite', StorageOperations)
+
+# STORAGE ENGINES AVAILABLE TO QUEUECTL_STORAGE
+StorageEngines = {
+    'sqlite': SqliteBackend,
+    'tinydb': TinyDbBackend,
+}
+
+StorageInstances = {}
+
+def GetStorage(engine=None):
+    """
+    Returns the process-wide backend selected by QUEUECTL_STORAGE (default: sqlite):
+    a client of the `queuectl serve` daemon when one is running here, else OpenStorage(engine).
+    """
+    engine = engine or os.environ.get('QUEUECTL_STORAGE', DEFAULT_ENGINE)
+    if engine not in StorageEngines:
+        raise ValueError(f"Unknown storage engine '{engine}'. Choose from: {', '.join(StorageEngines)}")
+    if engine not in StorageInstances:
+        from .daemon import ConnectDaemon
+        StorageInstances[engine] = ConnectDaemon(engine) or OpenStorage(engine)
+    return StorageInstances[engine]
+
+def OpenStorage(engine):
+    """Opens engine's storage in this process: every queue shard of it, behind one ShardedStorage."""
+    from .shards import ShardedStorage
+    return ShardedStorage(engine)
+
+
+# QUEUE DEPTH, READ FROM STORAGE WHEN /metrics IS SCRAPED
+QueueDepth = Gauge(
+    'queuectl_queue_depth', 'Jobs that are not yet completed, by state and priority.', ['state', 'priority'],
+    lambda: GetStorage().CountActiveByPriority()
+)
+JobsByState = Gauge(
+    'queuectl_jobs', 'Stored jobs by state, with dead-letter jobs under state="dlq".', ['state'],
+    lambda: {(state,): count for state, count in GetStorage().CountByState().items()}
+)
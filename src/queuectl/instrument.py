@@ -0,0 +1,211 @@
+# instrument.py - IN-PROCESS METRICS, RENDERED IN THE OPENMETRICS TEXT FORMAT
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# BUCKETS FOR WAITS AND STORAGE CALLS (100 MICROSECONDS TO 10 SECONDS) AND FOR
+# JOB RUNTIMES (10 MILLISECONDS TO ABOUT AN HOUR)
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RUNTIME_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+# EVERY METRIC OF THIS PROCESS, IN REGISTRATION ORDER
+MetricRegistry = []
+
+def FormatLabels(labelNames, labelValues, extra=()):
+    pairs = list(zip(labelNames, labelValues)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def FormatNumber(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+    def __init__(self, name, help, labelNames=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.lock = threading.Lock()
+        self.values = {}
+        MetricRegistry.append(self)
+
+    def Inc(self, amount=1, *labelValues):
+        with self.lock:
+            self.values[labelValues] = self.values.get(labelValues, 0) + amount
+
+    def Render(self):
+        lines = [f'# TYPE {self.name} counter', f'# HELP {self.name} {self.help}']
+        with self.lock:
+            for labelValues, value in sorted(self.values.items()):
+                lines.append(f'{self.name}_total{FormatLabels(self.labelNames, labelValues)} {FormatNumber(value)}')
+        return lines
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, optionally split by labels."""
+    def __init__(self, name, help, labelNames=(), buckets=FAST_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}
+        MetricRegistry.append(self)
+
+    def Observe(self, value, *labelValues):
+        with self.lock:
+            series = self.series.get(labelValues)
+            if series is None:
+                series = self.series[labelValues] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def Time(self, *labelValues):
+        """Observes how long the with-block took, even if it raised."""
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.Observe(time.perf_counter() - startTime, *labelValues)
+
+    def Render(self):
+        lines = [f'# TYPE {self.name} histogram', f'# HELP {self.name} {self.help}']
+        with self.lock:
+            for labelValues, (counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f'{self.name}_bucket{FormatLabels(self.labelNames, labelValues, [("le", bound)])} {cumulative}')
+                lines.append(f'{self.name}_bucket{FormatLabels(self.labelNames, labelValues, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{FormatLabels(self.labelNames, labelValues)} {FormatNumber(total)}')
+                lines.append(f'{self.name}_count{FormatLabels(self.labelNames, labelValues)} {count}')
+        return lines
+
+
+class Gauge:
+    """A value read at scrape time from collect(), which returns {labelValues: value}."""
+    def __init__(self, name, help, labelNames, collect):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.collect = collect
+        MetricRegistry.append(self)
+
+    def Render(self):
+        lines = [f'# TYPE {self.name} gauge', f'# HELP {self.name} {self.help}']
+        try:
+            values = self.collect()
+        except Exception:
+            # A FAILING COLLECTOR MUST NOT TAKE THE WHOLE SCRAPE DOWN WITH IT
+            return lines
+        for labelValues, value in sorted(values.items()):
+            lines.append(f'{self.name}{FormatLabels(self.labelNames, labelValues)} {FormatNumber(value)}')
+        return lines
+
+
+class TimedLock:
+    """
+    A drop-in for threading.Lock that records how long each acquire waited,
+    so contention shows up as a histogram instead of as unexplained slowness.
+    """
+    def __init__(self, waitHistogram, label):
+        self.lock = threading.Lock()
+        self.waitHistogram = waitHistogram
+        self.label = label
+
+    def acquire(self, blocking=True, timeout=-1):
+        # THE UNCONTENDED CASE SKIPS THE CLOCK ENTIRELY
+        if self.lock.acquire(False):
+            self.waitHistogram.Observe(0.0, self.label)
+            return True
+        if not blocking:
+            return False
+        startTime = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        self.waitHistogram.Observe(time.perf_counter() - startTime, self.label)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# METRICS SHARED BY THE STORAGE, JOB AND WORKER MODULES
+LockWaitSeconds = Histogram('queuectl_lock_wait_seconds', 'Time spent waiting to acquire a queuectl lock.', ['lock'])
+StorageOperationSeconds = Histogram('queuectl_storage_operation_seconds', 'Duration of storage backend calls, lock wait included.', ['engine', 'operation'])
+TinyDbIoSeconds = Histogram('queuectl_tinydb_io_seconds', 'Time the JSON engine spends reading and parsing or serializing and writing its file.', ['phase'])
+JobWriteSeconds = Histogram('queuectl_job_write_seconds', 'Duration of JobManager writes.', ['operation'])
+ClaimSeconds = Histogram('queuectl_claim_seconds', 'Time FindAndLockPending took to claim jobs, including empty polls.', ['result'])
+JobsClaimed = Counter('queuectl_jobs_claimed', 'Jobs claimed by this process.')
+JobRuntimeSeconds = Histogram('queuectl_job_runtime_seconds', 'Wall-clock runtime of job subprocesses.', ['outcome'], RUNTIME_BUCKETS)
+WorkerIdleSeconds = Counter('queuectl_worker_idle_seconds', 'Time worker loops spent waiting for work.', ['engine'])
+OutcomeBatchSize = Histogram('queuectl_outcome_batch_size', 'Job outcomes committed per writer transaction.', [], (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+
+def InstrumentStorage(backendClass, engine, operations):
+    """Wraps the listed methods of a StorageBackend class so each call is timed."""
+    for operation in operations:
+        method = getattr(backendClass, operation)
+
+        def Timed(self, *args, _method=method, _operation=operation, **kwargs):
+            with StorageOperationSeconds.Time(engine, _operation):
+                return _method(self, *args, **kwargs)
+        Timed.__name__ = method.__name__
+        Timed.__doc__ = method.__doc__
+        setattr(backendClass, operation, Timed)
+    return backendClass
+
+
+def RenderOpenMetrics():
+    """Returns every registered metric as an OpenMetrics text exposition."""
+    lines = []
+    for metric in MetricRegistry:
+        lines.extend(metric.Render())
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def StartMetricsExporter(port, host='127.0.0.1'):
+    """Serves /metrics for this process on a background thread. Returns the server."""
+    # IMPORTED HERE SO COMMANDS THAT NEVER EXPORT METRICS DON'T PAY FOR http.server AT STARTUP
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = RenderOpenMetrics().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            # SCRAPES EVERY FEW SECONDS WOULD DROWN OUT THE WORKER'S OWN OUTPUT
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='MetricsExporter', daemon=True).start()
+    return server
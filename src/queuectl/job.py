@@ -1,112 +1,293 @@
 # job.py - MANAGES THE JOB LIFECYCLE (UPGRADED WITH BONUS FEATURES)
 import uuid
 import json
-from datetime import datetime, timezone
-from .db import GetDbConnection, JobQuery, DatabaseLock
+import time
+from .db import GetStorage, DuplicateJobError, DEFAULT_QUEUE
+from .record import ParseTime, Expand
+from .archive import ARCHIVE_KINDS, WriteArchive
+from .shards import ValidateQueueName
 from .config import GetConfigValue
+from .notify import NotifyWorkers
+from .instrument import JobWriteSeconds, ClaimSeconds, JobsClaimed
 
 class JobManager:
     @staticmethod
-    def CreateJob(jobDataString):
-        with DatabaseLock:
-            db = GetDbConnection()
-            JobsTable = db.table('Jobs')
-            parsedData = json.loads(jobDataString)
-            now = datetime.now(timezone.utc)
-            run_at_str = parsedData.get('run_at', now.isoformat())
-            run_at_dt = datetime.fromisoformat(run_at_str.replace('Z', '+00:00'))
-
-            newJob = {
-                "id": parsedData.get('id', str(uuid.uuid4())),
-                "command": parsedData['command'],
-                "state": "pending",
-                "attempts": 0,
-                "max_retries": GetConfigValue('maxRetries'),
-                "created_at": now.isoformat(),
-                "updated_at": now.isoformat(),
-                # BONUS FEATURE FIELDS
-                "priority": int(parsedData.get('priority', 10)), # LOWER IS HIGHER PRIORITY
-                "timeout": int(parsedData.get('timeout', 300)), #  5 MIN DEFAULT
-                "run_at": run_at_dt.isoformat(),
-                "log_file": f"logs/{parsedData.get('id', 'unassigned_id')}.log",
-                "started_at": None,
-                "finished_at": None,
-                "duration_seconds": None,
-                "output": None,
-            }
-            JobsTable.insert(newJob)
-            db.close()
-            return newJob
+    def BuildJob(parsedData, now, queue=None, dedupWindow=0):
+        """
+        Validates one parsed job payload and returns the new job document. now is
+        an epoch timestamp, and run_at may be given as one or as ISO 8601. queue,
+        when given, wins over a 'queue' field in the payload. dedupWindow is the
+        default lifetime, in seconds, of a dedup_key.
+        """
+        if not isinstance(parsedData, dict):
+            raise ValueError("Job data must be a JSON object.")
+        if not isinstance(parsedData.get('command'), str) or not parsedData['command']:
+            raise ValueError("Job data needs a non-empty 'command' string.")
+        runAt = ParseTime(parsedData['run_at']) if parsedData.get('run_at') is not None else now
+        jobId = str(parsedData.get('id', uuid.uuid4()))
+
+        # OPTIONAL PER-JOB OVERRIDES OF THE RETRY CONFIG, STORED ONLY WHEN GIVEN, SO A JOB
+        # WITHOUT ONE FOLLOWS THE CONFIG AS IT IS WHEN THE JOB FAILS (SEE GetJobSetting)
+        overrides = {}
+        if parsedData.get('max_retries') is not None:
+            value = parsedData['max_retries']
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                raise ValueError("'max_retries' must be a non-negative whole number.")
+            overrides['max_retries'] = value
+        for field in ('backoff_base', 'backoff_cap', 'backoff_jitter'):
+            if parsedData.get(field) is not None:
+                value = parsedData[field]
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                    raise ValueError(f"'{field}' must be a non-negative number.")
+                overrides[field] = value
+        if overrides.get('backoff_jitter', 0) > 100:
+            raise ValueError("'backoff_jitter' is a percentage between 0 and 100.")
+
+        # OPTIONAL IDEMPOTENCY KEY: WHILE ITS WINDOW LASTS, A JOB WITH THE SAME KEY IS REJECTED
+        if parsedData.get('dedup_key') is not None:
+            if not isinstance(parsedData['dedup_key'], str) or not parsedData['dedup_key']:
+                raise ValueError("'dedup_key' must be a non-empty string.")
+            window = parsedData.get('dedup_window', dedupWindow)
+            if isinstance(window, bool) or not isinstance(window, (int, float)) or window < 0:
+                raise ValueError("'dedup_window' must be a non-negative number of seconds.")
+            overrides['dedup_key'] = parsedData['dedup_key']
+            overrides['dedup_expires_at'] = now + window
+        queue = ValidateQueueName(queue or parsedData.get('queue') or DEFAULT_QUEUE)
+
+        # started_at, finished_at, duration_seconds AND output ARE SET AS THE JOB RUNS;
+        # UNTIL THEN THEY ARE ABSENT RATHER THAN NULL (SEE record.py)
+        return {
+            "id": jobId,
+            "command": parsedData['command'],
+            "state": "pending",
+            "queue": queue,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+            # BONUS FEATURE FIELDS
+            "priority": int(parsedData.get('priority', 10)), # LOWER IS HIGHER PRIORITY
+            "timeout": int(parsedData.get('timeout', 300)), #  5 MIN DEFAULT
+            "run_at": runAt,
+            **overrides,
+        }
+
+    @staticmethod
+    @JobWriteSeconds.Time('CreateJob')
+    def CreateJob(jobDataString, queue=None):
+        """Enqueues one job. Raises DuplicateJobError if its id or dedup_key is taken."""
+        parsedData = json.loads(jobDataString)
+        newJob = JobManager.BuildJob(
+            parsedData, time.time(), queue, GetConfigValue('dedupWindowSeconds')
+        )
+        GetStorage().InsertJob(newJob)
+        NotifyWorkers()
+        return newJob
 
     @staticmethod
-    def FindAndLockPending():
-        with DatabaseLock:
-            db = GetDbConnection()
-            JobsTable = db.table('Jobs')
-            now = datetime.now(timezone.utc)
-
-            # FETCH CANDIDATE JOBS THAT ARE DUE TO RUN
-            candidates = JobsTable.search(
-                (JobQuery.state == 'pending') &
-                (JobQuery.run_at <= now.isoformat())
-            )
-
-            if not candidates:
-                db.close()
-                return None
-
-            # SORT CANDIDATES BY PRIORITY AND CREATED_AT
-            candidates.sort(key=lambda j: (j.get('priority', 10), j['created_at']))
-            
-            bestJob = candidates[0]
-
-            # LOCK THE JOB BY UPDATING ITS STATE TO 'PROCESSING'
-            updates = {
-                'state': 'processing',
-                'updated_at': now.isoformat(),
-                'started_at': now.isoformat()
-            }
-            JobsTable.update(updates, doc_ids=[bestJob.doc_id])
-            bestJob.update(updates)
-
-            db.close()
-            return bestJob
+    @JobWriteSeconds.Time('CreateJobs')
+    def CreateJobs(jobLines, chunkSize=1000, onError=None, queue=None):
+        """
+        Streams many jobs into storage. jobLines yields JSON strings (e.g. NDJSON
+        lines) or already-parsed dicts. Each line is validated on its own and
+        valid jobs are inserted in transactions of chunkSize, so a bad line is
+        reported through onError(lineNumber, error) without aborting the batch.
+        Duplicates (see CreateJob) are reported the same way, as DuplicateJobError.
+        queue, when given, puts every job on that queue. Returns (enqueuedCount, errorCount).
+        """
+        storage = GetStorage()
+        dedupWindow = GetConfigValue('dedupWindowSeconds')
+        enqueuedCount = 0
+        errorCount = 0
+        chunk = []
+        chunkLines = []
+
+        def InsertChunk():
+            rejected = storage.InsertJobs(chunk)
+            for rejection in rejected:
+                if onError:
+                    onError(chunkLines[rejection['index']], DuplicateJobError(rejection['reason']))
+            NotifyWorkers()
+            return len(chunk) - len(rejected), len(rejected)
+
+        for lineNumber, jobLine in enumerate(jobLines, start=1):
+            if isinstance(jobLine, str) and not jobLine.strip():
+                continue
+            try:
+                parsedData = json.loads(jobLine) if isinstance(jobLine, str) else jobLine
+                chunk.append(JobManager.BuildJob(parsedData, time.time(), queue, dedupWindow))
+                chunkLines.append(lineNumber)
+            except (ValueError, TypeError, KeyError) as error:
+                errorCount += 1
+                if onError:
+                    onError(lineNumber, error)
+                continue
+
+            if len(chunk) >= chunkSize:
+                inserted, rejectedCount = InsertChunk()
+                enqueuedCount += inserted
+                errorCount += rejectedCount
+                chunk = []
+                chunkLines = []
 
+        if chunk:
+            inserted, rejectedCount = InsertChunk()
+            enqueuedCount += inserted
+            errorCount += rejectedCount
+        return enqueuedCount, errorCount
 
     @staticmethod
+    def FindAndLockPending(batchSize=1, owner=None, readyIndex=None, queue=DEFAULT_QUEUE):
+        """
+        Leases up to batchSize of the best due jobs of queue in one transaction.
+        Returns a list of expanded job documents (see record.Expand). With a
+        ReadyIndex the candidates come from the in-process heaps and storage only
+        has to confirm the claim by id; the index's queue is the one claimed from.
+        """
+        now = time.time()
+
+        # LOCK THE JOB BY UPDATING ITS STATE TO 'PROCESSING'
+        # THE OWNER AND A FRESH LEASE TOKEN IDENTIFY WHICH WORKER HOLDS THE CLAIM,
+        # AND THE CLAIM LAPSES AT lease_expires_at UNLESS THE WORKER RENEWS IT
+        updates = {
+            'state': 'processing',
+            'updated_at': now,
+            'started_at': now,
+            'owner': owner,
+            'lease_token': uuid.uuid4().hex,
+            'lease_expires_at': JobManager.LeaseExpiry(now),
+        }
+        startTime = time.perf_counter()
+        claimedJobs = []
+        try:
+            if readyIndex is None:
+                claimedJobs = [Expand(job) for job in GetStorage().ClaimPending(now, updates, limit=batchSize, queue=queue)]
+                return claimedJobs
+
+            # ANOTHER PROCESS MAY WIN THE RACE FOR THE SAME IDS, SO KEEP GOING UNTIL
+            # SOMETHING IS CLAIMED OR THE INDEX HAS NOTHING DUE LEFT
+            while True:
+                readyIndex.Refresh()
+                jobIds = readyIndex.PopReady(now, batchSize)
+                if not jobIds:
+                    return claimedJobs
+                claimedJobs = [Expand(job) for job in GetStorage().ClaimByIds(jobIds, now, updates, queue=readyIndex.queue)]
+                if claimedJobs:
+                    return claimedJobs
+        finally:
+            ClaimSeconds.Observe(time.perf_counter() - startTime, 'claimed' if claimedJobs else 'empty')
+            JobsClaimed.Inc(len(claimedJobs))
+
+    @staticmethod
+    @JobWriteSeconds.Time('ReleaseJobs')
+    def ReleaseJobs(jobs):
+        """Returns claimed-but-unstarted jobs to the queue, if their lease is still ours."""
+        if not jobs:
+            return
+        updates = {
+            'state': 'pending',
+            'updated_at': time.time(),
+            'started_at': None,
+            'owner': None,
+            'lease_token': None,
+            'lease_expires_at': None,
+        }
+        GetStorage().ReleaseClaims([(j['id'], j.get('lease_token')) for j in jobs], updates)
+        NotifyWorkers()
+
+    @staticmethod
+    def LeaseExpiry(now):
+        return now + GetConfigValue('leaseSeconds')
+
+    @staticmethod
+    def RenewLeases(claims):
+        """Heartbeat: extends the given (jobId, leaseToken) leases in one write. Returns the ids still held."""
+        if not claims:
+            return set()
+        return GetStorage().RenewLeases(claims, JobManager.LeaseExpiry(time.time()))
+
+    @staticmethod
+    @JobWriteSeconds.Time('ReapExpiredLeases')
+    def ReapExpiredLeases(decideOutcome, limit=100):
+        """
+        Finds up to limit processing jobs whose worker stopped renewing its lease and
+        applies decideOutcome(job) to each, unless a heartbeat renewed it meanwhile.
+        The outcome must carry the expired lease's token (see ApplyOutcomes).
+        Returns the outcomes applied.
+        """
+        now = time.time()
+        storage = GetStorage()
+        expired = [Expand(job) for job in storage.FindExpiredLeases(now, limit)]
+        if not expired:
+            return []
+        # OUTCOMES ARE DECIDED OUTSIDE THE WRITE, WHICH RE-CHECKS EACH LEASE BEFORE APPLYING IT
+        reaped = storage.ReapLeases([decideOutcome(job) for job in expired], now)
+        if reaped:
+            NotifyWorkers()
+        return reaped
+
+    @staticmethod
+    def PrepareUpdate(jobId, updates):
+        """Stamps timestamps and duration onto updates without writing them."""
+        # UPDATING METRICS IF JOB IS COMPLETED, FAILED, OR DEAD
+        if updates.get('state') in ['completed', 'failed', 'dead']:
+            # A PREFETCHED JOB CARRIES ITS REAL START TIME IN THE UPDATES
+            job = updates if updates.get('started_at') else GetStorage().GetJob(jobId)
+            if job and job.get('started_at'):
+                finished = time.time()
+                updates['finished_at'] = finished
+                updates['duration_seconds'] = round(finished - job['started_at'], 2)
+
+        updates['updated_at'] = time.time()
+        return updates
+
+    @staticmethod
+    def PrepareDlqRecord(failedJob):
+        """Finalizes a job's metrics for the DLQ without writing it."""
+        # FINALIZING METRICS BEFORE MOVING TO DLQ
+        finished = time.time()
+        failedJob['state'] = 'dead'
+        failedJob['updated_at'] = finished
+        failedJob['finished_at'] = finished
+        failedJob['duration_seconds'] = finished - (failedJob.get('started_at') or finished)
+        return failedJob
+
+    @staticmethod
+    @JobWriteSeconds.Time('UpdateJob')
     def UpdateJob(jobId, updates):
-        with DatabaseLock:
-            db = GetDbConnection()
-            JobsTable = db.table('Jobs')
-            
-            # UPDATING METRICS IF JOB IS COMPLETED, FAILED, OR DEAD
-            if updates.get('state') in ['completed', 'failed', 'dead']:
-                job = JobsTable.get(JobQuery.id == jobId) 
-                if job and job.get('started_at'):
-                    started = datetime.fromisoformat(job['started_at'])
-                    finished = datetime.now(timezone.utc)
-                    updates['finished_at'] = finished.isoformat()
-                    updates['duration_seconds'] = round((finished - started).total_seconds(), 2)
-
-            updates['updated_at'] = datetime.now(timezone.utc).isoformat()
-            JobsTable.update(updates, JobQuery.id == jobId)
-            db.close()
+        GetStorage().UpdateJob(jobId, JobManager.PrepareUpdate(jobId, updates))
 
     @staticmethod
+    @JobWriteSeconds.Time('MoveToDlq')
     def MoveToDlq(failedJob):
-        with DatabaseLock:
-            db = GetDbConnection()
-            JobsTable = db.table('Jobs')
-            DlqTable = db.table('DLQ')
-            
-            # FINALIZING METRICS BEFORE MOVING TO DLQ
-            started = datetime.fromisoformat(failedJob['started_at']) if failedJob.get('started_at') else datetime.now(timezone.utc)
-            finished = datetime.now(timezone.utc)
-            failedJob['state'] = 'dead'
-            failedJob['updated_at'] = finished.isoformat()
-            failedJob['finished_at'] = finished.isoformat()
-            failedJob['duration_seconds'] = (finished - started).total_seconds()
-
-            DlqTable.insert(failedJob)
-            JobsTable.remove(JobQuery.id == failedJob['id'])
-            db.close()
\ No newline at end of file
+        GetStorage().MoveToDlq(JobManager.PrepareDlqRecord(failedJob))
+
+    @staticmethod
+    @JobWriteSeconds.Time('RetryFromDlq')
+    def RetryFromDlq(jobId):
+        """Moves a dead job back to the queue with a fresh attempt budget."""
+        retried = GetStorage().RetryFromDlq(jobId, {'state': 'pending', 'attempts': 0})
+        if retried:
+            NotifyWorkers()
+        return retried
+
+    @staticmethod
+    @JobWriteSeconds.Time('CollectGarbage')
+    def CollectGarbage(batchSize=1000):
+        """
+        Moves completed jobs and DLQ entries past their configured retention into
+        the compressed archive, a batch per transaction. Returns {kind: count}.
+        """
+        now = time.time()
+        storage = GetStorage()
+        purged = {}
+        for kind in ARCHIVE_KINDS:
+            maxAge = GetConfigValue(f'{kind}RetentionSeconds')
+            cutoff = now - maxAge if maxAge else None
+            keepCount = GetConfigValue(f'{kind}RetentionCount')
+            purged[kind] = 0
+            while True:
+                count = storage.PurgeFinished(kind, cutoff, keepCount, lambda jobs, k=kind: WriteArchive(k, jobs), batchSize)
+                purged[kind] += count
+                if count < batchSize:
+                    break
+        return purged
@@ -0,0 +1,135 @@
+# joblog.py - STREAMS JOB OUTPUT TO SIZE-CAPPED, ROTATING LOG FILES
+import os
+import signal
+import subprocess
+import threading
+
+# BYTES READ FROM A JOB'S OUTPUT PIPE AT A TIME
+CHUNK_SIZE = 64 * 1024
+
+# HOW LONG TO KEEP DRAINING A PIPE AFTER THE JOB EXITS, IN CASE A BACKGROUND
+# CHILD IT LEFT BEHIND STILL HOLDS THE PIPE OPEN
+PUMP_DRAIN_TIMEOUT = 5.0
+
+class JobLogWriter:
+    """
+    Appends a job's combined stdout/stderr to its log file as it is produced,
+    so worker memory stays flat no matter how much a job prints. Once the file
+    reaches maxBytes it is rotated to '<log>.1' (shifting older copies up to
+    '<log>.<backupCount>'), which bounds disk use at (backupCount + 1) * maxBytes.
+    Safe to call from several pump threads.
+    """
+    def __init__(self, path, maxBytes, backupCount):
+        self.path = path
+        self.maxBytes = max(int(maxBytes), 1)
+        self.backupCount = max(int(backupCount), 0)
+        self.lock = threading.Lock()
+        self.size = 0
+        # A RETRY STARTS A FRESH LOG, SO DROP ROTATED COPIES FROM EARLIER ATTEMPTS
+        for i in range(1, self.backupCount + 1):
+            try:
+                os.remove(f"{self.path}.{i}")
+            except OSError:
+                pass
+        self.handle = open(self.path, 'wb')
+
+    def Write(self, data):
+        with self.lock:
+            # A PUMP THAT OUTLIVED ITS JOB MAY STILL WRITE AFTER Close()
+            if self.handle.closed:
+                return
+            while data:
+                room = self.maxBytes - self.size
+                if room <= 0:
+                    self.Rotate()
+                    room = self.maxBytes
+                piece = data[:room]
+                self.handle.write(piece)
+                self.size += len(piece)
+                data = data[room:]
+
+    def WriteNote(self, text):
+        """Appends a queuectl status line, e.g. why the job failed."""
+        self.Write(f"\n[queuectl] {text}\n".encode())
+
+    def Rotate(self):
+        self.handle.close()
+        if self.backupCount:
+            for i in range(self.backupCount - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        self.handle = open(self.path, 'wb')
+        self.size = 0
+
+    def Close(self):
+        with self.lock:
+            self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+
+def ReadLogTail(path, maxChars=1000):
+    """Returns the last maxChars characters of a log without reading the whole file."""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            # UTF-8 USES AT MOST 4 BYTES PER CHARACTER
+            f.seek(max(size - maxChars * 4, 0))
+            return f.read().decode('utf-8', errors='replace')[-maxChars:]
+    except OSError:
+        return ''
+
+
+def ProcessGroupArgs():
+    """Popen arguments that put a job in its own process group, so a timeout kills all of it."""
+    if os.name == 'posix':
+        return {'start_new_session': True}
+    return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+
+def KillProcessTree(process):
+    if os.name == 'posix':
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        except OSError:
+            pass
+    process.kill()
+
+def PumpStream(stream, jobLog):
+    while True:
+        chunk = os.read(stream.fileno(), CHUNK_SIZE)
+        if not chunk:
+            return
+        jobLog.Write(chunk)
+
+def RunStreamingProcess(command, timeout, jobLog):
+    """
+    Runs a shell command with stdout and stderr streamed into jobLog and
+    returns its exit status. Raises subprocess.TimeoutExpired after killing
+    the command's whole process group.
+    """
+    process = subprocess.Popen(
+        command,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        **ProcessGroupArgs()
+    )
+    pump = threading.Thread(target=PumpStream, args=(process.stdout, jobLog), daemon=True)
+    pump.start()
+    try:
+        return process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        KillProcessTree(process)
+        process.wait()
+        raise
+    finally:
+        pump.join(PUMP_DRAIN_TIMEOUT)
+        if not pump.is_alive():
+            process.stdout.close()
@@ -0,0 +1,110 @@
+# notify.py - WAKES IDLE WORKERS AS SOON AS NEW WORK ARRIVES
+import os
+import socket
+import threading
+
+# EVERY WORKER PROCESS BINDS ONE DATAGRAM SOCKET HERE, NEXT TO THE DATABASE FILES
+WAKEUP_DIR = os.path.join('.queuectl', 'wakeup')
+
+# UNIX DOMAIN SOCKETS ARE UNAVAILABLE ON SOME PLATFORMS (E.G. OLDER WINDOWS);
+# WORKERS THERE FALL BACK TO THEIR BOUNDED IDLE TIMEOUT
+SUPPORTS_SOCKET_WAKEUP = hasattr(socket, 'AF_UNIX')
+
+class WakeupSignal:
+    """
+    An in-process wakeup built on a condition variable. The generation counter
+    closes the gap between "found nothing to do" and "started waiting": a
+    worker passes the generation it saw before looking for work, and Wait
+    returns at once if a notification arrived in between.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.callbacks = []
+
+    def Subscribe(self, callback):
+        """Registers a callback run on every Notify, e.g. to wake an event loop."""
+        self.callbacks.append(callback)
+
+    def Unsubscribe(self, callback):
+        self.callbacks.remove(callback)
+
+    def Notify(self):
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+        for callback in list(self.callbacks):
+            callback()
+
+    def Wait(self, seenGeneration, timeout):
+        with self.condition:
+            if self.generation == seenGeneration:
+                self.condition.wait(timeout)
+            return self.generation
+
+# THE SIGNAL ALL WORKER THREADS OF THIS PROCESS SLEEP ON
+WorkerWakeup = WakeupSignal()
+
+
+class WakeupListener:
+    """Receives cross-process wakeups on this process's socket and relays them to WorkerWakeup."""
+    def __init__(self):
+        self.path = os.path.join(WAKEUP_DIR, f"{os.getpid()}.sock")
+        self.sock = None
+        self.thread = None
+
+    def Start(self):
+        if not SUPPORTS_SOCKET_WAKEUP or self.sock is not None:
+            return
+        os.makedirs(WAKEUP_DIR, exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.thread = threading.Thread(target=self.RunListenLoop, name='WakeupListener', daemon=True)
+        self.thread.start()
+
+    def RunListenLoop(self):
+        while True:
+            try:
+                self.sock.recv(64)
+            except OSError:
+                return
+            WorkerWakeup.Notify()
+
+    def Close(self):
+        if self.sock is None:
+            return
+        self.sock.close()
+        self.sock = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def NotifyWorkers():
+    """Wakes idle workers in this process and in every other worker process."""
+    WorkerWakeup.Notify()
+    if not SUPPORTS_SOCKET_WAKEUP or not os.path.isdir(WAKEUP_DIR):
+        return
+    sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sender.setblocking(False)
+    try:
+        for name in os.listdir(WAKEUP_DIR):
+            path = os.path.join(WAKEUP_DIR, name)
+            try:
+                sender.sendto(b'!', path)
+            except BlockingIOError:
+                # THE RECEIVER ALREADY HAS WAKEUPS QUEUED, ONE MORE ADDS NOTHING
+                pass
+            except (ConnectionRefusedError, FileNotFoundError):
+                # NOBODY IS BOUND ANY MORE: A WORKER PROCESS THAT DID NOT EXIT CLEANLY
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except OSError:
+                pass
+    finally:
+        sender.close()
@@ -0,0 +1,98 @@
+# record.py - THE STORED FORM OF A JOB: EPOCH TIMESTAMPS, NO NULLS, NO DEFAULTS
+from datetime import datetime, timezone
+
+# VERSION OF THE JOB DOCUMENT LAYOUT BOTH ENGINES STORE. VERSION 1 KEPT ISO 8601
+# STRINGS AND WROTE EVERY FIELD, NULL OR NOT; VERSION 2 IS DESCRIBED BELOW.
+SCHEMA_VERSION = 2
+
+# JOBS ENQUEUED WITHOUT --queue GO HERE; ITS SHARD IS THE DEFAULT DATABASE FILE
+DEFAULT_QUEUE = 'default'
+
+# FIELDS HOLDING A POINT IN TIME, AS SECONDS SINCE THE UNIX EPOCH (A FLOAT). NUMBERS
+# COMPARE AND SUBTRACT DIRECTLY ON THE CLAIM PATH; ISO STRINGS ARE ONLY MADE FOR PEOPLE.
+TIMESTAMP_FIELDS = ('created_at', 'updated_at', 'run_at', 'started_at', 'finished_at', 'lease_expires_at', 'dedup_expires_at')
+
+# FIELDS LEFT OUT OF A STORED DOCUMENT WHILE THEY HOLD THESE VALUES. A FIELD SET TO
+# None IS LEFT OUT TOO, AND log_file IS ALWAYS DERIVED FROM THE ID (SEE LogPath).
+FIELD_DEFAULTS = {
+    'queue': DEFAULT_QUEUE,
+    'attempts': 0,
+    'priority': 10,
+    'timeout': 300,
+}
+
+NOT_SET = object()
+
+def LogPath(jobId):
+    """Where a job's output is logged."""
+    return f"logs/{jobId}.log"
+
+def ParseTime(value):
+    """
+    An epoch timestamp from an epoch number or an ISO 8601 string (naive means
+    UTC), or None for None. Raises ValueError for anything else.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str):
+        raise ValueError(f"{value!r} is not a timestamp.")
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def FormatTime(epoch):
+    """Renders an epoch timestamp as ISO 8601 in UTC, the form the CLI and dashboard show."""
+    if epoch is None:
+        return None
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+def IsStored(field, value, jobId):
+    if value is None:
+        return False
+    if field == 'log_file':
+        return value != LogPath(jobId)
+    return FIELD_DEFAULTS.get(field, NOT_SET) != value
+
+def Compact(job):
+    """The stored form of a job document: without nulls, defaults or derived fields."""
+    return {field: value for field, value in job.items() if IsStored(field, value, job['id'])}
+
+def Upgrade(doc):
+    """Converts a stored document of any schema version to the current one. Idempotent."""
+    upgraded = dict(doc)
+    # SCHEMA 1 (ISO TIMESTAMPS) COPIED THE CONFIG'S max_retries INTO EVERY JOB. IT WAS
+    # NEVER A PER-JOB OVERRIDE, SO IT IS DROPPED AND `config set max-retries` APPLIES
+    if isinstance(doc.get('created_at'), str):
+        upgraded.pop('max_retries', None)
+    for field in TIMESTAMP_FIELDS:
+        if isinstance(upgraded.get(field), str):
+            upgraded[field] = ParseTime(upgraded[field])
+    return Compact(upgraded)
+
+def ApplyUpdates(doc, updates):
+    """Writes updates into a stored document in place, dropping fields they null or reset."""
+    for field, value in updates.items():
+        if IsStored(field, value, doc['id']):
+            doc[field] = value
+        else:
+            doc.pop(field, None)
+    return doc
+
+def Expand(doc):
+    """A stored document with its defaults and log_file filled back in, for code that runs the job."""
+    job = dict(doc)
+    for field, value in FIELD_DEFAULTS.items():
+        job.setdefault(field, value)
+    job.setdefault('log_file', LogPath(job['id']))
+    return job
+
+def ForDisplay(doc):
+    """Expand, with every timestamp rendered as ISO 8601. Only the CLI and dashboard need this."""
+    job = Expand(doc)
+    for field in TIMESTAMP_FIELDS:
+        if field in job:
+            job[field] = FormatTime(ParseTime(job[field]))
+    return job
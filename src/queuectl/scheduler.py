@@ -0,0 +1,133 @@
+# scheduler.py - IN-PROCESS READY QUEUE INDEX FOR FAST JOB SELECTION
+import heapq
+import threading
+import time
+from .db import GetStorage, CLAIMABLE_STATES, DEFAULT_QUEUE
+
+class ReadyIndex:
+    """
+    A worker-process view of the claimable jobs in storage, so picking the next
+    job costs O(log n) instead of a filter-and-sort over the whole table.
+
+    Due jobs sit in a ready heap ordered by (priority, created_at). Jobs whose
+    run_at is still in the future sit in a separate timer heap ordered by run_at
+    and only move to the ready heap once due, so scheduled work stays off the
+    hot path. The index is kept in sync by pulling the storage change feed
+    (ClaimableChangesSince) before each pick. It is only a hint: the claim itself
+    is still a compare-and-set in storage, so a job taken by another process is
+    simply skipped.
+
+    Heap entries are deleted lazily. `entries` maps a job id to its current key,
+    and anything popped that no longer matches is discarded. Each index follows
+    a single queue.
+    """
+    def __init__(self, fullResyncInterval=60, queue=DEFAULT_QUEUE):
+        self.queue = queue
+        self.lock = threading.Lock()
+        self.readyHeap = []
+        self.timerHeap = []
+        self.entries = {}
+        self.cursor = None
+        self.fullResyncInterval = fullResyncInterval
+        self.lastFullResync = 0.0
+
+    def Refresh(self):
+        """Applies the storage changes made since the last refresh."""
+        with self.lock:
+            # A PERIODIC FULL RESYNC HEALS ANY DRIFT, E.G. AFTER A FAILED CLAIM
+            if time.monotonic() - self.lastFullResync > self.fullResyncInterval:
+                self.cursor = None
+            rows, self.cursor, isFullSnapshot = GetStorage().ClaimableChangesSince(self.cursor, queue=self.queue)
+            if isFullSnapshot:
+                self.readyHeap, self.timerHeap, self.entries = [], [], {}
+                self.lastFullResync = time.monotonic()
+            for row in rows:
+                if row['state'] in CLAIMABLE_STATES:
+                    self.Add(row)
+                else:
+                    self.entries.pop(row['id'], None)
+
+    def Add(self, row):
+        priority = row['priority'] if row.get('priority') is not None else 10
+        entry = (priority, row['created_at'], row['run_at'], row['id'])
+        if self.entries.get(row['id']) == entry:
+            return
+        self.entries[row['id']] = entry
+        heapq.heappush(self.timerHeap, (row['run_at'], entry))
+
+    def PromoteDue(self, now):
+        """Moves every timer whose run_at has passed onto the ready heap."""
+        while self.timerHeap and self.timerHeap[0][0] <= now:
+            _, entry = heapq.heappop(self.timerHeap)
+            if self.entries.get(entry[3]) == entry:
+                heapq.heappush(self.readyHeap, entry)
+
+    def PopReady(self, now, limit):
+        """Removes and returns the ids of up to `limit` of the best due jobs."""
+        with self.lock:
+            self.PromoteDue(now)
+            jobIds = []
+            while self.readyHeap and len(jobIds) < limit:
+                entry = heapq.heappop(self.readyHeap)
+                if self.entries.get(entry[3]) == entry:
+                    del self.entries[entry[3]]
+                    jobIds.append(entry[3])
+            return jobIds
+
+    def NextRunAt(self):
+        """Returns the earliest run_at still waiting in the timer heap, or None."""
+        with self.lock:
+            while self.timerHeap and self.entries.get(self.timerHeap[0][1][3]) != self.timerHeap[0][1]:
+                heapq.heappop(self.timerHeap)
+            return self.timerHeap[0][0] if self.timerHeap else None
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class WeightedQueues:
+    """
+    Decides which queue a worker pulls from next, by smooth weighted round robin:
+    every job served adds each queue's weight to its credit and takes the total
+    weight off the credit of the queue that served it, and the queue with the
+    most credit goes first. With weights critical:5 and batch:1, a backlog in
+    both drains five critical jobs for every batch job, interleaved rather than
+    in bursts. A queue with nothing due is passed over, so its share goes to the
+    others; the credit it builds meanwhile is capped at one round.
+
+    Without weights every queue in storage is served at weight 1, and queues
+    created later are picked up within refreshInterval seconds.
+    """
+    def __init__(self, weights=None, refreshInterval=1.0):
+        self.lock = threading.Lock()
+        self.refreshInterval = refreshInterval
+        self.SetWeights(weights)
+
+    def SetWeights(self, weights):
+        """weights is {queue: positive int}, or None for every queue at weight 1."""
+        with self.lock:
+            self.fixedWeights = dict(weights) if weights else None
+            self.weights = dict(self.fixedWeights or {DEFAULT_QUEUE: 1})
+            self.credits = {}
+            self.lastRefresh = 0.0
+
+    def Refresh(self):
+        if self.fixedWeights is not None or time.monotonic() - self.lastRefresh < self.refreshInterval:
+            return
+        self.weights = {queue: 1 for queue in GetStorage().ListQueues()}
+        self.lastRefresh = time.monotonic()
+
+    def Order(self):
+        """Returns the queues to try, the one owed the next job first."""
+        with self.lock:
+            self.Refresh()
+            return sorted(self.weights, key=lambda q: self.credits.get(q, 0) + self.weights[q], reverse=True)
+
+    def Charge(self, queue, count=1):
+        """Records that queue just served count jobs."""
+        with self.lock:
+            total = sum(self.weights.values())
+            for _ in range(count):
+                for name, weight in self.weights.items():
+                    self.credits[name] = min(self.credits.get(name, 0) + weight, total)
+                self.credits[queue] = max(self.credits.get(queue, 0) - total, -total)
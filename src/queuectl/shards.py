@@ -0,0 +1,293 @@
+# shards.py - NAMED QUEUES: EACH QUEUE IS ITS OWN STORAGE SHARD (FILE, LOCK AND CHANGE FEED)
+import heapq
+import os
+import re
+import threading
+from .db import StorageBackend, StorageEngines, DEFAULT_QUEUE, SQLITE_PATH, TINYDB_PATH, LeaseDeadline, DuplicateReason, Rejection, OutcomeJobId
+from .stats import MergeStats
+
+# THE DEFAULT QUEUE KEEPS THE ORIGINAL DATABASE FILE; EVERY OTHER QUEUE GETS ONE
+# OF ITS OWN HERE, e.g. queues/reports.db, CREATED THE FIRST TIME IT IS USED
+QUEUES_DIR = 'queues'
+DEFAULT_SHARD_PATHS = {'sqlite': SQLITE_PATH, 'tinydb': TINYDB_PATH}
+SHARD_SUFFIXES = {'sqlite': '.db', 'tinydb': '.json'}
+
+# QUEUE NAMES BECOME FILE NAMES, SO THEY ARE KEPT TO A SAFE, SHORT ALPHABET
+QUEUE_NAME_PATTERN = re.compile(r'[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}')
+
+# JOB ID -> QUEUE ROUTES REMEMBERED FOR CALLS THAT ONLY CARRY A JOB ID. PAST THIS
+# MANY THE MAP STARTS OVER; A FORGOTTEN ROUTE IS FOUND AGAIN BY ASKING EACH SHARD.
+MAX_ROUTES = 100000
+
+# ORDERINGS OF QueryJobs ACROSS SHARDS. seq IS PER FILE, SO 'updated' FALLS BACK TO updated_at.
+MergedSortKeys = {
+    'updated': lambda j: j.get('updated_at') or 0,
+    'created_at': lambda j: j['created_at'],
+    'priority': lambda j: (j.get('priority', 10), j['created_at']),
+    'run_at': lambda j: j.get('run_at') or 0,
+}
+
+def ValidateQueueName(queue):
+    """Returns queue if it is a usable queue name, else raises ValueError."""
+    if not isinstance(queue, str) or not QUEUE_NAME_PATTERN.fullmatch(queue):
+        raise ValueError(f"Invalid queue name {queue!r}: use up to 64 letters, digits, '_', '-' or '.', not starting with '.'.")
+    return queue
+
+def ShardPath(engine, queue):
+    if queue == DEFAULT_QUEUE:
+        return DEFAULT_SHARD_PATHS[engine]
+    return os.path.join(QUEUES_DIR, queue + SHARD_SUFFIXES[engine])
+
+
+class ShardedStorage(StorageBackend):
+    """
+    One engine instance per named queue. SQLite takes one writer per file and the
+    JSON engine rewrites its whole file on every write, so giving each queue its
+    own file and lock lets claims and writes on different queues run in parallel.
+
+    Writes are routed by the job's queue: inserts carry it, and calls that only
+    carry a job id look it up in a map filled by inserts, claims and reads, asking
+    each shard in turn on a miss. Reads without a queue merge every shard. A
+    batch that spans several queues commits once per shard, not atomically.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.shards = {}
+        self.shardsLock = threading.Lock()
+        self.routes = {}
+
+    def Shard(self, queue=DEFAULT_QUEUE):
+        """Returns the engine holding queue, opening (and on first write creating) its file."""
+        with self.shardsLock:
+            shard = self.shards.get(queue)
+            if shard is None:
+                path = ShardPath(self.engine, ValidateQueueName(queue))
+                if queue != DEFAULT_QUEUE:
+                    os.makedirs(QUEUES_DIR, exist_ok=True)
+                shard = self.shards[queue] = StorageEngines[self.engine](path, countsArchive=queue == DEFAULT_QUEUE)
+            return shard
+
+    def ListQueues(self):
+        # ONE listdir, SO QUEUES ANOTHER PROCESS CREATED SHOW UP WITHOUT A RESTART
+        suffix = SHARD_SUFFIXES[self.engine]
+        try:
+            names = os.listdir(QUEUES_DIR)
+        except FileNotFoundError:
+            names = []
+        found = {name[:-len(suffix)] for name in names if name.endswith(suffix)}
+        with self.shardsLock:
+            found.update(self.shards)
+        found.discard(DEFAULT_QUEUE)
+        return [DEFAULT_QUEUE] + sorted(q for q in found if QUEUE_NAME_PATTERN.fullmatch(q))
+
+    def Shards(self, queue=None):
+        """Returns [(queue, engine)] for queue, or for every queue when it is None. Never creates a queue."""
+        if queue is None:
+            return [(q, self.Shard(q)) for q in self.ListQueues()]
+        if queue == DEFAULT_QUEUE or queue in self.ListQueues():
+            return [(queue, self.Shard(queue))]
+        ValidateQueueName(queue)
+        return []
+
+    def Remember(self, jobs, queue):
+        if len(self.routes) > MAX_ROUTES:
+            self.routes.clear()
+        for job in jobs:
+            self.routes[job['id']] = queue
+
+    def FindJob(self, jobId):
+        """Returns (queue, job) for the job with jobId, or (None, None)."""
+        queue = self.routes.get(jobId)
+        if queue is not None:
+            job = self.Shard(queue).GetJob(jobId)
+            if job is not None:
+                return queue, job
+        for queue, shard in self.Shards():
+            job = shard.GetJob(jobId)
+            if job is not None:
+                self.Remember([job], queue)
+                return queue, job
+        return None, None
+
+    def QueueOf(self, jobId):
+        queue = self.routes.get(jobId)
+        if queue is None:
+            queue = self.FindJob(jobId)[0] or DEFAULT_QUEUE
+        return queue
+
+    def GroupByQueue(self, items, jobIdOf):
+        """Splits items into {queue: [items]}, keeping their order within each queue."""
+        groups = {}
+        for item in items:
+            groups.setdefault(self.QueueOf(jobIdOf(item)), []).append(item)
+        return groups
+
+    def InsertJobs(self, jobs):
+        # IDS MUST BE UNIQUE ACROSS QUEUES, SINCE CALLS BY ID ARE ROUTED BY THEM. A SHARD
+        # ONLY REJECTS IDS IT HOLDS ITSELF, SO IDS ON OTHER QUEUES ARE CHECKED HERE FIRST
+        # (NOT ATOMICALLY: TWO PROCESSES MAY STILL PUT ONE ID ON TWO QUEUES AT ONCE).
+        queues = set(self.ListQueues()) | {job.get('queue', DEFAULT_QUEUE) for job in jobs}
+        heldBy = {}
+        if len(queues) > 1:
+            jobIds = {job['id'] for job in jobs}
+            for queue, shard in self.Shards():
+                for jobId in shard.StoredIds(jobIds):
+                    heldBy.setdefault(jobId, queue)
+        groups, rejected = {}, []
+        for index, job in enumerate(jobs):
+            queue = job.get('queue', DEFAULT_QUEUE)
+            if heldBy.setdefault(job['id'], queue) != queue:
+                rejected.append(Rejection(index, job, DuplicateReason(job, True, None)))
+            else:
+                groups.setdefault(queue, []).append((index, job))
+        for queue, entries in groups.items():
+            queueJobs = [job for _, job in entries]
+            for rejection in self.Shard(queue).InsertJobs(queueJobs):
+                rejection['index'] = entries[rejection['index']][0]
+                rejected.append(rejection)
+            self.Remember(queueJobs, queue)
+        rejected.sort(key=lambda r: r['index'])
+        return rejected
+
+    def GetJob(self, jobId):
+        return self.FindJob(jobId)[1]
+
+    def ClaimPending(self, now, updates, limit=1, queue=DEFAULT_QUEUE):
+        claimed = self.Shard(queue).ClaimPending(now, updates, limit)
+        self.Remember(claimed, queue)
+        return claimed
+
+    def ClaimByIds(self, jobIds, now, updates, queue=DEFAULT_QUEUE):
+        claimed = self.Shard(queue).ClaimByIds(jobIds, now, updates)
+        self.Remember(claimed, queue)
+        return claimed
+
+    def ClaimableChangesSince(self, cursor, queue=DEFAULT_QUEUE):
+        return self.Shard(queue).ClaimableChangesSince(cursor)
+
+    def ReleaseClaims(self, claims, updates):
+        for queue, queueClaims in self.GroupByQueue(claims, lambda c: c[0]).items():
+            self.Shard(queue).ReleaseClaims(queueClaims, updates)
+
+    def RenewLeases(self, claims, expiresAt):
+        renewed = set()
+        for queue, queueClaims in self.GroupByQueue(claims, lambda c: c[0]).items():
+            renewed |= self.Shard(queue).RenewLeases(queueClaims, expiresAt)
+        return renewed
+
+    def FindExpiredLeases(self, now, limit=100):
+        expired = []
+        for queue, shard in self.Shards():
+            jobs = shard.FindExpiredLeases(now, limit)
+            self.Remember(jobs, queue)
+            expired.extend(jobs)
+        expired.sort(key=LeaseDeadline)
+        return expired[:limit]
+
+    def ReapLeases(self, outcomes, now):
+        applied = []
+        for queue, queueOutcomes in self.GroupByQueue(outcomes, OutcomeJobId).items():
+            applied.extend(self.Shard(queue).ReapLeases(queueOutcomes, now))
+        return applied
+
+    def UpdateJob(self, jobId, updates):
+        self.Shard(self.QueueOf(jobId)).UpdateJob(jobId, updates)
+
+    def MoveToDlq(self, job):
+        self.Shard(self.QueueOf(job['id'])).MoveToDlq(job)
+
+    def ApplyOutcomes(self, outcomes):
+        applied = []
+        for queue, queueOutcomes in self.GroupByQueue(outcomes, OutcomeJobId).items():
+            applied.extend(self.Shard(queue).ApplyOutcomes(queueOutcomes))
+        return applied
+
+    def RetryFromDlq(self, jobId, updates):
+        # DLQ ENTRIES ARE NOT ROUTED, SO EACH QUEUE IS ASKED UNTIL ONE HAS IT
+        for queue, shard in self.Shards():
+            if shard.RetryFromDlq(jobId, updates):
+                return True
+        return False
+
+    def SearchJobs(self, state=None, queue=None):
+        return [job for _, shard in self.Shards(queue) for job in shard.SearchJobs(state)]
+
+    def IterJobs(self, state=None, after=None, queue=None):
+        return heapq.merge(*(shard.IterJobs(state, after) for _, shard in self.Shards(queue)), key=lambda j: j['id'])
+
+    def IterDlq(self, after=None, queue=None):
+        return heapq.merge(*(shard.IterDlq(after) for _, shard in self.Shards(queue)), key=lambda j: j['id'])
+
+    def QueryJobs(self, state, idPrefix=None, createdFrom=None, createdTo=None, sort='updated', descending=True, limit=50, offset=0, queue=None):
+        shards = self.Shards(queue)
+        if len(shards) == 1:
+            return shards[0][1].QueryJobs(state, idPrefix, createdFrom, createdTo, sort, descending, limit, offset)
+        # THE PAGE IS AMONG THE FIRST offset + limit OF SOME SHARD, SO THAT IS ALL EACH ONE RETURNS
+        jobs, total = [], 0
+        for _, shard in shards:
+            shardJobs, shardTotal = shard.QueryJobs(state, idPrefix, createdFrom, createdTo, sort, descending, offset + limit, 0)
+            jobs.extend(shardJobs)
+            total += shardTotal
+        jobs.sort(key=MergedSortKeys.get(sort, MergedSortKeys['updated']), reverse=descending)
+        return jobs[offset:offset + limit], total
+
+    def ChangesSince(self, cursor, limit=500):
+        # ONE CURSOR PER QUEUE, PACKED AS 'default=12|reports=7'; A QUEUE MISSING
+        # FROM IT (E.G. ONE CREATED SINCE) MAKES THE CALLER RELOAD
+        cursors = {}
+        for part in str(cursor).split('|') if cursor is not None else []:
+            queue, separator, queueCursor = part.partition('=')
+            if separator:
+                cursors[queue] = queueCursor
+        rows, newCursors, isFullRefresh = [], [], False
+        for queue, shard in self.Shards():
+            queueRows, queueCursor, queueFull = shard.ChangesSince(cursors.get(queue), limit)
+            rows.extend(queueRows)
+            newCursors.append(f'{queue}={queueCursor}')
+            isFullRefresh = isFullRefresh or queueFull
+        if isFullRefresh or len(rows) > limit:
+            return [], '|'.join(newCursors), True
+        return rows, '|'.join(newCursors), False
+
+    def ListDlq(self, queue=None):
+        return [job for _, shard in self.Shards(queue) for job in shard.ListDlq()]
+
+    def CountByState(self, queue=None):
+        counts = {}
+        for _, shard in self.Shards(queue):
+            for state, count in shard.CountByState().items():
+                counts[state] = counts.get(state, 0) + count
+        return counts
+
+    def CountActiveByPriority(self):
+        counts = {}
+        for _, shard in self.Shards():
+            for key, count in shard.CountActiveByPriority().items():
+                counts[key] = counts.get(key, 0) + count
+        return counts
+
+    def GetStats(self):
+        shards = self.Shards()
+        if len(shards) == 1:
+            return shards[0][1].GetStats()
+        return MergeStats(shard.GetStats() for _, shard in shards)
+
+    def PurgeFinished(self, kind, cutoff, keepCount, onPurge, limit=1000):
+        # RETENTION IS APPLIED TO EACH QUEUE ON ITS OWN, SO keepCount IS PER QUEUE
+        return sum(shard.PurgeFinished(kind, cutoff, keepCount, onPurge, limit) for _, shard in self.Shards())
+
+    def Compact(self):
+        return sum(shard.Compact() for _, shard in self.Shards())
+
+    # THE CONFIG IS GLOBAL AND LIVES IN THE DEFAULT QUEUE'S FILE
+    def GetConfig(self, configKey):
+        return self.Shard().GetConfig(configKey)
+
+    def SetConfig(self, configKey, configValue):
+        self.Shard().SetConfig(configKey, configValue)
+
+    def GetAllConfig(self):
+        return self.Shard().GetAllConfig()
+
+    def ConfigVersion(self):
+        return self.Shard().ConfigVersion()
@@ -0,0 +1,103 @@
+# stats.py - RUNNING COUNTERS AND DURATION HISTOGRAMS BEHIND `metrics`
+import bisect
+import time
+from .record import ParseTime
+
+# UPPER BOUNDS, IN SECONDS, OF THE DURATION HISTOGRAM BUCKETS: 5 MS DOUBLING UP TO
+# ABOUT 11.6 HOURS. ONE MORE BUCKET AT THE END CATCHES ANYTHING LONGER.
+DURATION_BUCKETS = [0.005 * 2 ** k for k in range(24)]
+
+# FINISHED JOBS ARE COUNTED IN SLOTS OF THIS MANY SECONDS, AND SLOTS OLDER THAN
+# THE HISTORY ARE DROPPED, SO THE LONGEST THROUGHPUT WINDOW IS 15 MINUTES
+THROUGHPUT_SLOT = 10
+THROUGHPUT_HISTORY = 15 * 60
+
+# WINDOWS REPORTED BY `queuectl metrics`, IN SECONDS
+THROUGHPUT_WINDOWS = (60, 300, 900)
+
+def EmptyStats():
+    """A fresh stats document. It is plain JSON so every backend can store it as-is."""
+    return {
+        'completed': 0,
+        'dead': 0,
+        'retried': 0,
+        'duration_count': 0,
+        'duration_sum': 0.0,
+        'histogram': [0] * (len(DURATION_BUCKETS) + 1),
+        'slots': {},
+    }
+
+def RecordFinish(stats, kind, durationSeconds, finishedAt):
+    """Counts one finished attempt. kind is 'completed', 'dead' or 'retried'."""
+    stats[kind] += 1
+    if kind == 'retried':
+        return
+    if durationSeconds is not None:
+        stats['duration_count'] += 1
+        stats['duration_sum'] += durationSeconds
+        stats['histogram'][bisect.bisect_left(DURATION_BUCKETS, durationSeconds)] += 1
+    if finishedAt:
+        # ARCHIVES WRITTEN BEFORE SCHEMA 2 HOLD ISO STRINGS
+        epoch = ParseTime(finishedAt)
+        slot = str(int(epoch // THROUGHPUT_SLOT) * THROUGHPUT_SLOT)
+        stats['slots'][slot] = stats['slots'].get(slot, 0) + 1
+
+def PruneSlots(stats, now=None):
+    oldest = (now or time.time()) - THROUGHPUT_HISTORY - THROUGHPUT_SLOT
+    stats['slots'] = {slot: n for slot, n in stats['slots'].items() if int(slot) >= oldest}
+
+def RecordOutcomes(stats, outcomes):
+    """Folds a batch of ApplyOutcomes outcomes into stats and returns it."""
+    for outcome in outcomes:
+        if outcome[0] == 'dlq':
+            job = outcome[1]
+            RecordFinish(stats, 'dead', job.get('duration_seconds'), job.get('finished_at'))
+        elif outcome[2].get('state') == 'completed':
+            updates = outcome[2]
+            RecordFinish(stats, 'completed', updates.get('duration_seconds'), updates.get('finished_at'))
+        elif outcome[2].get('state') == 'failed':
+            RecordFinish(stats, 'retried', None, None)
+    PruneSlots(stats)
+    return stats
+
+def BuildStats(completedJobs, deadJobs):
+    """Rebuilds stats from stored jobs, for databases that predate the counters."""
+    stats = EmptyStats()
+    for kind, jobs in (('completed', completedJobs), ('dead', deadJobs)):
+        for job in jobs:
+            RecordFinish(stats, kind, job.get('duration_seconds'), job.get('finished_at'))
+    PruneSlots(stats)
+    return stats
+
+def MergeStats(documents):
+    """Adds up stats documents, e.g. one per queue shard, into a new one."""
+    merged = EmptyStats()
+    for stats in documents:
+        for key in ('completed', 'dead', 'retried', 'duration_count', 'duration_sum'):
+            merged[key] += stats[key]
+        merged['histogram'] = [a + b for a, b in zip(merged['histogram'], stats['histogram'])]
+        for slot, n in stats['slots'].items():
+            merged['slots'][slot] = merged['slots'].get(slot, 0) + n
+    return merged
+
+def Percentile(stats, fraction):
+    """Estimates a duration percentile (fraction in 0..1) by interpolating inside its bucket."""
+    total = sum(stats['histogram'])
+    if not total:
+        return None
+    rank = fraction * total
+    seen = 0
+    for i, count in enumerate(stats['histogram']):
+        if count and seen + count >= rank:
+            lower = DURATION_BUCKETS[i - 1] if i > 0 else 0.0
+            if i == len(DURATION_BUCKETS):
+                return lower
+            return lower + (DURATION_BUCKETS[i] - lower) * (rank - seen) / count
+        seen += count
+    return DURATION_BUCKETS[-1]
+
+def Throughput(stats, windowSeconds, now=None):
+    """Jobs finished per second over the last windowSeconds."""
+    oldest = (now or time.time()) - windowSeconds
+    finished = sum(n for slot, n in stats['slots'].items() if int(slot) >= oldest)
+    return finished / windowSeconds
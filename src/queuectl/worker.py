@@ -1,49 +1,199 @@
 # worker.py - DEFINES WORKER LOGIC FOR PROCESSING JOBS (UPGRADED WITH BONUS FEATURES)
-import time
 import subprocess
 import threading
+import socket
 import os
+import random
+import time
+from collections import deque
 from .job import JobManager
-from .config import GetConfigValue
+from .config import GetConfigValue, GetJobSetting
+from .writer import OutcomeWriter
+from .scheduler import ReadyIndex, WeightedQueues
+from .notify import WorkerWakeup, WakeupListener
+from .joblog import JobLogWriter, ReadLogTail, RunStreamingProcess
+from .instrument import JobRuntimeSeconds, WorkerIdleSeconds
 
 StopEventFlag = threading.Event()
 
+# ALL WORKER THREADS HAND THEIR RESULTS TO ONE BATCHING WRITER
+CompletionWriter = OutcomeWriter()
+
+# ONE READY-QUEUE INDEX PER NAMED QUEUE, SHARED BY ALL WORKER THREADS OF THIS PROCESS
+WorkerReadyIndexes = {}
+WorkerReadyIndexesLock = threading.Lock()
+
+# WHICH QUEUES THIS PROCESS SERVES, AND IN WHAT PROPORTION (SEE `worker start --queues`)
+WorkerQueues = WeightedQueues()
+
+# RECEIVES ENQUEUE NOTIFICATIONS FROM OTHER PROCESSES
+WorkerWakeupListener = WakeupListener()
+
+# UPPER BOUND ON AN IDLE SLEEP, A SAFETY NET FOR WORK THAT ARRIVES WITHOUT A NOTIFICATION
+MAX_IDLE_WAIT = 5.0
+
+# HEARTBEATS PER leaseSeconds, SO A SLOW DISK OR A PAUSE THAT DELAYS ONE OF THEM
+# DOES NOT COST THE LEASE
+LEASE_RENEWALS_PER_PERIOD = 3
+
+class LeaseKeeper:
+    """
+    Renews every lease this process holds in one storage write per heartbeat and,
+    on the same beat, reaps the expired leases of workers that died. Stop() comes
+    after the last outcome is flushed, so jobs still finishing during a graceful
+    shutdown keep their leases.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.held = {}
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def Hold(self, jobs):
+        with self.lock:
+            for job in jobs:
+                self.held[job['id']] = job.get('lease_token')
+
+    def Drop(self, jobs):
+        with self.lock:
+            for job in jobs:
+                self.held.pop(job['id'], None)
+
+    def Start(self):
+        if self.thread is None:
+            self.stopEvent.clear()
+            self.thread = threading.Thread(target=self.RunHeartbeatLoop, name='LeaseKeeper', daemon=True)
+            self.thread.start()
+
+    def Stop(self):
+        if self.thread is not None:
+            self.stopEvent.set()
+            self.thread.join()
+            self.thread = None
+
+    def Heartbeat(self):
+        with self.lock:
+            claims = list(self.held.items())
+        renewed = JobManager.RenewLeases(claims)
+        with self.lock:
+            # A JOB DROPPED WHILE THE RENEWAL WAS IN FLIGHT FINISHED NORMALLY
+            lost = [jobId for jobId, token in claims if jobId not in renewed and self.held.get(jobId) == token]
+            for jobId in lost:
+                del self.held[jobId]
+        for jobId in lost:
+            print(f"LEASE ON JOB {jobId} WAS LOST. ANOTHER WORKER MAY RUN IT AGAIN.")
+
+    def Reap(self):
+        for outcome in JobManager.ReapExpiredLeases(ExpiredLeaseOutcome):
+            if outcome[0] == 'dlq':
+                print(f"JOB {outcome[1]['id']} LOST ITS WORKER AND REACHED MAX RETRIES. MOVED TO DLQ.")
+            else:
+                print(f"JOB {outcome[1]} LOST ITS WORKER. REQUEUED FOR ANOTHER ATTEMPT.")
+
+    def RunHeartbeatLoop(self):
+        while True:
+            try:
+                self.Heartbeat()
+                self.Reap()
+            except Exception as e:
+                # THE NEXT BEAT TRIES AGAIN; LEASES OUTLAST SEVERAL MISSED BEATS
+                print(f"LEASE HEARTBEAT FAILED: {e}")
+            if self.stopEvent.wait(GetConfigValue('leaseSeconds') / LEASE_RENEWALS_PER_PERIOD):
+                return
+
+# KEEPS THE LEASES OF EVERY JOB THIS PROCESS HAS CLAIMED, IN EITHER ENGINE
+WorkerLeases = LeaseKeeper()
+
 def EnsureLogDirectory():
     """Ensures the 'logs' directory exists."""
     os.makedirs('logs', exist_ok=True)
 
-def RunWorkerLoop(workerId):
+def WorkerOwnerName(workerId):
+    """Identifies a worker across processes and hosts, e.g. 'host:4242:1'."""
+    return f"{socket.gethostname()}:{os.getpid()}:{workerId}"
+
+def ReadyIndexFor(queue):
+    with WorkerReadyIndexesLock:
+        if queue not in WorkerReadyIndexes:
+            WorkerReadyIndexes[queue] = ReadyIndex(queue=queue)
+        return WorkerReadyIndexes[queue]
+
+def ClaimNextJobs(batchSize, owner):
+    """Claims up to batchSize jobs from the queue owed the next job that has any due. Returns a list."""
+    for queue in WorkerQueues.Order():
+        claimed = JobManager.FindAndLockPending(batchSize, owner, ReadyIndexFor(queue))
+        if claimed:
+            WorkerQueues.Charge(queue, len(claimed))
+            return claimed
+    return []
+
+def IdleWaitSeconds():
+    """Sleeps until the earliest scheduled job is due, but never longer than MAX_IDLE_WAIT."""
+    with WorkerReadyIndexesLock:
+        indexes = list(WorkerReadyIndexes.values())
+    nextRunAt = min((r for r in (index.NextRunAt() for index in indexes) if r is not None), default=None)
+    if nextRunAt is None:
+        return MAX_IDLE_WAIT
+    untilDue = nextRunAt - time.time()
+    return min(max(untilDue, 0.0), MAX_IDLE_WAIT)
+
+def RunWorkerLoop(workerId, prefetchDepth=1):
     EnsureLogDirectory()
+    owner = WorkerOwnerName(workerId)
+    # LOCAL PREFETCH BUFFER OF JOBS LEASED TO THIS WORKER BUT NOT YET STARTED
+    prefetched = deque()
     print(f"WORKER {workerId} STARTED.")
-    while not StopEventFlag.is_set():
-        jobToProcess = JobManager.FindAndLockPending()
-        if jobToProcess:
-            print(f"WORKER {workerId} PICKED UP JOB {jobToProcess['id']}.")
-            ExecuteJob(jobToProcess)
-        else:
-            time.sleep(1)
+    try:
+        while not StopEventFlag.is_set():
+            # READ BEFORE LOOKING FOR WORK SO A WAKEUP IN BETWEEN IS NOT MISSED
+            seenGeneration = WorkerWakeup.generation
+            if not prefetched:
+                claimed = ClaimNextJobs(prefetchDepth, owner)
+                WorkerLeases.Hold(claimed)
+                prefetched.extend(claimed)
+            if prefetched:
+                jobToProcess = prefetched.popleft()
+                print(f"WORKER {workerId} PICKED UP JOB {jobToProcess['id']}.")
+                ExecuteJob(jobToProcess)
+            else:
+                idleStart = time.perf_counter()
+                WorkerWakeup.Wait(seenGeneration, IdleWaitSeconds())
+                WorkerIdleSeconds.Inc(time.perf_counter() - idleStart, 'thread')
+    finally:
+        # HANDING UNSTARTED JOBS BACK TO THE QUEUE
+        if prefetched:
+            print(f"WORKER {workerId} RETURNING {len(prefetched)} PREFETCHED JOB(S) TO THE QUEUE.")
+            JobManager.ReleaseJobs(list(prefetched))
+            WorkerLeases.Drop(prefetched)
     print(f"WORKER {workerId} STOPPING.")
 
+def OpenJobLog(currentJob):
+    return JobLogWriter(currentJob['log_file'], GetConfigValue('logMaxBytes'), GetConfigValue('logBackups'))
+
 def ExecuteJob(currentJob):
-    updates = {}
+    # PREFETCHED JOBS MAY HAVE WAITED IN THE BUFFER, SO THE CLOCK STARTS HERE
+    currentJob['started_at'] = time.time()
+    updates = {'started_at': currentJob['started_at']}
+    runStart = time.perf_counter()
+    outcome = 'error'
     try:
         timeout = currentJob.get('timeout', 300)
-        result = subprocess.run(
-            currentJob['command'],
-            shell=True,
-            check=True,
-            capture_output=True, 
-            text=True,
-            timeout=timeout
-        )
-        updates['state'] = 'completed'
-        updates['output'] = result.stdout[-1000:] # CAPTURE LAST 1000 CHARACTERS
-        print(f"JOB {currentJob['id']} SUCCEEDED.")
-    except subprocess.CalledProcessError as error:
-        updates['state'] = 'failed'
-        updates['output'] = error.stderr[-1000:]
-        print(f"JOB {currentJob['id']} FAILED: {error}")
+        # OUTPUT IS STREAMED TO THE LOG FILE AS IT IS PRODUCED, NEVER HELD IN MEMORY
+        with OpenJobLog(currentJob) as jobLog:
+            try:
+                returnCode = RunStreamingProcess(currentJob['command'], timeout, jobLog)
+            except subprocess.TimeoutExpired as terror:
+                jobLog.WriteNote(f"Job timed out after {terror.timeout} seconds.")
+                raise
+            if returnCode == 0:
+                updates['state'] = outcome = 'completed'
+                print(f"JOB {currentJob['id']} SUCCEEDED.")
+            else:
+                jobLog.WriteNote(f"Command exited with status {returnCode}.")
+                updates['state'] = outcome = 'failed'
+                print(f"JOB {currentJob['id']} FAILED: Command '{currentJob['command']}' returned non-zero exit status {returnCode}.")
     except subprocess.TimeoutExpired as terror:
+        outcome = 'timeout'
         updates['state'] = 'failed'
         updates['output'] = f"Job timed out after {terror.timeout} seconds."
         print(f"JOB {currentJob['id']} FAILED: TIMEOUT")
@@ -51,49 +201,120 @@ def ExecuteJob(currentJob):
         updates['state'] = 'failed'
         updates['output'] = f"An unexpected error occurred: {str(e)}"
         print(f"JOB {currentJob['id']} FAILED: UNEXPECTED ERROR")
+    JobRuntimeSeconds.Observe(time.perf_counter() - runStart, outcome)
 
-    # WRITING LOG OUTPUT TO FILE
-    full_output = updates.get('output', 'No output captured.')
-    if 'result' in locals() and result:
-        full_output = f"STDOUT:\n{result.stdout}\n\nSTDERR:\n{result.stderr}"
-    
-    try:
-        with open(currentJob['log_file'], 'w') as f:
-            f.write(full_output)
-    except IOError as e:
-        print(f"Could not write log for job {currentJob['id']}: {e}")
+    FinishJob(currentJob, updates)
+
+def FinishJob(currentJob, updates):
+    """Fills in the output tail and hands the job's outcome to the writer. Shared by all engines."""
+    # DROPPED BEFORE SUBMITTING: THE LEASE OUTLIVES THE FLUSH WITHOUT ANOTHER RENEWAL
+    WorkerLeases.Drop([currentJob])
+    if 'output' not in updates:
+        # THE LAST 1000 CHARACTERS, READ FROM THE END OF THE LOG
+        updates['output'] = ReadLogTail(currentJob['log_file'], 1000)
 
     # FINALIZING JOB STATUS
     if updates.get('state') == 'completed':
-        JobManager.UpdateJob(currentJob['id'], updates)
+        CompletionWriter.SubmitUpdate(currentJob['id'], updates, currentJob.get('lease_token'))
     else:
         HandleFailure(currentJob, updates)
 
-def HandleFailure(failedJob, updates):
+def ComputeBackoffDelay(attempts, job=None):
+    """
+    Exponential backoff, capped, with optional jitter so retries do not synchronize.
+    Fields set on the job (backoff_base, backoff_cap, backoff_jitter) win over the config.
+    """
+    job = job or {}
+    backoffDelay = min(GetJobSetting(job, 'backoff_base') ** attempts, GetJobSetting(job, 'backoff_cap'))
+    jitterPercent = GetJobSetting(job, 'backoff_jitter')
+    if jitterPercent:
+        backoffDelay -= backoffDelay * (jitterPercent / 100) * random.random()
+    return backoffDelay
+
+def FailureOutcome(failedJob, updates):
+    """
+    Counts a failed attempt and decides what comes next: a retry after backoff, or
+    the DLQ once max_retries is reached. Returns (outcome, backoffDelay), where
+    backoffDelay is None for the DLQ. The outcome is fenced by the job's current
+    lease, so it is dropped if another worker holds the job by the time it is written.
+    """
+    leaseToken = failedJob.get('lease_token')
     newAttemptCount = failedJob['attempts'] + 1
-    maxRetries = GetConfigValue('maxRetries')
+    if newAttemptCount >= GetJobSetting(failedJob, 'max_retries'):
+        # THE DLQ RECORD CARRIES THE FAILURE OUTPUT, SO ONE WRITE IS ENOUGH
+        failedJob.update(updates)
+        failedJob['attempts'] = newAttemptCount
+        return ('dlq', JobManager.PrepareDlqRecord(failedJob), leaseToken), None
 
-    JobManager.UpdateJob(failedJob['id'], updates) 
+    backoffDelay = ComputeBackoffDelay(newAttemptCount, failedJob)
+    # RESCHEDULING INSTEAD OF SLEEPING: THE JOB STAYS 'failed' UNTIL ITS NEW
+    # run_at PASSES, AND THIS WORKER IS FREE TO PICK UP OTHER WORK AT ONCE
+    updates['attempts'] = newAttemptCount
+    updates['run_at'] = time.time() + backoffDelay
+    return ('update', failedJob['id'], JobManager.PrepareUpdate(failedJob['id'], updates), leaseToken), backoffDelay
 
-    if newAttemptCount >= maxRetries:
+def HandleFailure(failedJob, updates):
+    outcome, backoffDelay = FailureOutcome(failedJob, updates)
+    if backoffDelay is None:
         print(f"JOB {failedJob['id']} REACHED MAX RETRIES. MOVING TO DLQ.")
-        JobManager.MoveToDlq(failedJob)
     else:
-        backoffDelay = GetConfigValue('backoffBase') ** newAttemptCount
-        print(f"JOB {failedJob['id']} WILL RETRY IN {backoffDelay} SECONDS.")
-        # UPDATING ATTEMPT COUNT BEFORE SLEEPING
-        JobManager.UpdateJob(failedJob['id'], {"attempts": newAttemptCount})
-        time.sleep(backoffDelay)
-        # RESETTING JOB STATE TO PENDING FOR RETRY
-        JobManager.UpdateJob(failedJob['id'], {"state": "pending"})
-
-def StartWorkers(workerCount):
+        print(f"JOB {failedJob['id']} WILL RETRY IN {backoffDelay:.2f} SECONDS.")
+    CompletionWriter.Submit(outcome)
+
+def ExpiredLeaseOutcome(expiredJob):
+    """The reaper's verdict on a job whose worker stopped renewing its lease: one failed attempt."""
+    updates = {
+        'state': 'failed',
+        'started_at': expiredJob.get('started_at'),
+        'output': f"Lease held by {expiredJob.get('owner')} expired; the worker is presumed dead.",
+        'owner': None,
+        'lease_token': None,
+        'lease_expires_at': None,
+    }
+    return FailureOutcome(expiredJob, updates)[0]
+
+def RunGarbageCollector(interval):
+    """Archives expired jobs every interval seconds until the workers stop."""
+    while not StopEventFlag.wait(interval):
+        try:
+            purged = JobManager.CollectGarbage()
+        except Exception as e:
+            # A FAILED PASS (E.G. A FULL DISK) IS RETRIED NEXT INTERVAL; NOTHING WAS DELETED
+            print(f"GARBAGE COLLECTION FAILED: {e}")
+            continue
+        if any(purged.values()):
+            print(f"ARCHIVED {purged['completed']} COMPLETED JOB(S) AND {purged['dlq']} DLQ ENTR(IES).")
+
+def StartWorkerServices(flushBatchSize=100, flushLatency=0.05, gcInterval=0, queueWeights=None):
+    """
+    Starts the per-process helpers every engine relies on. queueWeights is
+    {queue: weight} for the queues to serve, or None for all of them equally.
+    """
+    WorkerQueues.SetWeights(queueWeights)
+    CompletionWriter.maxBatchSize = flushBatchSize
+    CompletionWriter.maxFlushLatency = flushLatency
+    CompletionWriter.Start()
+    WorkerWakeupListener.Start()
+    WorkerLeases.Start()
+    if gcInterval:
+        threading.Thread(target=RunGarbageCollector, args=(gcInterval,), name='GarbageCollector', daemon=True).start()
+
+def StartWorkers(workerCount, prefetchDepth=1, flushBatchSize=100, flushLatency=0.05, gcInterval=0, queueWeights=None):
+    StartWorkerServices(flushBatchSize, flushLatency, gcInterval, queueWeights)
     workerThreads = []
     for i in range(workerCount):
-        aThread = threading.Thread(target=RunWorkerLoop, args=(i + 1,))
+        aThread = threading.Thread(target=RunWorkerLoop, args=(i + 1, prefetchDepth))
         aThread.start()
         workerThreads.append(aThread)
     return workerThreads
 
 def StopWorkers():
-    StopEventFlag.set()
\ No newline at end of file
+    StopEventFlag.set()
+    WorkerWakeupListener.Close()
+    # WAKING IDLE WORKERS SO THEY SEE THE STOP FLAG AT ONCE
+    WorkerWakeup.Notify()
+
+def FlushOutcomes():
+    """Commits every buffered job outcome. Call once the worker threads have exited."""
+    CompletionWriter.Stop()
+    WorkerLeases.Stop()
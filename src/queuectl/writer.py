@@ -0,0 +1,112 @@
+# writer.py - COALESCES JOB OUTCOMES INTO BATCHED STORAGE COMMITS
+import queue
+import threading
+import time
+from .db import GetStorage, OutcomeJobId
+from .job import JobManager
+from .notify import NotifyWorkers
+from .instrument import JobWriteSeconds, OutcomeBatchSize
+
+# A BATCH THAT FAILS TO COMMIT IS RETRIED AFTER THIS MANY SECONDS, DOUBLING UP TO THE MAXIMUM
+FLUSH_RETRY_DELAY = 0.1
+FLUSH_RETRY_MAX_DELAY = 5.0
+
+class OutcomeWriter:
+    """
+    Collects terminal updates, attempt increments and DLQ moves from the workers
+    and flushes them to storage as one transaction per batch. A batch is flushed
+    once it holds maxBatchSize outcomes or its oldest outcome has waited
+    maxFlushLatency seconds, whichever comes first.
+
+    DURABILITY: an outcome is durable only after the batch holding it commits.
+    If the process crashes, outcomes still in the queue (at most maxBatchSize,
+    no older than maxFlushLatency) are lost. Their jobs stay in 'processing',
+    so the commands already ran but their result was not recorded, and they
+    run again once their lease expires and is reaped. Stop() flushes everything that was
+    submitted before returning, so a clean shutdown loses nothing. An outcome
+    that reaches storage after its lease was reaped is dropped (see ApplyOutcomes).
+
+    A batch whose commit fails (a database locked past its timeout, a full disk)
+    is kept and retried with backoff until it commits; outcomes submitted
+    meanwhile wait behind it. The workers dropped those leases when they submitted
+    the outcomes, so if storage stays unwritable for longer than leaseSeconds the
+    jobs may be reaped and run again, and their outcomes are then dropped when the
+    batch finally commits. Once Stop() is called a failing batch gets one more
+    attempt and is then given up, leaving its jobs to the reaper as after a crash.
+    """
+    def __init__(self, maxBatchSize=100, maxFlushLatency=0.05):
+        self.maxBatchSize = maxBatchSize
+        self.maxFlushLatency = maxFlushLatency
+        self.pending = queue.Queue()
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def Start(self):
+        if self.thread is None:
+            self.stopEvent.clear()
+            self.thread = threading.Thread(target=self.RunFlushLoop, name='OutcomeWriter', daemon=True)
+            self.thread.start()
+
+    def Stop(self):
+        """Flushes every submitted outcome, then stops the flush thread."""
+        if self.thread is not None:
+            self.stopEvent.set()
+            self.pending.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def Submit(self, outcome):
+        # WITHOUT A RUNNING FLUSH THREAD, WRITE THROUGH IMMEDIATELY
+        if self.thread is None:
+            GetStorage().ApplyOutcomes([outcome])
+        else:
+            self.pending.put(outcome)
+
+    def SubmitUpdate(self, jobId, updates, leaseToken):
+        self.Submit(('update', jobId, JobManager.PrepareUpdate(jobId, updates), leaseToken))
+
+    def RunFlushLoop(self):
+        stopping = False
+        while not stopping:
+            outcome = self.pending.get()
+            if outcome is None:
+                break
+            batch = [outcome]
+            deadline = time.monotonic() + self.maxFlushLatency
+
+            # GATHERING MORE OUTCOMES UNTIL THE BATCH IS FULL OR THE DEADLINE PASSES
+            while len(batch) < self.maxBatchSize:
+                remaining = deadline - time.monotonic()
+                try:
+                    outcome = self.pending.get(timeout=max(remaining, 0)) if remaining > 0 else self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if outcome is None:
+                    stopping = True
+                    break
+                batch.append(outcome)
+            self.Flush(batch)
+
+    def Flush(self, batch):
+        OutcomeBatchSize.Observe(len(batch))
+        retryDelay = FLUSH_RETRY_DELAY
+        while True:
+            stopping = self.stopEvent.is_set()
+            try:
+                with JobWriteSeconds.Time('ApplyOutcomes'):
+                    applied = GetStorage().ApplyOutcomes(batch)
+                break
+            except Exception as e:
+                if stopping:
+                    print(f"OUTCOME WRITER GAVE UP ON {len(batch)} OUTCOME(S) AT SHUTDOWN: {e}")
+                    return
+                print(f"OUTCOME WRITER FAILED TO COMMIT {len(batch)} OUTCOME(S), RETRYING IN {retryDelay:.1f}S: {e}")
+                self.stopEvent.wait(retryDelay)
+                retryDelay = min(retryDelay * 2, FLUSH_RETRY_MAX_DELAY)
+        appliedIds = {OutcomeJobId(o) for o in applied}
+        for outcome in batch:
+            if OutcomeJobId(outcome) not in appliedIds:
+                print(f"OUTCOME OF JOB {OutcomeJobId(outcome)} DROPPED: ITS LEASE EXPIRED AND WAS REAPED BEFORE IT WAS WRITTEN.")
+        # RESCHEDULED RETRIES ARE NEW WORK THAT IDLE WORKERS SHOULD SEE
+        if any(o[0] == 'update' and o[2].get('state') == 'failed' for o in applied):
+            NotifyWorkers()
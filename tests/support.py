@@ -0,0 +1,67 @@
+# support.py - SHARED SETUP FOR THE BEHAVIOUR TESTS: EACH TEST GETS ITS OWN EMPTY QUEUE DIRECTORY
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from queuectl import db
+from queuectl.config import SharedConfig, GetJobSetting
+from queuectl.job import JobManager
+from queuectl.worker import FailureOutcome
+
+# RUNS THE queuectl CLI OF THIS CHECKOUT, WHATEVER IS ON PATH
+CLI_COMMAND = [sys.executable, '-c', 'from queuectl.cli import MainCLI; MainCLI()']
+
+class QueueTestCase(unittest.TestCase):
+    """
+    Runs each test in a fresh temporary directory, which is where queuectl keeps
+    its database files, with QUEUECTL_STORAGE set to the class's engine. A test
+    class covers the JSON engine too by subclassing with engine = 'tinydb'.
+    """
+    engine = 'sqlite'
+
+    def setUp(self):
+        self.previousDir = os.getcwd()
+        self.previousEngine = os.environ.get('QUEUECTL_STORAGE')
+        self.workDir = tempfile.mkdtemp(prefix='queuectl-test-')
+        os.chdir(self.workDir)
+        os.environ['QUEUECTL_STORAGE'] = self.engine
+        # STORAGE AND CONFIG ARE CACHED PER PROCESS, SO EACH TEST STARTS THEM OVER
+        db.StorageInstances.clear()
+        SharedConfig.Invalidate()
+
+    def tearDown(self):
+        db.StorageInstances.clear()
+        SharedConfig.Invalidate()
+        os.chdir(self.previousDir)
+        if self.previousEngine is None:
+            os.environ.pop('QUEUECTL_STORAGE', None)
+        else:
+            os.environ['QUEUECTL_STORAGE'] = self.previousEngine
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def RunCli(self, *args, input=None):
+        """Runs `queuectl args...` in the test directory. Returns the CompletedProcess."""
+        return subprocess.run(CLI_COMMAND + list(args), input=input, capture_output=True, text=True, timeout=60)
+
+    def FinishJobs(self, count, dead=False):
+        """
+        Claims up to count due jobs and completes them, or with dead moves them to
+        the DLQ whatever their max_retries. Returns the ids in claim order.
+        """
+        outcomes = []
+        jobs = JobManager.FindAndLockPending(count, owner='test')
+        for job in jobs:
+            if dead:
+                job['attempts'] = GetJobSetting(job, 'max_retries') - 1
+                outcomes.append(FailureOutcome(job, {'state': 'failed', 'output': 'failed'})[0])
+            else:
+                updates = JobManager.PrepareUpdate(job['id'], {'state': 'completed'})
+                outcomes.append(('update', job['id'], updates, job['lease_token']))
+        self.assertEqual(len(db.GetStorage().ApplyOutcomes(outcomes)), len(jobs))
+        return [job['id'] for job in jobs]
+
+    def RunPython(self, code, *args):
+        """Starts a Python process running code in the test directory. Returns the Popen."""
+        return subprocess.Popen([sys.executable, '-c', code, *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
@@ -0,0 +1,95 @@
+# test_claims.py - A JOB IS ONLY EVER CLAIMED BY ONE WORKER, ACROSS PROCESSES
+import json
+from support import QueueTestCase
+from queuectl.db import GetStorage
+from queuectl.job import JobManager
+
+# CLAIMS JOBS UNTIL NONE ARE LEFT AND PRINTS THE IDS IT GOT AS JSON. WITH 'index'
+# THE CANDIDATES COME FROM A ReadyIndex (ClaimByIds), ELSE FROM ClaimPending. EVERY
+# PROCESS SAYS 'ready' AND WAITS FOR THE START FILE, SO THEY ALL RACE FROM THE SAME MOMENT.
+CLAIMING_PROCESS = """
+import json, os, sys, time
+from queuectl.db import GetStorage
+from queuectl.job import JobManager
+from queuectl.scheduler import ReadyIndex
+owner, mode = sys.argv[1], sys.argv[2]
+readyIndex = ReadyIndex() if mode == 'index' else None
+GetStorage().CountByState()
+print('ready', flush=True)
+while not os.path.exists('start'):
+    time.sleep(0.001)
+claimed = []
+while True:
+    jobs = JobManager.FindAndLockPending(2, owner, readyIndex)
+    if not jobs:
+        break
+    claimed.extend(job['id'] for job in jobs)
+print(json.dumps(claimed))
+"""
+
+JOB_COUNT = 300
+PROCESS_COUNT = 6
+
+class ClaimTests(QueueTestCase):
+    def EnqueueJobs(self, count):
+        JobManager.CreateJobs(json.dumps({'id': f'job{i:03d}', 'command': 'true'}) for i in range(count))
+        return {f'job{i:03d}' for i in range(count)}
+
+    def testConcurrentProcessesNeverClaimAJobTwice(self):
+        jobIds = self.EnqueueJobs(JOB_COUNT)
+        processes = [
+            self.RunPython(CLAIMING_PROCESS, f'worker{i}', 'index' if i % 2 else 'pending')
+            for i in range(PROCESS_COUNT)
+        ]
+        for process in processes:
+            self.assertEqual(process.stdout.readline().strip(), 'ready', process.stderr.read() if process.poll() else '')
+        open('start', 'w').close()
+        claims = []
+        for process in processes:
+            stdout, stderr = process.communicate(timeout=120)
+            self.assertEqual(process.returncode, 0, stderr)
+            claims.extend(json.loads(stdout.strip().splitlines()[-1]))
+
+        self.assertEqual(len(claims), len(set(claims)), "a job was claimed by two workers")
+        self.assertEqual(set(claims), jobIds)
+        counts = GetStorage().CountByState()
+        self.assertEqual(counts.get('processing'), JOB_COUNT)
+        self.assertFalse(counts.get('pending'))
+
+    def testClaimRecordsOwnerAndLease(self):
+        self.EnqueueJobs(2)
+        first = JobManager.FindAndLockPending(1, owner='a')
+        second = JobManager.FindAndLockPending(1, owner='b')
+        self.assertEqual([len(first), len(second)], [1, 1])
+        self.assertNotEqual(first[0]['id'], second[0]['id'])
+        self.assertNotEqual(first[0]['lease_token'], second[0]['lease_token'])
+        stored = GetStorage().GetJob(first[0]['id'])
+        self.assertEqual((stored['state'], stored['owner']), ('processing', 'a'))
+        self.assertEqual(JobManager.FindAndLockPending(1, owner='c'), [])
+
+    def testBatchClaimTakesTheBestDueJobsInOrder(self):
+        JobManager.CreateJob('{"id":"low","command":"true","priority":20}')
+        JobManager.CreateJob('{"id":"high","command":"true","priority":1}')
+        JobManager.CreateJob('{"id":"later","command":"true","priority":1,"run_at":"2999-01-01T00:00:00Z"}')
+        JobManager.CreateJob('{"id":"normal1","command":"true"}')
+        JobManager.CreateJob('{"id":"normal2","command":"true"}')
+        claimed = JobManager.FindAndLockPending(3, owner='a')
+        self.assertEqual([job['id'] for job in claimed], ['high', 'normal1', 'normal2'])
+        self.assertEqual(len({job['lease_token'] for job in claimed}), 1)
+        self.assertEqual([job['id'] for job in JobManager.FindAndLockPending(3, owner='b')], ['low'])
+        self.assertEqual(GetStorage().GetJob('later')['state'], 'pending')
+
+    def testReleasedJobsAreClaimableAgain(self):
+        self.EnqueueJobs(3)
+        claimed = JobManager.FindAndLockPending(3, owner='a')
+        JobManager.ReleaseJobs(claimed[1:])
+        for job in claimed[1:]:
+            stored = GetStorage().GetJob(job['id'])
+            self.assertEqual((stored['state'], stored.get('attempts', 0)), ('pending', 0))
+            self.assertNotIn('owner', stored)
+        self.assertEqual(GetStorage().GetJob('job000')['state'], 'processing')
+        self.assertEqual([job['id'] for job in JobManager.FindAndLockPending(3, owner='b')], ['job001', 'job002'])
+
+
+class TinyDbClaimTests(ClaimTests):
+    engine = 'tinydb'
@@ -0,0 +1,59 @@
+# test_config.py - CACHED CONFIG, AND WHICH JOBS A `config set` REACHES
+import time
+from support import QueueTestCase
+from queuectl.config import ConfigCache, GetConfigValue, SetConfigValue
+from queuectl.db import GetStorage
+from queuectl.job import JobManager
+from queuectl.record import Upgrade
+from queuectl.worker import FailureOutcome
+
+class ConfigCacheTests(QueueTestCase):
+    def testChangeFromAnotherProcessIsSeenAfterTheCheckInterval(self):
+        cache = ConfigCache(checkInterval=0.3)
+        self.assertIsNone(cache.Get('maxRetries'))
+        result = self.RunCli('config', 'set', 'max-retries', '9')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        # STILL SERVED FROM MEMORY UNTIL THE INTERVAL RUNS OUT
+        self.assertIsNone(cache.Get('maxRetries'))
+        time.sleep(0.35)
+        self.assertEqual(cache.Get('maxRetries'), 9)
+
+    def testOwnChangeIsSeenAtOnce(self):
+        self.assertEqual(GetConfigValue('maxRetries'), 3)
+        SetConfigValue('maxRetries', 5)
+        self.assertEqual(GetConfigValue('maxRetries'), 5)
+
+
+class MaxRetriesTests(QueueTestCase):
+    def FailOnce(self):
+        job, = JobManager.FindAndLockPending(1, owner='a')
+        outcome, _ = FailureOutcome(job, {'state': 'failed', 'output': 'failed'})
+        return outcome[0]
+
+    def testConfigChangeReachesQueuedJobs(self):
+        JobManager.CreateJob('{"id":"queued","command":"false"}')
+        self.assertNotIn('max_retries', GetStorage().GetJob('queued'))
+        SetConfigValue('maxRetries', 1)
+        self.assertEqual(self.FailOnce(), 'dlq')
+
+    def testJobOverrideWinsOverTheConfig(self):
+        JobManager.CreateJob('{"id":"x","command":"false","max_retries":5}')
+        SetConfigValue('maxRetries', 1)
+        self.assertEqual(self.FailOnce(), 'update')
+        self.assertEqual(GetStorage().GetJob('x')['max_retries'], 5)
+
+    def testInvalidMaxRetriesIsRejected(self):
+        for value in ('-1', '1.5', '"3"', 'true'):
+            with self.assertRaises(ValueError):
+                JobManager.CreateJob(f'{{"command":"true","max_retries":{value}}}')
+
+    def testSchemaOneCopyOfTheConfigIsDropped(self):
+        created = '2024-01-02T03:04:05Z'
+        old = {'id': 'x', 'command': 'true', 'state': 'pending', 'max_retries': 3, 'created_at': created, 'run_at': created}
+        self.assertNotIn('max_retries', Upgrade(old))
+        # A CURRENT DOCUMENT'S max_retries IS THE JOB'S OWN OVERRIDE
+        self.assertEqual(Upgrade({**Upgrade(old), 'max_retries': 3})['max_retries'], 3)
+
+
+class TinyDbMaxRetriesTests(MaxRetriesTests):
+    engine = 'tinydb'
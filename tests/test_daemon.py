@@ -0,0 +1,82 @@
+# test_daemon.py - `queuectl serve`, AND FALLING BACK TO STORAGE WHEN THE DAEMON GOES AWAY
+import os
+import signal
+import socketserver
+import subprocess
+import threading
+from support import QueueTestCase, CLI_COMMAND
+from queuectl.daemon import RemoteBackend, StorageRequestHandler, SocketPath, DAEMON_DIR, ReceiveMessage, SendMessage
+from queuectl.db import GetStorage, OpenStorage
+
+class HangUpOnInsert(StorageRequestHandler):
+    """Answers like the daemon, but closes the connection on a request to insert jobs, as if it had crashed."""
+    def handle(self):
+        while True:
+            request = ReceiveMessage(self.request)
+            if request is None or request['op'] in ('InsertJob', 'InsertJobs'):
+                return
+            SendMessage(self.request, {'result': self.Dispatch(self.server.backend, request)})
+
+
+class DaemonTests(QueueTestCase):
+    def StartDaemon(self):
+        daemon = subprocess.Popen(CLI_COMMAND + ['serve'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        self.addCleanup(daemon.wait)
+        self.addCleanup(daemon.kill)
+        self.assertIn('Serving', daemon.stdout.readline())
+        return daemon
+
+    def Status(self):
+        result = self.RunCli('status')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def testCommandsUseTheDaemonWhileItRuns(self):
+        daemon = self.StartDaemon()
+        self.assertEqual(self.RunCli('enqueue', '{"id":"x","command":"true"}').returncode, 0)
+        self.assertIsInstance(GetStorage(), RemoteBackend)
+        self.assertEqual(GetStorage().GetJob('x')['state'], 'pending')
+
+        daemon.send_signal(signal.SIGINT)
+        self.assertEqual(daemon.wait(30), 0)
+        self.assertFalse(os.path.exists(SocketPath(self.engine)))
+        self.assertIn('Pending: 1', self.Status())
+
+    def testKilledDaemonFallsBackToStorage(self):
+        daemon = self.StartDaemon()
+        self.assertEqual(self.RunCli('enqueue', '{"id":"x","command":"true"}').returncode, 0)
+        storage = GetStorage()
+        self.assertIsInstance(storage, RemoteBackend)
+        daemon.kill()
+        daemon.wait()
+
+        # ITS SOCKET FILE IS LEFT BEHIND; A NEW COMMAND CANNOT CONNECT AND USES STORAGE DIRECTLY
+        self.assertTrue(os.path.exists(SocketPath(self.engine)))
+        self.assertIn('Pending: 1', self.Status())
+        # A CLIENT THAT WAS CONNECTED RETRIES ITS READ DIRECTLY
+        self.assertEqual(storage.GetJob('x')['state'], 'pending')
+        self.assertEqual(self.RunCli('enqueue', '{"id":"y","command":"true"}').returncode, 0)
+        self.assertEqual(storage.CountByState().get('pending'), 2)
+
+    def testEnqueueReportsADaemonLostMidRequest(self):
+        os.makedirs(DAEMON_DIR)
+        server = socketserver.ThreadingUnixStreamServer(SocketPath(self.engine), HangUpOnInsert)
+        server.daemon_threads = True
+        server.backend = OpenStorage(self.engine)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        single = self.RunCli('enqueue', '{"id":"x","command":"true"}')
+        self.assertEqual(single.returncode, 1)
+        self.assertIn('went away during InsertJob', single.stderr)
+        self.assertNotIn('Traceback', single.stderr)
+
+        bulk = self.RunCli('enqueue', '--file', '-', input='{"id":"y","command":"true"}\n')
+        self.assertEqual(bulk.returncode, 1)
+        self.assertIn('went away during InsertJobs', bulk.stderr)
+        self.assertNotIn('Traceback', bulk.stderr)
+
+
+class TinyDbDaemonTests(DaemonTests):
+    engine = 'tinydb'
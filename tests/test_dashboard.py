@@ -0,0 +1,84 @@
+# test_dashboard.py - THE DASHBOARD'S JSON API: PAGES, SORTS AND THE CHANGE FEED
+import json
+from support import QueueTestCase
+from queuectl.config import SetConfigValue
+from queuectl.dashboard import app
+from queuectl.db import QUERY_SORTS
+from queuectl.job import JobManager
+
+class DashboardApiTests(QueueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = app.test_client()
+
+    def Get(self, url, status=200):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status, response.get_data(as_text=True))
+        return response.get_json()
+
+    def JobIds(self, query):
+        return [job['id'] for job in self.Get(f'/api/jobs?{query}')['jobs']]
+
+    def testJobsArePagedWithATotal(self):
+        JobManager.CreateJobs(json.dumps({'id': f'job{i}', 'command': 'true', 'priority': i}) for i in range(5))
+        page = self.Get('/api/jobs?state=pending&sort=priority&order=asc&limit=2&offset=2')
+        self.assertEqual((page['total'], [job['id'] for job in page['jobs']]), (5, ['job2', 'job3']))
+        # TIMESTAMPS ARE SHOWN AS ISO 8601, AND DEFAULTED FIELDS ARE FILLED BACK IN
+        self.assertIsInstance(page['jobs'][0]['created_at'], str)
+        self.assertEqual(page['jobs'][0]['queue'], 'default')
+        self.assertEqual(self.JobIds('state=pending&id_prefix=job4'), ['job4'])
+
+    def testBadArgumentsAreRejected(self):
+        for query in ('state=nope', 'state=pending&sort=nope', 'state=pending&order=up',
+                      'state=pending&limit=0', 'state=pending&created_from=yesterday'):
+            self.assertIn('error', self.Get(f'/api/jobs?{query}', 400))
+
+    def testDlqSupportsEverySortKey(self):
+        for i, (priority, runAt) in enumerate([(5, '2020-01-03'), (1, '2020-01-01'), (9, '2020-01-02')]):
+            JobManager.CreateJob(json.dumps({'id': f'dead{i}', 'command': 'false', 'priority': priority, 'run_at': runAt}))
+            self.FinishJobs(1, dead=True)
+        expected = {
+            'updated': ['dead0', 'dead1', 'dead2'],
+            'created_at': ['dead0', 'dead1', 'dead2'],
+            'priority': ['dead1', 'dead0', 'dead2'],
+            'run_at': ['dead1', 'dead2', 'dead0'],
+        }
+        for sort in QUERY_SORTS:
+            self.assertEqual(self.JobIds(f'state=dlq&sort={sort}&order=asc'), expected[sort], sort)
+            self.assertEqual(self.JobIds(f'state=dlq&sort={sort}&order=desc'), expected[sort][::-1], sort)
+
+    def testSummaryCountsJobs(self):
+        JobManager.CreateJob('{"id":"x","command":"true"}')
+        summary = self.Get('/api/summary')
+        self.assertEqual(summary['counts']['pending'], 1)
+        self.assertEqual(summary['queues'], ['default'])
+        self.assertIsNotNone(summary['cursor'])
+
+    def testChangesListWritesSinceTheCursor(self):
+        cursor = self.Get('/api/summary')['cursor']
+        self.assertEqual(self.Get(f'/api/changes?since={cursor}')['changes'], [])
+        JobManager.CreateJob('{"id":"x","command":"true"}')
+        changes = self.Get(f'/api/changes?since={cursor}')
+        self.assertEqual(changes['counts']['pending'], 1)
+        if self.engine == 'sqlite':
+            self.assertFalse(changes['full_refresh'])
+            self.assertEqual(changes['changes'], [{'id': 'x', 'state': 'pending'}])
+        else:
+            self.assertTrue(changes['full_refresh'])
+
+    def testPurgeForcesAFullRefresh(self):
+        JobManager.CreateJobs(json.dumps({'id': f'job{i}', 'command': 'true'}) for i in range(3))
+        self.FinishJobs(3)
+        cursor = self.Get('/api/summary')['cursor']
+        SetConfigValue('completedRetentionCount', 1)
+        self.assertEqual(JobManager.CollectGarbage()['completed'], 2)
+
+        changes = self.Get(f'/api/changes?since={cursor}')
+        self.assertTrue(changes['full_refresh'])
+        self.assertEqual(changes['counts']['completed'], 1)
+        # THE NEW CURSOR IS PAST THE PURGE, SO POLLING GOES BACK TO DELTAS
+        self.assertEqual(self.Get(f"/api/changes?since={changes['cursor']}")['changes'], [])
+
+
+class TinyDbDashboardApiTests(DashboardApiTests):
+    engine = 'tinydb'
@@ -0,0 +1,80 @@
+# test_duplicates.py - A JOB ID OR DEDUP KEY IS ONLY EVER ENQUEUED ONCE
+import json
+import time
+from support import QueueTestCase
+from queuectl.db import GetStorage, DuplicateJobError
+from queuectl.job import JobManager
+from queuectl.worker import FailureOutcome
+
+class DuplicateTests(QueueTestCase):
+    def testDuplicateIdIsRejected(self):
+        JobManager.CreateJob('{"id":"x","command":"echo first"}')
+        with self.assertRaises(DuplicateJobError):
+            JobManager.CreateJob('{"id":"x","command":"echo second"}')
+        self.assertEqual(GetStorage().GetJob('x')['command'], 'echo first')
+        self.assertEqual(GetStorage().CountByState().get('pending'), 1)
+
+    def testIdOnAnotherQueueIsRejected(self):
+        JobManager.CreateJob('{"id":"x","command":"true"}')
+        with self.assertRaises(DuplicateJobError):
+            JobManager.CreateJob('{"id":"x","command":"true"}', queue='batch')
+        self.assertFalse(GetStorage().CountByState(queue='batch').get('pending'))
+
+    def testIdInDlqIsRejected(self):
+        JobManager.CreateJob('{"id":"x","command":"false","max_retries":1}')
+        job, = JobManager.FindAndLockPending(1, owner='a')
+        job['attempts'] = 1
+        dlqOutcome, _ = FailureOutcome(job, {'state': 'failed', 'output': 'failed'})
+        self.assertEqual(len(GetStorage().ApplyOutcomes([dlqOutcome])), 1)
+        with self.assertRaises(DuplicateJobError):
+            JobManager.CreateJob('{"id":"x","command":"true"}')
+        self.assertIsNone(GetStorage().GetJob('x'))
+
+    def testBulkEnqueueReportsRejectedLines(self):
+        JobManager.CreateJob('{"id":"a","command":"true"}')
+        lines = [
+            '{"id":"a","command":"true"}',
+            '{"id":"b","command":"true"}',
+            '{"id":"b","command":"true"}',
+            'not json',
+            '{"id":"c","command":"true","dedup_key":"k"}',
+            '{"id":"d","command":"true","dedup_key":"k"}',
+        ]
+        errors = []
+        counts = JobManager.CreateJobs(lines, chunkSize=2, onError=lambda lineNumber, error: errors.append((lineNumber, type(error))))
+        self.assertEqual(counts, (2, 4))
+        self.assertEqual(sorted(errors), [(1, DuplicateJobError), (3, DuplicateJobError), (4, json.JSONDecodeError), (6, DuplicateJobError)])
+        self.assertEqual(sorted(job['id'] for job in GetStorage().SearchJobs()), ['a', 'b', 'c'])
+
+    def testDedupKeyIsRejectedWithinItsWindow(self):
+        JobManager.CreateJob('{"id":"x","command":"true","dedup_key":"k","dedup_window":0.5}')
+        with self.assertRaises(DuplicateJobError):
+            JobManager.CreateJob('{"id":"y","command":"true","dedup_key":"k"}')
+        time.sleep(0.6)
+        JobManager.CreateJob('{"id":"y","command":"true","dedup_key":"k"}')
+        self.assertEqual(GetStorage().GetJob('y')['state'], 'pending')
+
+    def testDedupKeyIsScopedToItsQueue(self):
+        JobManager.CreateJob('{"id":"x","command":"true","dedup_key":"k"}')
+        JobManager.CreateJob('{"id":"y","command":"true","dedup_key":"k"}', queue='batch')
+        with self.assertRaises(DuplicateJobError):
+            JobManager.CreateJob('{"id":"z","command":"true","dedup_key":"k"}', queue='batch')
+        self.assertEqual(GetStorage().GetJob('y')['queue'], 'batch')
+
+    def testCliEnqueueExitsNonZeroOnDuplicate(self):
+        first = self.RunCli('enqueue', '{"id":"x","command":"true"}')
+        self.assertEqual(first.returncode, 0, first.stderr)
+        second = self.RunCli('enqueue', '{"id":"x","command":"true"}')
+        self.assertEqual(second.returncode, 1)
+        self.assertIn('Not enqueued', second.stderr)
+
+        with open('jobs.ndjson', 'w') as f:
+            f.write('{"id":"y","command":"true"}\n{"id":"x","command":"true"}\n')
+        bulk = self.RunCli('enqueue', '--file', 'jobs.ndjson')
+        self.assertEqual(bulk.returncode, 1)
+        self.assertIn('Enqueued 1 job(s)', bulk.stdout)
+        self.assertEqual(GetStorage().GetJob('y')['state'], 'pending')
+
+
+class TinyDbDuplicateTests(DuplicateTests):
+    engine = 'tinydb'
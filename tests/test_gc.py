@@ -0,0 +1,64 @@
+# test_gc.py - RETENTION: FINISHED JOBS PAST IT ARE MOVED TO THE ARCHIVE
+import json
+import time
+from support import QueueTestCase
+from queuectl.archive import ArchivePartitions, ReadPartition
+from queuectl.config import SetConfigValue
+from queuectl.db import GetStorage
+from queuectl.job import JobManager
+
+class GarbageCollectionTests(QueueTestCase):
+    def Archived(self, kind):
+        return [job['id'] for _, path in ArchivePartitions(kind) for job in ReadPartition(path)]
+
+    def EnqueueJobs(self, prefix, count):
+        JobManager.CreateJobs(json.dumps({'id': f'{prefix}{i}', 'command': 'true'}) for i in range(count))
+
+    def testGcBeforeAnyJobHasFinished(self):
+        self.assertEqual(self.RunCli('enqueue', '{"id":"a","command":"true"}').returncode, 0)
+        for key in ('completed-retention-count', 'dlq-retention-count'):
+            self.assertEqual(self.RunCli('config', 'set', key, '5').returncode, 0)
+        result = self.RunCli('gc')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('Archived 0 completed job(s) and 0 DLQ entr(ies)', result.stdout)
+        self.assertEqual(GetStorage().GetJob('a')['state'], 'pending')
+
+    def testGcWithoutRetentionDoesNothing(self):
+        self.EnqueueJobs('job', 2)
+        self.FinishJobs(2)
+        self.assertIn('No retention is configured', self.RunCli('gc').stdout)
+        self.assertEqual(GetStorage().CountByState().get('completed'), 2)
+
+    def testCountRetentionArchivesAllButTheNewest(self):
+        self.EnqueueJobs('job', 5)
+        finished = self.FinishJobs(4)
+        SetConfigValue('completedRetentionCount', 2)
+        self.assertEqual(JobManager.CollectGarbage(), {'completed': 2, 'dlq': 0})
+        self.assertEqual(sorted(self.Archived('completed')), sorted(finished[:2]))
+        for jobId in finished[:2]:
+            self.assertIsNone(GetStorage().GetJob(jobId))
+        counts = GetStorage().CountByState()
+        self.assertEqual((counts.get('completed'), counts.get('pending')), (2, 1))
+        # A SECOND PASS FINDS NOTHING MORE TO DO
+        self.assertEqual(JobManager.CollectGarbage(), {'completed': 0, 'dlq': 0})
+
+    def testAgeRetentionArchivesOldDlqEntries(self):
+        self.EnqueueJobs('dead', 2)
+        self.FinishJobs(2, dead=True)
+        SetConfigValue('dlqRetentionSeconds', 0.2)
+        self.assertEqual(JobManager.CollectGarbage()['dlq'], 0)
+        time.sleep(0.3)
+        self.assertEqual(JobManager.CollectGarbage()['dlq'], 2)
+        self.assertEqual(GetStorage().ListDlq(), [])
+        self.assertEqual(sorted(self.Archived('dlq')), ['dead0', 'dead1'])
+
+    def testArchivedJobsStillCountInMetrics(self):
+        self.EnqueueJobs('job', 3)
+        self.FinishJobs(3)
+        SetConfigValue('completedRetentionCount', 1)
+        JobManager.CollectGarbage()
+        self.assertEqual(GetStorage().GetStats()['completed'], 3)
+
+
+class TinyDbGarbageCollectionTests(GarbageCollectionTests):
+    engine = 'tinydb'
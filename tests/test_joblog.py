@@ -0,0 +1,60 @@
+# test_joblog.py - JOB OUTPUT IS STREAMED TO SIZE-CAPPED, ROTATING LOG FILES
+import os
+import subprocess
+from support import QueueTestCase
+from queuectl.joblog import JobLogWriter, ReadLogTail, RunStreamingProcess
+from queuectl.record import LogPath
+
+def ReadFile(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+class JobLogTests(QueueTestCase):
+    def testLogRotatesAtMaxBytesAndKeepsBackups(self):
+        with JobLogWriter('job.log', maxBytes=10, backupCount=2) as jobLog:
+            jobLog.Write(b'0123456789abcdefghijklmnopqrstuvwxyz')
+        self.assertEqual(ReadFile('job.log'), b'uvwxyz')
+        self.assertEqual(ReadFile('job.log.1'), b'klmnopqrst')
+        self.assertEqual(ReadFile('job.log.2'), b'abcdefghij')
+        # THE OLDEST PIECE WAS DROPPED, SO DISK USE STAYS UNDER (backupCount + 1) * maxBytes
+        self.assertFalse(os.path.exists('job.log.3'))
+
+    def testWithoutBackupsTheLogIsTruncated(self):
+        with JobLogWriter('job.log', maxBytes=4, backupCount=0) as jobLog:
+            jobLog.Write(b'abcdefghij')
+        self.assertEqual(ReadFile('job.log'), b'ij')
+        self.assertFalse(os.path.exists('job.log.1'))
+
+    def testNewAttemptStartsAFreshLog(self):
+        with JobLogWriter('job.log', maxBytes=4, backupCount=2) as jobLog:
+            jobLog.Write(b'first attempt')
+        with JobLogWriter('job.log', maxBytes=4, backupCount=2) as jobLog:
+            jobLog.Write(b'two')
+        self.assertEqual(ReadFile('job.log'), b'two')
+        self.assertFalse(os.path.exists('job.log.1'))
+
+    def testReadLogTail(self):
+        with open('job.log', 'w') as f:
+            f.write('x' * 5000 + 'end')
+        self.assertEqual(ReadLogTail('job.log', 5), 'xxend')
+        self.assertEqual(ReadLogTail('missing.log'), '')
+
+    def testProcessOutputIsStreamedIntoTheLog(self):
+        with JobLogWriter('job.log', maxBytes=1024 * 1024, backupCount=1) as jobLog:
+            status = RunStreamingProcess('echo out; echo err >&2; exit 3', 10, jobLog)
+        self.assertEqual(status, 3)
+        self.assertEqual(sorted(ReadFile('job.log').split()), [b'err', b'out'])
+
+    def testTimeoutKillsTheProcess(self):
+        with JobLogWriter('job.log', maxBytes=1024, backupCount=1) as jobLog:
+            with self.assertRaises(subprocess.TimeoutExpired):
+                RunStreamingProcess('echo started; sleep 30', 0.5, jobLog)
+        self.assertEqual(ReadFile('job.log'), b'started\n')
+
+    def testLogsCommandPrintsRotatedCopiesOldestFirst(self):
+        os.makedirs('logs')
+        with JobLogWriter(LogPath('x'), maxBytes=10, backupCount=2) as jobLog:
+            jobLog.Write(b'0123456789abcdefghijklmnopqrst')
+        result = self.RunCli('logs', 'x')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout, '0123456789abcdefghijklmnopqrst')
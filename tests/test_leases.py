@@ -0,0 +1,127 @@
+# test_leases.py - REAPING THE JOBS OF DEAD WORKERS, AND FENCING OFF THEIR LATE OUTCOMES
+import os
+import signal
+import subprocess
+import time
+from support import QueueTestCase, CLI_COMMAND
+from queuectl.db import GetStorage
+from queuectl.job import JobManager
+from queuectl.worker import ExpiredLeaseOutcome, FailureOutcome
+
+class LeaseTests(QueueTestCase):
+    def Claim(self, owner, count=1):
+        claimed = JobManager.FindAndLockPending(count, owner)
+        self.assertEqual(len(claimed), count)
+        return claimed
+
+    def ExpireLeases(self, jobs):
+        """Moves the leases of jobs into the past, as if their worker had stopped renewing them."""
+        GetStorage().RenewLeases([(job['id'], job['lease_token']) for job in jobs], time.time() - 1)
+
+    def testHeldLeaseIsNotReaped(self):
+        JobManager.CreateJob('{"id":"x","command":"true"}')
+        job, = self.Claim('a')
+        self.assertEqual(JobManager.RenewLeases([(job['id'], job['lease_token'])]), {'x'})
+        self.assertEqual(JobManager.ReapExpiredLeases(ExpiredLeaseOutcome), [])
+        self.assertEqual(GetStorage().GetJob('x')['state'], 'processing')
+
+    def testExpiredLeaseIsRequeuedAsAFailedAttempt(self):
+        JobManager.CreateJob('{"id":"x","command":"true","max_retries":3,"backoff_base":0}')
+        job, = self.Claim('a')
+        self.ExpireLeases([job])
+
+        reaped = JobManager.ReapExpiredLeases(ExpiredLeaseOutcome)
+        self.assertEqual([(outcome[0], outcome[1]) for outcome in reaped], [('update', 'x')])
+        stored = GetStorage().GetJob('x')
+        self.assertEqual((stored['state'], stored['attempts']), ('failed', 1))
+        self.assertNotIn('owner', stored)
+        self.assertIn('presumed dead', stored['output'])
+        # THE DEAD WORKER'S HEARTBEAT NO LONGER HOLDS IT, AND ANOTHER WORKER CAN CLAIM IT
+        self.assertEqual(JobManager.RenewLeases([(job['id'], job['lease_token'])]), set())
+        self.assertEqual(self.Claim('b')[0]['id'], 'x')
+
+    def testExpiredLeaseOnLastAttemptGoesToDlq(self):
+        JobManager.CreateJob('{"id":"x","command":"true","max_retries":1}')
+        job, = self.Claim('a')
+        self.ExpireLeases([job])
+        self.assertEqual([outcome[0] for outcome in JobManager.ReapExpiredLeases(ExpiredLeaseOutcome)], ['dlq'])
+        self.assertIsNone(GetStorage().GetJob('x'))
+        self.assertEqual([(job['id'], job['state']) for job in GetStorage().ListDlq()], [('x', 'dead')])
+
+    def testLateOutcomesOfAReapedLeaseAreDropped(self):
+        JobManager.CreateJob('{"id":"x","command":"true","max_retries":3,"backoff_base":0}')
+        JobManager.CreateJob('{"id":"y","command":"true","max_retries":3,"backoff_base":0}')
+        staleJobs = self.Claim('a', 2)
+        self.ExpireLeases(staleJobs)
+        self.assertEqual(len(JobManager.ReapExpiredLeases(ExpiredLeaseOutcome)), 2)
+        time.sleep(0.01)
+        liveJobs = self.Claim('b', 2)
+        stale = {job['id']: job for job in staleJobs}
+
+        # A's LATE VERDICTS: x FAILS FOR THE LAST TIME (A DLQ MOVE), y COMPLETES
+        stale['x']['attempts'] = 2
+        dlqOutcome, _ = FailureOutcome(stale['x'], {'state': 'failed', 'output': 'late A'})
+        self.assertEqual(dlqOutcome[0], 'dlq')
+        completion = ('update', 'y', JobManager.PrepareUpdate('y', {'state': 'completed'}), stale['y']['lease_token'])
+        self.assertEqual(GetStorage().ApplyOutcomes([dlqOutcome, completion]), [])
+
+        self.assertEqual(GetStorage().ListDlq(), [])
+        for jobId in ('x', 'y'):
+            stored = GetStorage().GetJob(jobId)
+            self.assertEqual((stored['state'], stored['owner']), ('processing', 'b'))
+        self.assertEqual(JobManager.RenewLeases([(job['id'], job['lease_token']) for job in liveJobs]), {'x', 'y'})
+        self.assertEqual(GetStorage().GetStats()['dead'], 0)
+
+        # B STILL HOLDS BOTH LEASES, SO ITS OWN OUTCOMES ARE APPLIED
+        live = {job['id']: job for job in liveJobs}
+        completion = ('update', 'y', JobManager.PrepareUpdate('y', {'state': 'completed'}), live['y']['lease_token'])
+        self.assertEqual(len(GetStorage().ApplyOutcomes([completion])), 1)
+        self.assertEqual(GetStorage().GetJob('y')['state'], 'completed')
+
+    def testReleasedClaimCannotBeCompletedByItsOldHolder(self):
+        JobManager.CreateJob('{"id":"x","command":"true"}')
+        job, = self.Claim('a')
+        JobManager.ReleaseJobs([job])
+        completion = ('update', 'x', JobManager.PrepareUpdate('x', {'state': 'completed'}), job['lease_token'])
+        self.assertEqual(GetStorage().ApplyOutcomes([completion]), [])
+        self.assertEqual(GetStorage().GetJob('x')['state'], 'pending')
+
+    def testWorkerReapsTheJobOfAKilledWorker(self):
+        self.assertEqual(self.RunCli('config', 'set', 'lease-seconds', '1').returncode, 0)
+        # THE FIRST RUN HANGS; THE RUN AFTER THE REAP FINDS THE MARKER AND EXITS AT ONCE.
+        # THE MARKER HOLDS THE JOB'S PROCESS GROUP, WHICH IS ITS OWN SESSION (SEE joblog)
+        JobManager.CreateJob('{"id":"x","command":"test -f started || (echo $$ > started.tmp; mv started.tmp started; sleep 60)","backoff_base":0}')
+        first = self.StartWorker()
+        try:
+            self.WaitFor(lambda: os.path.exists('started'))
+        finally:
+            first.kill()
+            first.wait()
+            if os.path.exists('started'):
+                os.killpg(int(open('started').read()), signal.SIGKILL)
+        self.assertEqual(GetStorage().GetJob('x')['state'], 'processing')
+
+        second = self.StartWorker()
+        try:
+            self.WaitFor(lambda: GetStorage().GetJob('x')['state'] == 'completed')
+        finally:
+            second.send_signal(signal.SIGINT)
+            second.wait(30)
+        stored = GetStorage().GetJob('x')
+        self.assertEqual(stored['attempts'], 1)
+
+    def StartWorker(self):
+        return subprocess.Popen(
+            CLI_COMMAND + ['worker', 'start'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            preexec_fn=lambda: signal.signal(signal.SIGINT, signal.SIG_DFL)
+        )
+
+    def WaitFor(self, condition, timeout=30):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "timed out")
+            time.sleep(0.05)
+
+
+class TinyDbLeaseTests(LeaseTests):
+    engine = 'tinydb'
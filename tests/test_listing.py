@@ -0,0 +1,63 @@
+# test_listing.py - `list` AND `dlq list`: STREAMED OUTPUT, CURSOR PAGES AND PROJECTION
+import json
+import re
+from support import QueueTestCase
+from queuectl.job import JobManager
+
+class ListingTests(QueueTestCase):
+    def List(self, *args):
+        result = self.RunCli(*args)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result
+
+    def NdjsonIds(self, *args):
+        return [json.loads(line)['id'] for line in self.List(*args, '--ndjson').stdout.splitlines()]
+
+    def NextCursor(self, result):
+        match = re.search(r'continue with --after (\S+)', result.stderr)
+        return match.group(1) if match else None
+
+    def testPagesFollowTheCursorInIdOrder(self):
+        JobManager.CreateJobs(json.dumps({'id': f'job{i}', 'command': 'true'}) for i in (3, 0, 4, 1, 2))
+        JobManager.CreateJob('{"id":"job5","command":"true"}', queue='batch')
+        seen, after = [], None
+        while True:
+            result = self.List('list', '--limit', '2', *(['--after', after] if after else []))
+            page = [job['id'] for job in json.loads(result.stdout)]
+            seen.extend(page)
+            after = self.NextCursor(result)
+            if after is None:
+                break
+            self.assertEqual(after, page[-1])
+        self.assertEqual(seen, [f'job{i}' for i in range(6)])
+
+    def testNdjsonWithFieldsPrintsCompactRecords(self):
+        JobManager.CreateJob('{"id":"a","command":"echo a"}')
+        JobManager.CreateJob('{"id":"b","command":"echo b"}')
+        result = self.List('list', '--ndjson', '--fields', 'id,state')
+        self.assertEqual(result.stdout.splitlines(), ['{"id":"a","state":"pending"}', '{"id":"b","state":"pending"}'])
+        self.assertIsNone(self.NextCursor(result))
+
+    def testFiltersByStateAndQueue(self):
+        JobManager.CreateJob('{"id":"a","command":"true"}')
+        JobManager.CreateJob('{"id":"b","command":"true"}')
+        JobManager.CreateJob('{"id":"c","command":"true"}', queue='batch')
+        self.FinishJobs(1)
+        self.assertEqual(self.NdjsonIds('list', '--state', 'completed'), ['a'])
+        self.assertEqual(self.NdjsonIds('list', '--state', 'pending'), ['b', 'c'])
+        self.assertEqual(self.NdjsonIds('list', '--queue', 'batch'), ['c'])
+
+    def testDlqListPages(self):
+        JobManager.CreateJobs(json.dumps({'id': f'dead{i}', 'command': 'false'}) for i in range(3))
+        self.FinishJobs(3, dead=True)
+        first = self.List('dlq', 'list', '--limit', '2', '--fields', 'id,state')
+        self.assertEqual(json.loads(first.stdout), [{'id': 'dead0', 'state': 'dead'}, {'id': 'dead1', 'state': 'dead'}])
+        rest = self.List('dlq', 'list', '--after', self.NextCursor(first), '--ndjson', '--fields', 'id')
+        self.assertEqual(rest.stdout, '{"id":"dead2"}\n')
+
+    def testEmptyListIsAnEmptyArray(self):
+        self.assertEqual(json.loads(self.List('list').stdout), [])
+
+
+class TinyDbListingTests(ListingTests):
+    engine = 'tinydb'
@@ -0,0 +1,139 @@
+# test_migrate.py - MOVING A JSON QUEUE INTO SQLITE, AND SQLITE'S OWN SCHEMA MIGRATIONS
+import json
+import os
+import sqlite3
+from support import QueueTestCase
+from queuectl import db
+from queuectl.config import GetConfigValue, SetConfigValue, SharedConfig
+from queuectl.db import GetStorage, DuplicateJobError, SQLITE_PATH, TINYDB_PATH
+from queuectl.job import JobManager
+from queuectl.record import ParseTime, SCHEMA_VERSION
+from queuectl.worker import FailureOutcome
+
+# WHEN THE JOBS OF THE SCHEMA 1 FILE BELOW WERE CREATED
+SCHEMA_ONE_TIME = '2024-01-02T03:04:05Z'
+
+class MigrateTests(QueueTestCase):
+    engine = 'tinydb'
+
+    def UseEngine(self, engine):
+        os.environ['QUEUECTL_STORAGE'] = engine
+        db.StorageInstances.clear()
+        SharedConfig.Invalidate()
+
+    def FillJsonQueue(self):
+        """A pending job with a dedup key, a completed job, a DLQ entry and a config value, on the JSON engine."""
+        JobManager.CreateJob('{"id":"pending","command":"true","dedup_key":"k"}')
+        JobManager.CreateJob('{"id":"done","command":"true","priority":1}')
+        JobManager.CreateJob('{"id":"dead","command":"false","priority":2,"max_retries":1}')
+        done, dead = JobManager.FindAndLockPending(2, owner='a')
+        completion = ('update', 'done', JobManager.PrepareUpdate('done', {'state': 'completed'}), done['lease_token'])
+        dead['attempts'] = 1
+        dlqOutcome, _ = FailureOutcome(dead, {'state': 'failed', 'output': 'failed'})
+        self.assertEqual(len(GetStorage().ApplyOutcomes([completion, dlqOutcome])), 2)
+        SetConfigValue('maxRetries', 7)
+
+    def Migrate(self):
+        result = self.RunCli('migrate')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def testJobsDlqAndConfigAreImported(self):
+        self.FillJsonQueue()
+        self.assertIn('Migrated 2 job(s), 1 DLQ entry(ies) and 1 config value(s)', self.Migrate())
+
+        self.UseEngine('sqlite')
+        storage = GetStorage()
+        self.assertEqual(storage.GetJob('pending')['state'], 'pending')
+        self.assertEqual(storage.GetJob('done')['state'], 'completed')
+        self.assertEqual([(job['id'], job['state']) for job in storage.ListDlq()], [('dead', 'dead')])
+        counts = storage.CountByState()
+        self.assertEqual((counts.get('pending'), counts.get('completed'), counts.get('dlq')), (1, 1, 1))
+        self.assertEqual(GetConfigValue('maxRetries'), 7)
+        # THE IMPORTED JOB CAN BE CLAIMED AS USUAL
+        self.assertEqual([job['id'] for job in JobManager.FindAndLockPending(2, owner='b')], ['pending'])
+
+    def testDedupKeysAreImported(self):
+        self.FillJsonQueue()
+        self.Migrate()
+        self.UseEngine('sqlite')
+        with self.assertRaises(DuplicateJobError):
+            JobManager.CreateJob('{"id":"other","command":"true","dedup_key":"k"}')
+
+    def testRepeatedMigrateAddsNothing(self):
+        self.FillJsonQueue()
+        self.Migrate()
+        output = self.Migrate()
+        self.assertIn('Migrated 0 job(s), 0 DLQ entry(ies)', output)
+        self.assertIn('Skipped 3 job(s)', output)
+
+        self.UseEngine('sqlite')
+        counts = GetStorage().CountByState()
+        self.assertEqual((counts.get('pending'), counts.get('completed'), counts.get('dlq')), (1, 1, 1))
+        rows = sqlite3.connect(SQLITE_PATH).execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+        self.assertEqual(rows, 2)
+
+    def WriteSchemaOneFile(self):
+        """A JSON file from before schema 2: ISO timestamps, no 'Schema' table, and the config's max_retries in each job."""
+        with open(TINYDB_PATH, 'w') as f:
+            json.dump({
+                'Jobs': {'1': {
+                    'id': 'old', 'command': 'true', 'state': 'pending', 'attempts': 0, 'max_retries': 3,
+                    'created_at': SCHEMA_ONE_TIME, 'updated_at': SCHEMA_ONE_TIME, 'run_at': SCHEMA_ONE_TIME,
+                }},
+                'Dedup': {'1': {'key': 'k', 'job_id': 'old', 'expires_at': '2999-01-01T00:00:00Z'}},
+            }, f)
+
+    def AssertUpgraded(self):
+        job = GetStorage().GetJob('old')
+        self.assertEqual(job['created_at'], ParseTime(SCHEMA_ONE_TIME))
+        self.assertIsInstance(job['run_at'], float)
+        self.assertNotIn('max_retries', job)
+        self.assertEqual([job['id'] for job in JobManager.FindAndLockPending(1, owner='a')], ['old'])
+        with self.assertRaises(DuplicateJobError):
+            JobManager.CreateJob('{"id":"new","command":"true","dedup_key":"k"}')
+
+    def testSchemaOneFileIsUpgradedInPlace(self):
+        self.WriteSchemaOneFile()
+        self.AssertUpgraded()
+        with open(TINYDB_PATH) as f:
+            self.assertEqual(list(json.load(f)['Schema'].values()), [{'version': SCHEMA_VERSION}])
+
+    def testSchemaOneFileIsUpgradedOnImport(self):
+        self.WriteSchemaOneFile()
+        self.assertIn('Migrated 1 job(s)', self.Migrate())
+        self.UseEngine('sqlite')
+        self.AssertUpgraded()
+
+    def testNothingToMigrate(self):
+        result = self.RunCli('migrate')
+        self.assertIn('Nothing to migrate', result.stderr)
+        self.assertFalse(os.path.exists(SQLITE_PATH))
+
+
+class SqliteMigrationTests(QueueTestCase):
+    def testDuplicateIdRowsAreRemovedAndIdsMadeUnique(self):
+        JobManager.CreateJob('{"id":"x","command":"true"}')
+        JobManager.CreateJob('{"id":"y","command":"true"}')
+        db.StorageInstances.clear()
+
+        # A FILE FROM BEFORE MIGRATION 9, WHICH COULD HOLD TWO ROWS FOR ONE ID
+        conn = sqlite3.connect(SQLITE_PATH, isolation_level=None)
+        columns = 'id, state, priority, run_at, created_at, data, seq, lease_expires_at'
+        conn.executescript(f"""
+            DROP INDEX jobs_id;
+            CREATE INDEX jobs_id ON jobs (id);
+            INSERT INTO jobs ({columns}) SELECT {columns} FROM jobs WHERE id = 'x';
+            PRAGMA user_version = 8;
+        """)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM jobs WHERE id = 'x'").fetchone()[0], 2)
+        conn.close()
+
+        storage = GetStorage()
+        self.assertEqual(storage.GetJob('x')['state'], 'pending')
+        self.assertEqual(storage.CountByState().get('pending'), 2)
+        conn = sqlite3.connect(SQLITE_PATH)
+        self.assertEqual(conn.execute('SELECT id FROM jobs ORDER BY id').fetchall(), [('x',), ('y',)])
+        with self.assertRaises(sqlite3.IntegrityError):
+            conn.execute(f"INSERT INTO jobs ({columns}) SELECT {columns} FROM jobs WHERE id = 'x'")
+        conn.close()
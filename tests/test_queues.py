@@ -0,0 +1,100 @@
+# test_queues.py - NAMED QUEUES IN THEIR OWN SHARDS, SERVED BY WEIGHT
+import json
+import os
+import signal
+import subprocess
+import time
+from support import QueueTestCase, CLI_COMMAND
+from queuectl import worker
+from queuectl.db import GetStorage
+from queuectl.job import JobManager
+from queuectl.scheduler import WeightedQueues
+
+class WeightedQueuesTests(QueueTestCase):
+    def Serve(self, queues, count, idle=()):
+        """The queues that serve count jobs in turn, passing over those in idle as if they had nothing due."""
+        served = []
+        for _ in range(count):
+            queue = next(q for q in queues.Order() if q not in idle)
+            queues.Charge(queue)
+            served.append(queue)
+        return served
+
+    def testBacklogsDrainByWeightInterleaved(self):
+        served = self.Serve(WeightedQueues({'critical': 5, 'batch': 1}), 12)
+        self.assertEqual((served.count('critical'), served.count('batch')), (10, 2))
+        # SMOOTH: THE BATCH JOBS ARE SPREAD OUT, NOT SERVED BACK TO BACK
+        self.assertNotIn(('batch', 'batch'), list(zip(served, served[1:])))
+
+    def testEmptyQueueShareGoesToTheOthers(self):
+        queues = WeightedQueues({'critical': 5, 'batch': 1})
+        self.assertEqual(self.Serve(queues, 4, idle={'critical'}), ['batch'] * 4)
+        # CREDIT BUILT WHILE IDLE IS CAPPED AT ONE ROUND, SO CRITICAL CANNOT STARVE BATCH FOR LONG AFTERWARDS
+        self.assertIn('batch', self.Serve(queues, 12))
+
+    def testUnweightedServesEveryStoredQueue(self):
+        JobManager.CreateJob('{"command":"true"}')
+        JobManager.CreateJob('{"command":"true"}', queue='reports')
+        queues = WeightedQueues(refreshInterval=0)
+        self.assertEqual(sorted(self.Serve(queues, 4)), ['default', 'default', 'reports', 'reports'])
+
+
+class NamedQueueTests(QueueTestCase):
+    def setUp(self):
+        super().setUp()
+        worker.WorkerReadyIndexes.clear()
+
+    def tearDown(self):
+        worker.WorkerQueues.SetWeights(None)
+        worker.WorkerReadyIndexes.clear()
+        super().tearDown()
+
+    def EnqueueJobs(self, queue, count):
+        JobManager.CreateJobs((json.dumps({'id': f'{queue}{i}', 'command': 'true'}) for i in range(count)), queue=queue)
+
+    def testEachQueueIsItsOwnShard(self):
+        self.EnqueueJobs('reports', 2)
+        JobManager.CreateJob('{"id":"x","command":"true"}')
+        extension = 'db' if self.engine == 'sqlite' else 'json'
+        self.assertTrue(os.path.exists(f'queues/reports.{extension}'))
+        self.assertEqual(sorted(GetStorage().ListQueues()), ['default', 'reports'])
+        self.assertEqual(GetStorage().CountByState(queue='reports').get('pending'), 2)
+        self.assertEqual(GetStorage().GetJob('reports1')['queue'], 'reports')
+        status = self.RunCli('status').stdout
+        self.assertIn('reports', status)
+
+    def testWorkersClaimByWeight(self):
+        self.EnqueueJobs('critical', 12)
+        self.EnqueueJobs('batch', 12)
+        worker.WorkerQueues.SetWeights({'critical': 5, 'batch': 1})
+        claimed = [worker.ClaimNextJobs(1, 'a')[0]['queue'] for _ in range(12)]
+        self.assertEqual((claimed.count('critical'), claimed.count('batch')), (10, 2))
+        # ONCE critical RUNS DRY, batch GETS EVERY CLAIM
+        claimed = [job['queue'] for _ in range(12) for job in worker.ClaimNextJobs(1, 'a')]
+        self.assertEqual(claimed, ['critical'] * 2 + ['batch'] * 10)
+
+    def testWorkerServesOnlyTheQueuesItWasGiven(self):
+        self.EnqueueJobs('critical', 3)
+        self.EnqueueJobs('batch', 3)
+        process = subprocess.Popen(
+            CLI_COMMAND + ['worker', 'start', '--queues', 'critical:2'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            preexec_fn=lambda: signal.signal(signal.SIGINT, signal.SIG_DFL)
+        )
+        try:
+            deadline = time.monotonic() + 30
+            while GetStorage().CountByState(queue='critical').get('completed', 0) < 3:
+                self.assertLess(time.monotonic(), deadline, "timed out")
+                time.sleep(0.05)
+        finally:
+            process.send_signal(signal.SIGINT)
+            process.wait(30)
+        self.assertEqual(GetStorage().CountByState(queue='batch').get('pending'), 3)
+
+    def testBadQueueWeightsAreRejected(self):
+        for weights in ('critical:0', 'critical:x', 'bad/name:1'):
+            result = self.RunCli('worker', 'start', '--queues', weights)
+            self.assertEqual(result.returncode, 2, weights)
+
+
+class TinyDbNamedQueueTests(NamedQueueTests):
+    engine = 'tinydb'
@@ -0,0 +1,53 @@
+# test_retries.py - FAILED JOBS ARE RESCHEDULED WITH CAPPED, JITTERED BACKOFF
+import time
+from unittest import mock
+from support import QueueTestCase
+from queuectl.config import SetConfigValue
+from queuectl.db import GetStorage
+from queuectl.job import JobManager
+from queuectl.worker import ComputeBackoffDelay, FailureOutcome
+
+class BackoffTests(QueueTestCase):
+    def testDelayGrowsExponentiallyUpToTheCap(self):
+        SetConfigValue('backoffBase', 2)
+        SetConfigValue('backoffCap', 10)
+        self.assertEqual([ComputeBackoffDelay(attempts) for attempts in (1, 2, 3, 4, 5)], [2, 4, 8, 10, 10])
+
+    def testJobFieldsOverrideTheConfig(self):
+        job = {'backoff_base': 3, 'backoff_cap': 20}
+        self.assertEqual([ComputeBackoffDelay(attempts, job) for attempts in (1, 2, 3)], [3, 9, 20])
+
+    def testJitterShavesUpToItsPercentage(self):
+        job = {'backoff_base': 10, 'backoff_jitter': 50}
+        with mock.patch('random.random', return_value=0.0):
+            self.assertEqual(ComputeBackoffDelay(2, job), 100)
+        with mock.patch('random.random', return_value=1.0):
+            self.assertEqual(ComputeBackoffDelay(2, job), 50)
+        for _ in range(100):
+            self.assertTrue(50 <= ComputeBackoffDelay(2, job) <= 100)
+
+    def Fail(self, jobData):
+        """Enqueues jobData, claims it and records one failed attempt. Returns (stored job, backoffDelay)."""
+        JobManager.CreateJob(jobData)
+        job, = JobManager.FindAndLockPending(1, owner='a')
+        outcome, backoffDelay = FailureOutcome(job, {'state': 'failed', 'output': 'failed'})
+        self.assertEqual(len(GetStorage().ApplyOutcomes([outcome])), 1)
+        return GetStorage().GetJob(job['id']), backoffDelay
+
+    def testFailedJobWaitsForItsRunAt(self):
+        before = time.time()
+        stored, backoffDelay = self.Fail('{"id":"x","command":"false","backoff_base":60}')
+        self.assertEqual(backoffDelay, 60)
+        self.assertEqual((stored['state'], stored['attempts']), ('failed', 1))
+        self.assertGreaterEqual(stored['run_at'], before + 60)
+        self.assertEqual(JobManager.FindAndLockPending(1, owner='b'), [])
+
+    def testFailedJobIsClaimedAgainOnceDue(self):
+        stored, backoffDelay = self.Fail('{"id":"x","command":"false","backoff_base":0}')
+        self.assertEqual(backoffDelay, 0)
+        retried, = JobManager.FindAndLockPending(1, owner='b')
+        self.assertEqual((retried['id'], retried['attempts']), ('x', 1))
+
+
+class TinyDbBackoffTests(BackoffTests):
+    engine = 'tinydb'
@@ -0,0 +1,50 @@
+# test_startup.py - SHORT CLI COMMANDS START FAST AND LEAVE THE HEAVY MODULES UNLOADED
+import json
+import statistics
+import subprocess
+import sys
+from support import QueueTestCase
+
+# LARGEST MEDIAN TIME, IN MILLISECONDS, TO IMPORT THE CLI AND RUN `queuectl --help`.
+# ABOUT 35 MS ON A DEVELOPER MACHINE; THE HEADROOM ABSORBS SLOW CI RUNNERS, WHILE
+# AN EAGER IMPORT OF FLASK OR THE WORKER STILL PUSHES IT OVER.
+STARTUP_BUDGET_MS = 150
+TIMED_RUNS = 5
+
+# MODULES THAT BELONG TO `worker start` AND `dashboard` ONLY
+HEAVY_MODULES = ['flask', 'werkzeug', 'jinja2', 'http.server', 'queuectl.dashboard', 'queuectl.worker', 'queuectl.aioworker']
+
+# RUN IN A FRESH INTERPRETER: TIMES IMPORTING THE CLI PLUS RUNNING THE COMMAND
+# (INTERPRETER STARTUP ITSELF IS LEFT OUT) AND REPORTS ON THE LAST LINE OF STDERR
+CHILD_SCRIPT = '''
+import json, sys, time
+startTime = time.perf_counter()
+from queuectl.cli import MainCLI
+try:
+    MainCLI(sys.argv[1:], prog_name='queuectl')
+except SystemExit:
+    pass
+sys.stderr.write('\\n' + json.dumps({
+    'ms': (time.perf_counter() - startTime) * 1000,
+    'heavy': [name for name in %r if name in sys.modules],
+}) + '\\n')
+''' % (HEAVY_MODULES,)
+
+class StartupTests(QueueTestCase):
+    def RunCommand(self, *args):
+        result = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, *args], capture_output=True, text=True, timeout=60)
+        return json.loads(result.stderr.strip().splitlines()[-1])
+
+    def testHelpIsWithinTheStartupBudget(self):
+        self.RunCommand('--help')
+        samples = [self.RunCommand('--help')['ms'] for _ in range(TIMED_RUNS)]
+        self.assertLessEqual(statistics.median(samples), STARTUP_BUDGET_MS, f"startup samples (ms): {samples}")
+
+    def testShortCommandsDoNotImportHeavyModules(self):
+        for args in (['--help'], ['enqueue', '{"command":"true"}'], ['status'], ['list', '--limit', '1'],
+                     ['dlq', 'list'], ['config', 'set', 'max-retries', '3'], ['metrics'], ['worker', 'start', '--help']):
+            self.assertEqual(self.RunCommand(*args)['heavy'], [], ' '.join(args))
+
+
+class TinyDbStartupTests(StartupTests):
+    engine = 'tinydb'